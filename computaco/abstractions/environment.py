@@ -2,6 +2,8 @@ from logging import Logger
 from pathlib import Path
 
 import attr
+from computaco.abstractions.message_bus import MessageBus
+from computaco.abstractions.streaming import TextStream
 from computaco.agents.agent import Agent
 from computaco.tools.tool import Tool
 from computaco.utils.logging import make_logger
@@ -12,13 +14,34 @@ class Environment:
     path: Path = attr.ib()
     tools: list[Tool] = attr.ib()
     agents: list[Agent] = attr.ib()
+    bus: MessageBus
     _logger: Logger
 
-    def __init__(self, path, tools=[], agents=[]):
+    def __init__(self, path, tools=[], agents=[], bus: MessageBus = None):
+        self.path = Path(path)
+        self.tools = tools
+        # subclasses may derive `agents` (eg, from speakers and bystanders) instead
+        if not isinstance(getattr(type(self), "agents", None), property):
+            self.agents = agents
+        self.bus = bus or MessageBus()
         self._logger = make_logger(__name__, self.path / "log")
 
     def input_tool_output(
         self, tool: Tool, output: any, sender: Agent, recievers: list[Agent] = None
     ):
-        for reciever in recievers or self.env.agents:
-            reciever.input(output, sender=sender)
+        if isinstance(output, TextStream):
+            # published as soon as it starts, so recievers can consume it as it grows
+            output.add_done_callback(self._log_stream)
+        # queued per agent; `self.bus.delivery` decides when (and how batched) agents get it
+        self.bus.publish(
+            output, sender=sender, recievers=recievers or self.agents, source=tool
+        )
+
+    def _log_stream(self, stream: TextStream):
+        if stream.error is not None:
+            self._logger.warning(f"Stream from {stream.sender} failed: {stream.error}")
+        elif stream.ttft is not None:
+            self._logger.info(
+                f"Stream from {stream.sender}: first chunk after {stream.ttft:.3f}s, "
+                f"done after {stream.finished_at - stream.created:.3f}s"
+            )
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+import queue
+import threading
+from typing import Iterable, Literal
+
+import attr
+
+
+@attr.s
+class Envelope:
+    content: any = attr.ib()
+    sender: any = attr.ib()  # usually an Agent
+    source: any = attr.ib(default=None)  # the tool that produced `content`, if any
+
+
+class Inbox:
+    """Bounded, thread-safe queue of envelopes for one agent.
+
+    When full, `overflow` decides what happens to new envelopes: "block" makes the
+    publisher wait (backpressure), "drop_oldest" and "drop_newest" discard one. A
+    `put` with `block=False` drops the new envelope instead of waiting.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        overflow: Literal["block", "drop_oldest", "drop_newest"] = "block",
+    ):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.num_dropped = 0
+        self._envelopes = deque()
+        self._condition = threading.Condition()
+
+    def put(self, envelope: Envelope, timeout: float = None, block: bool = True):
+        with self._condition:
+            if self.maxsize and len(self._envelopes) >= self.maxsize:
+                if self.overflow == "drop_oldest":
+                    self._envelopes.popleft()
+                    self.num_dropped += 1
+                elif self.overflow == "drop_newest" or not block:
+                    self.num_dropped += 1
+                    return
+                elif not self._condition.wait_for(
+                    lambda: len(self._envelopes) < self.maxsize, timeout
+                ):
+                    raise queue.Full("Inbox.put: timed out waiting for the agent.")
+            self._envelopes.append(envelope)
+
+    def drain(self, max_items: int = None) -> list[Envelope]:
+        with self._condition:
+            if max_items is None or max_items >= len(self._envelopes):
+                envelopes = list(self._envelopes)
+                self._envelopes.clear()
+            else:
+                envelopes = [self._envelopes.popleft() for _ in range(max_items)]
+            self._condition.notify_all()  # wake publishers blocked on a full inbox
+            return envelopes
+
+    def __len__(self):
+        return len(self._envelopes)
+
+
+class Delivery:
+    """Decides when queued envelopes are handed to their agents."""
+
+    def notify(self, bus: MessageBus, agents: Iterable):
+        raise NotImplementedError()
+
+
+class ImmediateDelivery(Delivery):
+    """Delivers on the publisher's thread before `publish` returns."""
+
+    def notify(self, bus, agents):
+        for agent in agents:
+            bus.deliver(agent)
+
+
+class ManualDelivery(Delivery):
+    """Never delivers. Agents (or processes) call `bus.deliver`/`bus.drain` themselves."""
+
+    def notify(self, bus, agents):
+        pass
+
+
+class ThreadedDelivery(Delivery):
+    """Delivers on a pool of background threads, so publishing never waits on agents.
+
+    Envelopes published while an agent is busy accumulate in its inbox and arrive in
+    one batch. Each agent is only ever delivered to by one thread at a time.
+    """
+
+    def __init__(self, num_workers: int = 4):
+        self._pending = deque()
+        self._scheduled = set()  # agents that are pending or being delivered to
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def notify(self, bus, agents):
+        with self._condition:
+            for agent in agents:
+                if agent not in self._scheduled:
+                    self._scheduled.add(agent)
+                    self._pending.append((bus, agent))
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                bus, agent = self._pending.popleft()
+            try:
+                bus.deliver(agent)
+            finally:
+                with self._condition:
+                    self._scheduled.discard(agent)
+                    # envelopes may have arrived during delivery
+                    if len(bus.inbox(agent)):
+                        self._scheduled.add(agent)
+                        self._pending.append((bus, agent))
+                    self._condition.notify_all()
+
+    def join(self):
+        """Blocks until every published envelope has been delivered."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._scheduled)
+
+
+class AsyncioDelivery(Delivery):
+    """Delivers from tasks on an event loop; agent code runs in the loop's executor.
+
+    Must be created on (or given) the loop it should deliver from.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop or asyncio.get_running_loop()
+        self._tasks: dict[any, asyncio.Task] = {}
+
+    def notify(self, bus, agents):
+        for agent in agents:
+            self.loop.call_soon_threadsafe(self._schedule, bus, agent)
+
+    def _schedule(self, bus, agent):
+        if agent not in self._tasks:
+            self._tasks[agent] = self.loop.create_task(self._deliver(bus, agent))
+
+    async def _deliver(self, bus, agent):
+        try:
+            while len(bus.inbox(agent)):
+                await self.loop.run_in_executor(None, bus.deliver, agent)
+        finally:
+            del self._tasks[agent]
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values())
+
+
+class MessageBus:
+    """Queues messages into per-agent inboxes and hands them over in batches.
+
+    Agents that define `input_batch` get a whole inbox in one call; others get one
+    `input` call per message, as before. An agent that publishes to itself while its
+    messages are being delivered never blocks on its own full inbox (nobody else
+    would drain it); the message is dropped instead.
+    """
+
+    def __init__(
+        self,
+        delivery: Delivery = None,
+        inbox_size: int = 0,
+        overflow: Literal["block", "drop_oldest", "drop_newest"] = "block",
+    ):
+        self.delivery = delivery or ImmediateDelivery()
+        self.inbox_size = inbox_size
+        self.overflow = overflow
+        self._inboxes: dict[any, Inbox] = {}
+        self._inboxes_lock = threading.Lock()
+        self._local = threading.local()  # `delivering`: agents this thread delivers to
+
+    def inbox(self, agent) -> Inbox:
+        inbox = self._inboxes.get(agent)
+        if inbox is None:
+            with self._inboxes_lock:
+                inbox = self._inboxes.setdefault(
+                    agent, Inbox(maxsize=self.inbox_size, overflow=self.overflow)
+                )
+        return inbox
+
+    def publish(self, content, sender, recievers: Iterable, source=None):
+        recievers = list(recievers)
+        envelope = Envelope(content, sender, source)
+        delivering = getattr(self._local, "delivering", ())
+        for reciever in recievers:
+            self.inbox(reciever).put(envelope, block=reciever not in delivering)
+        self.delivery.notify(self, recievers)
+
+    def drain(self, agent, max_items: int = None) -> list[Envelope]:
+        return self.inbox(agent).drain(max_items)
+
+    def deliver(self, agent, max_items: int = None):
+        envelopes = self.drain(agent, max_items)
+        if not envelopes:
+            return
+        if not hasattr(self._local, "delivering"):
+            self._local.delivering = []  # a list, since deliveries can nest
+        self._local.delivering.append(agent)
+        try:
+            if hasattr(agent, "input_batch"):
+                agent.input_batch([(e.content, e.sender) for e in envelopes])
+            else:
+                for envelope in envelopes:
+                    agent.input(envelope.content, sender=envelope.sender)
+        finally:
+            self._local.delivering.remove(agent)
@@ -1,11 +1,64 @@
+from __future__ import annotations
+
+import atexit
+from concurrent.futures import Future
 from datetime import datetime
 import json
 from dataclasses import dataclass
+import os
 from pathlib import Path
+import threading
+import time
+from typing import Callable
+import weakref
 
+import attr
 from git import Repo
 import git
 
+from computaco.utils.artifact_store import ArtifactStore
+from computaco.utils.logging import make_logger
+
+_projects: weakref.WeakSet[Project] = weakref.WeakSet()
+
+
+def mark_dirty(path: str | Path):
+    """Tells the open projects containing `path` that it changed. Tools that write
+    files call this, so checkpoints only have to stage what they wrote."""
+    path = Path(path).absolute()
+    for project in list(_projects):
+        if path.is_relative_to(project.path.absolute()):
+            project.mark_dirty(path)
+
+
+@atexit.register
+def _close_projects():
+    # commits the checkpoints still waiting for their interval
+    for project in list(_projects):
+        project.close()
+
+
+@attr.s
+class CheckpointStats:
+    requested: int = attr.ib(default=0)
+    checkpoints: int = attr.ib(default=0)  # batches of requests
+    commits: int = attr.ib(default=0)  # batches that changed something
+    files_staged: int = attr.ib(default=0)
+    # seconds from the first request a commit covers until it's done
+    last_latency: float = attr.ib(default=0.0)
+    max_latency: float = attr.ib(default=0.0)
+    total_latency: float = attr.ib(default=0.0)
+    commit_seconds: float = attr.ib(default=0.0)  # spent staging and committing
+
+    @property
+    def coalesced(self) -> int:
+        """Requests that were batched with an earlier one."""
+        return self.requested - self.checkpoints
+
+    @property
+    def mean_latency(self) -> float | None:
+        return self.total_latency / self.checkpoints if self.checkpoints else None
+
 
 class Project:
 
@@ -17,8 +70,28 @@ class Project:
     conversations = {}  # {task: <conversations>}
     files = {}  # {group: <files>}
 
-    def __init__(self, path):
+    # the attributes saved to (and loaded from) project.json
+    FIELDS = ("name", "summary", "conversations", "files")
+    # checkpoints requested within this many seconds are committed together
+    DEFAULT_CHECKPOINT_INTERVAL = 5.0
+
+    def __init__(self, path, checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL):
         self.path = Path(path)
+        self.conversations = {}
+        self.files = {}
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_stats = CheckpointStats()
+        self._dirty: set[Path] = set()
+        self._requested = 0  # checkpoints requested so far
+        self._committed = 0  # of those, how many are committed
+        self._requested_at: float = None  # first request since the last commit
+        self._last_commit = 0.0
+        self._messages: list[str] = []
+        self._batch = Future()  # resolved once the pending requests are committed
+        self._urgent = False
+        self._closing = False
+        self._condition = threading.Condition()
+        self._checkpointer: threading.Thread = None
         # open git repository if it exists
         try:
             self.repo = Repo(self.path)
@@ -28,29 +101,192 @@ class Project:
         # create .computacode directory if it doesn't exist
         if not (self.path / ".computacode").exists():
             (self.path / ".computacode").mkdir()
-            self.checkpoint()
+            # first checkpoint: everything that's already there
+            self._dirty.add(self.path.absolute())
         if (self.path / ".computacode" / "project.json").exists():
             with open(self.path / ".computacode" / "project.json") as f:
-                self.__dict__.update(json.load(f))
+                fields = json.load(f)
+            self.__dict__.update({k: v for k, v in fields.items() if k in self.FIELDS})
+        self._logger = make_logger(__name__, self.path / ".computacode" / "log")
+        self.artifacts = ArtifactStore(self.path / ".computacode" / "artifacts")
+        _projects.add(self)
+        if self._dirty:
+            self.checkpoint()
 
     @property
     def all_files(self):
         return [file for group in self.files.values() for file in group]
 
-    def checkpoint(self, message=None):
-        # save snapshot of self to json
-        with open(self.path / ".computacode" / "project.json", "w") as f:
-            json.dump(self.__dict__, f, indent=4)
-        # git add all changes
-        self.repo.index.add(["."])
-        # git commit all changes
-        if message is None:
+    def mark_dirty(self, *paths: str | Path):
+        """Adds `paths` to the next checkpoint."""
+        with self._condition:
+            self._dirty.update(Path(path).absolute() for path in paths)
+
+    def write(self, path: str | Path, text: str):
+        """Writes `text` to `path` and marks it dirty."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        self.mark_dirty(path)
+
+    def artifact(
+        self,
+        path: str | Path,
+        make: Callable[[], any],
+        group: str = "artifacts",
+        **inputs,
+    ):
+        """Returns `make()` and writes it to `path` (as json, unless it's a str).
+
+        The result is kept in `artifacts`, keyed by `path` and `inputs` (eg, the
+        prompt, upstream artifacts and agents), so once it's made, later calls with
+        the same inputs read it back instead of calling `make`. Either way `path`
+        is written, marked dirty, and listed in `files[group]`."""
+        path = Path(path)
+        name = os.path.relpath(path.absolute(), self.path.absolute())
+        key = self.artifacts.key(name, **inputs)
+        data = self.artifacts.get(key)
+        if data is None:
+            result = make()
+            self.artifacts.put(key, name, json.dumps(result).encode())
+        else:
+            result = json.loads(data)
+        self.write(path, result if isinstance(result, str) else json.dumps(result))
+        with self._condition:
+            files = self.files.setdefault(group, [])
+            if name not in files:
+                files.append(name)
+        return result
+
+    def checkpoint(self, message=None, wait=False):
+        """Commits the project fields and the files marked dirty since the last commit.
+
+        Commits happen on a background thread, at most once per
+        `checkpoint_interval`; requests made in between share one commit (and their
+        messages). With `wait`, commits right away and returns once it's done, or
+        raises the error that made it fail."""
+        with self._condition:
+            if self._checkpointer is None:
+                self._checkpointer = threading.Thread(
+                    target=self._checkpoint_loop, daemon=True
+                )
+                self._checkpointer.start()
+            self._requested += 1
+            self.checkpoint_stats.requested += 1
+            if self._requested_at is None:
+                self._requested_at = time.monotonic()
+            if message is not None:
+                self._messages.append(message)
+            self._urgent |= wait
+            batch = self._batch
+            self._condition.notify_all()
+        if wait:
+            batch.result()
+
+    def flush(self):
+        """Commits pending checkpoints now."""
+        with self._condition:
+            pending = self._committed < self._requested
+        if pending:
+            self.checkpoint(wait=True)
+
+    def close(self):
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+            self._checkpointer = None
+        self.artifacts.close()
+        _projects.discard(self)
+
+    def _checkpoint_loop(self):
+        while True:
+            with self._condition:
+                while self._committed == self._requested and not self._closing:
+                    self._condition.wait()
+                if self._committed == self._requested:
+                    return  # closing, and nothing left to commit
+                delay = self._last_commit + self.checkpoint_interval - time.monotonic()
+                if delay > 0 and not (self._urgent or self._closing):
+                    self._condition.wait(delay)
+                    continue
+                target, requested_at = self._requested, self._requested_at
+                messages, self._messages = self._messages, []
+                paths, self._dirty = self._dirty, set()
+                self._requested_at, self._urgent = None, False
+                batch, self._batch = self._batch, Future()
+            error = None
+            try:
+                self._commit(paths, messages)
+            except Exception as e:
+                self._logger.exception("Checkpoint failed.")
+                error = e
+                with self._condition:
+                    self._dirty |= paths  # retried with the next checkpoint
+            with self._condition:
+                self._last_commit = time.monotonic()
+                self._committed = target
+                stats = self.checkpoint_stats
+                latency = self._last_commit - requested_at
+                stats.checkpoints += 1
+                stats.last_latency = latency
+                stats.max_latency = max(stats.max_latency, latency)
+                stats.total_latency += latency
+                self._condition.notify_all()
+            # callers waiting on this batch get its error
+            if error is None:
+                batch.set_result(None)
+            else:
+                batch.set_exception(error)
+
+    def _commit(self, paths: set[Path], messages: list[str]):
+        start = time.monotonic()
+        # save snapshot of the declared fields to json
+        project_json = self.path / ".computacode" / "project.json"
+        with open(project_json, "w") as f:
+            json.dump(
+                {k: getattr(self, k) for k in self.FIELDS if hasattr(self, k)},
+                f,
+                indent=4,
+                default=str,
+            )
+        paths = {*paths, project_json.absolute()}
+        # git add only what changed (`self.path` itself: everything), including
+        # deletions. The git command, not `repo.index.add`, which changes the working
+        # directory of the whole process
+        root = self.path.absolute()
+        index = self.repo.index
+        staged = [
+            os.path.relpath(p, root)
+            for p in paths
+            if p.is_relative_to(root)
+            and (p.exists() or (os.path.relpath(p, root), 0) in index.entries)
+        ]
+        # naming an ignored path fails the whole `git add`
+        ignored = set(self.repo.ignored(*staged)) if staged else set()
+        staged = [path for path in staged if path not in ignored]
+        if staged:
+            self.repo.git.add("-A", "--", *staged)
+        # git commit, unless nothing changed
+        if self.repo.head.is_valid() and not self.repo.is_dirty(
+            index=True, working_tree=False
+        ):
+            return
+        if messages:
+            message = "\n".join(messages)
+        else:
             # message: "checkpoint-<branch>-<num_heads>-<YYYY>-<MM>-<DD>-<HH>-<MM>-<SS.ffffff>"
             message = (
                 f"checkpoint-{self.repo.active_branch.name}-"
                 f"{len(self.repo.heads)}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S.%f')}"
             )
         self.repo.index.commit(message)
+        with self._condition:
+            self.checkpoint_stats.commits += 1
+            self.checkpoint_stats.files_staged += len(staged)
+            self.checkpoint_stats.commit_seconds += time.monotonic() - start
 
     def __repr__(self):
         return self.name
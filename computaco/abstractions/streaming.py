@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+
+
+class TextStream:
+    """Text that is still being generated, delivered a chunk at a time.
+
+    The producer calls `put` for each chunk and `close` when done (from any thread).
+    Any number of consumers can read it, each from the first chunk, either with
+    `for chunk in stream` or `async for chunk in stream`, or wait for the whole text
+    with `result`/`aresult`. `ttft` is the time from creating the stream (ie, making
+    the request) to its first chunk.
+
+    >>> stream = TextStream.from_iterable(engine.stream(prompt), sender=agent)
+    >>> async for chunk in stream:
+    ...     render(chunk)
+    >>> stream.ttft
+    0.21
+    """
+
+    def __init__(self, sender=None):
+        self.sender = sender  # usually the Agent producing the text
+        self.created = time.monotonic()
+        self.first_chunk_at: float = None
+        self.finished_at: float = None
+        self.error: BaseException = None
+        self._chunks: list[str] = []
+        self._done = False
+        self._condition = threading.Condition()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._callbacks: list[Callable[[TextStream], None]] = []
+        self._task: asyncio.Task = None  # set by `from_async_iterable`
+
+    @classmethod
+    def from_iterable(cls, chunks: Iterable[str], sender=None) -> TextStream:
+        """Pumps a (blocking) iterable of chunks into a new stream on a thread."""
+        stream = cls(sender=sender)
+
+        def pump():
+            try:
+                for chunk in chunks:
+                    stream.put(chunk)
+            except BaseException as e:
+                stream.close(error=e)
+            else:
+                stream.close()
+
+        threading.Thread(target=pump, daemon=True).start()
+        return stream
+
+    @classmethod
+    def from_async_iterable(cls, chunks: AsyncIterable[str], sender=None) -> TextStream:
+        """Pumps an async iterable of chunks into a new stream from a task on the
+        running loop."""
+        stream = cls(sender=sender)
+
+        async def pump():
+            try:
+                async for chunk in chunks:
+                    stream.put(chunk)
+            except BaseException as e:
+                stream.close(error=e)
+            else:
+                stream.close()
+
+        stream._task = asyncio.get_running_loop().create_task(pump())
+        return stream
+
+    @property
+    def ttft(self) -> float | None:
+        """Seconds to the first chunk, or None if there hasn't been one yet."""
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.created
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def text(self) -> str:
+        """The text so far."""
+        return "".join(self._chunks)
+
+    def put(self, chunk: str):
+        if not chunk:
+            return
+        with self._condition:
+            assert not self._done, "TextStream.put: the stream is closed."
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.monotonic()
+            self._chunks.append(chunk)
+            self._wake()
+
+    def close(self, error: BaseException = None):
+        with self._condition:
+            if self._done:
+                return
+            self._done = True
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._wake()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def _wake(self):
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def add_done_callback(self, callback: Callable[[TextStream], None]):
+        """Calls `callback(stream)` once the stream closes (right away if it has)."""
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def __iter__(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: index < len(self._chunks) or self._done)
+                chunks = self._chunks[index:]
+                done = self._done
+            yield from chunks
+            index += len(chunks)
+            if done and index == len(self._chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            event = None
+            with self._condition:
+                chunks = self._chunks[index:]
+                done = self._done
+                if not chunks and not done:
+                    event = asyncio.Event()
+                    self._waiters.append((loop, event))
+            if event is not None:
+                await event.wait()
+                continue
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index == len(self._chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    def result(self, timeout: float = None) -> str:
+        """Blocks until the stream closes and returns the whole text."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._done, timeout):
+                raise TimeoutError("TextStream.result: the stream is still open.")
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    async def aresult(self) -> str:
+        async for _ in self:
+            pass
+        return self.text
+
+    def __repr__(self):
+        state = "done" if self._done else "streaming"
+        return f"TextStream({self.sender}, {state}, {self.text!r})"
@@ -1,23 +1,86 @@
+from __future__ import annotations
+
+import copy
+
 from computaco.agents.agent import Agent
+from computaco.agents.memory import ContextMemory
+from computaco.agents.prompt_cache import PromptCache, PromptPrefix
 from computils.engines.base import CompletionEngine, ConversationEngine
 
 from computaco.utils import registry
+from computaco.utils.rate_limit import Priority, priority
+from computaco.utils.router import CallKind, call_kind
 import langchain.agents
 
 
 class LangChainAgent(Agent):
 
     engine: ConversationEngine | CompletionEngine
+    memory: ContextMemory
     _agent: langchain.Agent
 
-    DEFAULT_ENGINE = registry.small_chat_engine
+    DEFAULT_ENGINE = registry.router
     DEFAULT_SYSTEM_PROMPT = "You are {name}."
+    DEFAULT_TOKEN_BUDGET = 3000
+    # shared by all agents; each agent's prompt is extended, not rebuilt, every turn
+    DEFAULT_PROMPT_CACHE = PromptCache()
 
-    def __init__(self, name, initial_message=None, engine=None):
+    def __init__(self, name, initial_message=None, engine=None, token_budget=None):
         super().__init__(name=name)
+        self.engine = engine or self.DEFAULT_ENGINE
+        self.system_prompt = initial_message or self.DEFAULT_SYSTEM_PROMPT.format(
+            name=name
+        )
+        self.prompt_cache = self.DEFAULT_PROMPT_CACHE
+        # what the agent has been told, bounded to `token_budget` tokens of prompt
+        budget = token_budget or self.DEFAULT_TOKEN_BUDGET
+        self.memory = ContextMemory(
+            summarize=self._summarize, token_budget=budget, window_tokens=budget // 2
+        )
+
+    def fork(self) -> LangChainAgent:
+        """A copy of the agent for work done alongside its other work (eg, in a
+        conversation branch). It remembers what the agent does now; what it hears
+        afterwards stays with the copy."""
+        view = copy.copy(self)
+        view.memory = self.memory.fork()
+        return view
+
+    def fingerprint(self) -> dict:
+        """What decides the agent's output, for `ArtifactStore` keys."""
+        return {
+            "class": type(self).__name__,
+            "name": self.name,
+            "system_prompt": self.system_prompt,
+            "engine": getattr(self.engine, "model_name", type(self.engine).__name__),
+        }
+
+    def _summarize(self, text: str) -> str:
+        with priority(Priority.BACKGROUND), call_kind(CallKind.SUMMARY):
+            return self.engine(f"{text}\n\nSummarize the above in a few sentences.")
+
+    def prompt(self) -> PromptPrefix:
+        """The system prompt and what the agent remembers, rendered and tokenized.
+
+        Only the messages (or summaries) that changed since the last call are
+        rendered; the rest of the prefix, and its `key`, stay the same."""
+        return self.prompt_cache.build(
+            self, self.system_prompt, self.memory.context_parts()
+        )
+
+    def complete(self, instruction: str, **kwargs) -> str:
+        """Calls the engine on `prompt()` followed by `instruction`. Engines that take
+        a `prefix` get the prompt's key, so the unchanged start of the prompt isn't
+        processed again."""
+        prefix = self.prompt()
+        text, key = prefix.text, prefix.key
+        if getattr(self.engine, "accepts_prefix", False):
+            kwargs["prefix"] = (key, len(text))
+        return self.engine(text + instruction, **kwargs)
 
     def talk(self, remember=True, **kwargs) -> str:
         raise NotImplementedError
 
     def tell(self, text, *args, sender="Info", remember=True, **kwargs):
-        raise NotImplementedError
+        if remember:
+            self.memory.add(str(text), sender=sender)
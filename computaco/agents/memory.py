@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import threading
+from typing import Callable
+
+import attr
+
+_logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    # ~4 characters per token; close enough for budgeting
+    return len(text) // 4 + 1
+
+
+@attr.s(slots=True)
+class _Segment:
+    level: int = attr.ib()  # 0: a message, n > 0: a summary of level n-1 segments
+    text: str = attr.ib()
+    tokens: int = attr.ib()
+    source_tokens: int = attr.ib()  # of the messages it stands for
+    summarizing: bool = attr.ib(default=False)
+
+
+@attr.s
+class MemoryStats:
+    messages: int = attr.ib(default=0)
+    summaries: int = attr.ib(default=0)
+    failed_summaries: int = attr.ib(default=0)
+    history_tokens: int = attr.ib(default=0)  # every message ever added
+    context_tokens: int = attr.ib(default=0)  # the last `context()`
+    # tokens summaries in the last `context()` save over the messages they stand for
+    # (history dropped for lack of room doesn't count)
+    last_saved: int = attr.ib(default=0)
+    tokens_saved: int = attr.ib(default=0)  # summed over every `context()` call
+
+
+class ContextMemory:
+    """Bounded context for one agent.
+
+    The newest messages are kept verbatim in a sliding window of up to
+    `window_tokens`. Messages that slide out are summarized on a background thread,
+    `chunk_size` at a time. Every `fanout` summaries of one level are summarized
+    again into one summary of the next level, so old history shrinks geometrically.
+    `context()` returns as much of the summaries and window as fits in
+    `token_budget`, and records how many tokens the summaries saved.
+
+    The context only grows at its end between two kinds of changes: a summary
+    replacing its messages, and trimming. Once the context outgrows `token_budget`,
+    its oldest parts are dropped until `trim_tokens` are free (not one per message),
+    so a rendered prefix of it (see `PromptCache`) stays valid until then.
+
+    >>> memory = ContextMemory(summarize=lambda text: engine(f"{text}\\n\\nSummarize."))
+    >>> memory.add("Let's build a todo app.", sender="Client")
+    >>> prompt = memory.context() + "\\nEngineer:"
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str], str],
+        token_budget: int = 3000,
+        window_tokens: int = 1500,
+        chunk_size: int = 8,
+        fanout: int = 4,
+        count_tokens: Callable[[str], int] = count_tokens,
+        trim_tokens: int = None,
+    ):
+        assert window_tokens <= token_budget, "ContextMemory: window exceeds budget."
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.window_tokens = window_tokens
+        self.chunk_size = chunk_size
+        self.fanout = fanout
+        self.count_tokens = count_tokens
+        self.trim_tokens = window_tokens // 2 if trim_tokens is None else trim_tokens
+        self.stats = MemoryStats()
+        self._window: deque[_Segment] = deque()
+        self._window_size = 0
+        self._segments: list[_Segment] = []  # older history, oldest first
+        self._first: _Segment = None  # oldest segment in the context
+        self._jobs: list[Future] = []
+        self._lock = threading.RLock()
+        # one worker, so summaries finish in the order they were started
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def add(self, text: str, sender=None):
+        if sender is not None:
+            text = f"{sender}: {text}"
+        tokens = self.count_tokens(text)
+        message = _Segment(0, text, tokens, tokens)
+        with self._lock:
+            self.stats.messages += 1
+            self.stats.history_tokens += message.tokens
+            self._window.append(message)
+            self._window_size += message.tokens
+            while self._window_size > self.window_tokens and len(self._window) > 1:
+                evicted = self._window.popleft()
+                self._window_size -= evicted.tokens
+                self._segments.append(evicted)
+            self._schedule()
+
+    def _schedule(self):
+        """Starts summarizing every run of enough adjacent, finished segments of one
+        level. Only adjacent ones, so each summary takes the place of its run."""
+        run: list[_Segment] = []
+        for segment in [*self._segments, None]:
+            if (
+                segment is not None
+                and not segment.summarizing
+                and (not run or segment.level == run[0].level)
+            ):
+                run.append(segment)
+                continue
+            size = self.chunk_size if run and run[0].level == 0 else self.fanout
+            for start in range(0, len(run) - size + 1, size):
+                group = run[start : start + size]
+                for member in group:
+                    member.summarizing = True
+                self._jobs.append(self._executor.submit(self._summarize, group))
+            run = [] if segment is None or segment.summarizing else [segment]
+
+    def _summarize(self, group: list[_Segment]):
+        try:
+            text = self.summarize("\n".join(segment.text for segment in group))
+        except Exception:
+            # kept verbatim, and tried again the next time a message is added; `flush`
+            # raises the error
+            _logger.exception("ContextMemory: summarizing failed.")
+            with self._lock:
+                for segment in group:
+                    segment.summarizing = False
+                self.stats.failed_summaries += 1
+            raise
+        summary = _Segment(
+            group[0].level + 1,
+            text,
+            self.count_tokens(text),
+            sum(segment.source_tokens for segment in group),
+        )
+        with self._lock:
+            members = {id(segment) for segment in group}
+            index = next(i for i, s in enumerate(self._segments) if id(s) in members)
+            self._segments[index:] = [
+                summary,
+                *(s for s in self._segments[index:] if id(s) not in members),
+            ]
+            if any(segment is self._first for segment in group):
+                self._first = summary
+            self.stats.summaries += 1
+            self._schedule()
+
+    def context(self, token_budget: int = None) -> str:
+        """The summaries and recent messages that fit in `token_budget`, in order.
+
+        Segments still being summarized are included verbatim until their summary is
+        ready. Whatever doesn't fit is dropped from the oldest end."""
+        return "\n".join(self.context_parts(token_budget))
+
+    def context_parts(self, token_budget: int = None) -> list[str]:
+        """Like `context`, but one string per summary or message. With a
+        `token_budget` other than the memory's own, the newest parts that fit are
+        returned, without trimming the context."""
+        with self._lock:
+            segments = [*self._segments, *self._window]
+            if token_budget is None or token_budget == self.token_budget:
+                parts = self._trim(segments)
+            else:
+                parts, used = [], 0
+                for segment in reversed(segments):
+                    if used + segment.tokens > token_budget:
+                        break
+                    parts.append(segment)
+                    used += segment.tokens
+                parts.reverse()
+            used = sum(segment.tokens for segment in parts)
+            self.stats.context_tokens = used
+            self.stats.last_saved = sum(s.source_tokens - s.tokens for s in parts)
+            self.stats.tokens_saved += self.stats.last_saved
+        return [
+            f"[Summary] {segment.text}" if segment.level else segment.text
+            for segment in parts
+        ]
+
+    def _trim(self, segments: list[_Segment]) -> list[_Segment]:
+        start = next((i for i, s in enumerate(segments) if s is self._first), 0)
+        used = sum(segment.tokens for segment in segments[start:])
+        if used > self.token_budget:
+            target = self.token_budget - self.trim_tokens
+            while start < len(segments) - 1 and used > target:
+                used -= segments[start].tokens
+                start += 1
+            if used > self.token_budget:
+                start = len(segments)  # the newest message alone doesn't fit
+        self._first = segments[start] if start < len(segments) else None
+        return segments[start:]
+
+    def fork(self) -> ContextMemory:
+        """An independent copy, that remembers what this memory does now."""
+        memory = ContextMemory(
+            self.summarize,
+            token_budget=self.token_budget,
+            window_tokens=self.window_tokens,
+            chunk_size=self.chunk_size,
+            fanout=self.fanout,
+            count_tokens=self.count_tokens,
+            trim_tokens=self.trim_tokens,
+        )
+        with self._lock:
+            # summaries in progress here finish here; the copy makes its own
+            copies = {
+                id(s): attr.evolve(s, summarizing=False)
+                for s in [*self._segments, *self._window]
+            }
+            memory._segments = [copies[id(s)] for s in self._segments]
+            memory._window = deque(copies[id(s)] for s in self._window)
+            memory._window_size = self._window_size
+            if self._first is not None:
+                memory._first = copies[id(self._first)]
+            memory.stats = attr.evolve(self.stats)
+        return memory
+
+    def flush(self):
+        """Waits for the summaries in progress (and any they trigger), then raises
+        the first error any of them failed with."""
+        error = None
+        while True:
+            with self._lock:
+                jobs, self._jobs = self._jobs, []
+            if not jobs:
+                break
+            for job in jobs:
+                error = error or job.exception()
+        if error is not None:
+            raise error
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+from typing import Callable, Sequence
+
+import attr
+
+from computaco.agents.memory import count_tokens
+
+
+class PromptPrefix:
+    """A rendered and tokenized prompt that is extended in place as parts are added.
+
+    Parts are the system prompt followed by one part per message. `key` is a rolling
+    hash of the parts, so two prompts share a key exactly when they share every
+    part; pass it to backends that cache prompt prefixes. `tokens` holds token ids
+    if a `tokenize` function is given (tokenized part by part, so end parts on a
+    newline to keep that identical to tokenizing the whole), else it is empty and
+    only `num_tokens` is estimated.
+    """
+
+    def __init__(self, tokenize: Callable[[str], list[int]] = None):
+        self.tokenize = tokenize
+        self.text = ""
+        self.tokens: list[int] = []
+        self.num_tokens = 0
+        self._parts: list[str] = []
+        self._digests: list[bytes] = []
+        self._text_ends: list[int] = []
+        self._token_ends: list[int] = []
+
+    def __len__(self):
+        return len(self._parts)
+
+    @property
+    def key(self) -> str:
+        return self._digests[-1].hex() if self._digests else ""
+
+    def truncate(self, num_parts: int):
+        if num_parts >= len(self._parts):
+            return
+        del self._parts[num_parts:], self._digests[num_parts:]
+        del self._text_ends[num_parts:], self._token_ends[num_parts:]
+        self.text = self.text[: self._text_ends[-1]] if num_parts else ""
+        self.num_tokens = self._token_ends[-1] if num_parts else 0
+        del self.tokens[self.num_tokens :]
+
+    def append(self, part: str) -> int:
+        """Adds `part` and returns its number of tokens."""
+        previous = self._digests[-1] if self._digests else b""
+        self._digests.append(hashlib.sha256(previous + part.encode()).digest())
+        self._parts.append(part)
+        self.text += part
+        self._text_ends.append(len(self.text))
+        if self.tokenize is not None:
+            tokens = self.tokenize(part)
+            self.tokens.extend(tokens)
+            num_tokens = len(tokens)
+        else:
+            num_tokens = count_tokens(part)
+        self.num_tokens += num_tokens
+        self._token_ends.append(self.num_tokens)
+        return num_tokens
+
+
+@attr.s
+class PromptCacheStats:
+    builds: int = attr.ib(default=0)
+    parts_reused: int = attr.ib(default=0)
+    parts_rendered: int = attr.ib(default=0)
+    # input tokens a prefix-caching backend doesn't have to process again
+    tokens_reused: int = attr.ib(default=0)
+    tokens_rendered: int = attr.ib(default=0)
+    build_seconds: float = attr.ib(default=0.0)
+
+
+class PromptCache:
+    """Memoized prompt assembly, one growing `PromptPrefix` per owner (eg, agent).
+
+    `build` reuses the longest run of leading parts that is unchanged since the
+    owner's last build, and only renders and tokenizes the rest. Appending a message
+    to a transcript therefore costs one message, not the whole transcript. Prefixes
+    of the `max_prefixes` least recently built owners are dropped.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str], str] = lambda message: f"{message}\n",
+        tokenize: Callable[[str], list[int]] = None,
+        max_prefixes: int = 256,
+    ):
+        self.render = render
+        self.tokenize = tokenize
+        self.max_prefixes = max_prefixes
+        self.stats = PromptCacheStats()
+        self._prefixes: OrderedDict[any, tuple[list[str], PromptPrefix]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def build(self, owner, system_prompt: str, messages: Sequence[str]) -> PromptPrefix:
+        start = time.perf_counter()
+        with self._lock:
+            sources, prefix = self._prefixes.pop(owner, ([], None))
+            if prefix is None:
+                prefix = PromptPrefix(self.tokenize)
+            self._prefixes[owner] = (sources, prefix)
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+
+            # compare the unrendered sources, so unchanged messages aren't re-rendered
+            new_sources = [system_prompt, *messages]
+            reused = 0
+            for mine, theirs in zip(sources, new_sources):
+                if mine is not theirs and mine != theirs:
+                    break
+                reused += 1
+            prefix.truncate(reused)
+            del sources[reused:]
+            tokens_reused = prefix.num_tokens
+            for source in new_sources[reused:]:
+                prefix.append(f"{source}\n" if not sources else self.render(source))
+                sources.append(source)
+
+            self.stats.builds += 1
+            self.stats.parts_reused += reused
+            self.stats.parts_rendered += len(new_sources) - reused
+            self.stats.tokens_reused += tokens_reused
+            self.stats.tokens_rendered += prefix.num_tokens - tokens_reused
+            self.stats.build_seconds += time.perf_counter() - start
+        return prefix
+
+    def forget(self, owner):
+        with self._lock:
+            self._prefixes.pop(owner, None)
@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection
+import pickle
+import threading
+from typing import Callable
+import zlib
+
+from computaco.agents.agent import Agent
+from computaco.organizations.company import Company
+from computaco.organizations.enterprise import Enterprise
+from computaco.organizations.organization import Organization
+
+MAIN = "main"  # node name of the process that owns the `Cluster`
+
+
+class RemoteError(Exception):
+    """Raised by a remote call whose exception couldn't be sent back as-is."""
+
+
+def encode(destination: str, message: tuple) -> bytes:
+    """Frames a message for the wire: the destination node, a newline, then the
+    message pickled, and zlib-compressed when that helps. The broker routes on the
+    destination alone and only unpickles to bounce a frame it can't deliver.
+
+    Everything in `message` is pickled by value: callers replace local agents by
+    `AgentRef`s first (see `_Runtime._export`), so they're never copied."""
+    data, flag = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL), b"p"
+    if len(data) >= 1024:
+        compressed = zlib.compress(data, 1)
+        if len(compressed) < len(data):
+            data, flag = compressed, b"z"
+    return destination.encode() + b"\n" + flag + data
+
+
+def destination(frame: bytes) -> str:
+    return frame[: frame.index(b"\n")].decode()
+
+
+def decode(frame: bytes) -> tuple:
+    start = frame.index(b"\n") + 1
+    flag, data = frame[start : start + 1], frame[start + 1 :]
+    return pickle.loads(zlib.decompress(data) if flag == b"z" else data)
+
+
+class AgentRef:
+    """Location-transparent handle to an agent living on some node.
+
+    Method calls (and calling the ref itself) are forwarded to the agent and block
+    until it answers; on the agent's own node they are plain calls. Refs can be
+    passed around freely, including inside messages to other nodes.
+    """
+
+    __slots__ = ("node", "id", "name")
+
+    def __init__(self, node: str, id: int, name: str):
+        self.node = node
+        self.id = id
+        self.name = name
+
+    def call(self, method: str, *args, **kwargs):
+        return _runtime().call(self, method, args, kwargs)
+
+    def __call__(self, *args, **kwargs):
+        return self.call("__call__", *args, **kwargs)
+
+    def __getattr__(self, method: str):
+        if method.startswith("__"):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self.call(method, *args, **kwargs)
+
+    def __reduce__(self):
+        return AgentRef, (self.node, self.id, self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, AgentRef) and (self.node, self.id) == (
+            other.node,
+            other.id,
+        )
+
+    def __hash__(self):
+        return hash((self.node, self.id))
+
+    def __repr__(self):
+        return f"{self.name}@{self.node}"
+
+
+class _Runtime:
+    """Per-process end of the broker: sends requests, serves calls to local agents."""
+
+    def __init__(self, node: str, connection: Connection, max_workers: int = 16):
+        self.node = node
+        self.connection = connection
+        self.agents: dict[int, Agent] = {}
+        self.organizations: dict[str, Organization] = {}
+        self._ids = itertools.count()  # message ids
+        self._agent_ids: dict[int, int] = {}  # id(agent) -> agent id
+        self._pending: dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._agent_counter = itertools.count()
+        self._agent_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def ref(self, agent: Agent) -> AgentRef:
+        with self._agent_lock:
+            agent_id = self._agent_ids.get(id(agent))
+            if agent_id is None:
+                agent_id = self._agent_ids[id(agent)] = next(self._agent_counter)
+                self.agents[agent_id] = agent
+        return AgentRef(self.node, agent_id, getattr(agent, "name", repr(agent)))
+
+    def send(self, destination: str, kind: str, message_id: int, body):
+        data = encode(destination, (self.node, kind, message_id, body))
+        with self._send_lock:
+            self.connection.send_bytes(data)
+
+    def request(self, destination: str, kind: str, body) -> any:
+        future = Future()
+        message_id = next(self._ids)
+        self._pending[message_id] = future
+        self.send(destination, kind, message_id, body)
+        return future.result()
+
+    def call(self, ref: AgentRef, method: str, args: tuple, kwargs: dict):
+        if ref.node == self.node:
+            return getattr(self.agents[ref.id], method)(*args, **kwargs)
+        return self.request(
+            ref.node, "call", (ref.id, method, self._export(args), self._export(kwargs))
+        )
+
+    def receive(self):
+        """Serves incoming messages until the broker says stop or goes away."""
+        while True:
+            try:
+                data = self.connection.recv_bytes()
+            except (EOFError, OSError):
+                break
+            source, kind, message_id, body = decode(data)
+            if kind in ("result", "error"):
+                future = self._pending.pop(message_id)
+                if kind == "result":
+                    future.set_result(body)
+                else:
+                    future.set_exception(body)
+            elif kind == "stop":
+                break
+            else:
+                self._executor.submit(self._serve, source, kind, message_id, body)
+        for future in self._pending.values():
+            future.set_exception(RemoteError(f"{self.node}: broker connection closed"))
+
+    def _serve(self, source: str, kind: str, message_id: int, body):
+        try:
+            if kind == "call":
+                agent_id, method, args, kwargs = body
+                result = getattr(self.agents[agent_id], method)(*args, **kwargs)
+            elif kind == "host":
+                name, organization = body
+                if callable(organization) and not isinstance(organization, Agent):
+                    organization = organization()
+                self.organizations[name] = organization
+                result = self._describe(organization)
+            elif kind == "run":
+                name, fn, args, kwargs = body
+                result = fn(self.organizations[name], *args, **kwargs)
+            else:
+                raise ValueError(f"unknown message kind {kind}")
+            result = self._export(result)
+            kind = "result"
+        except Exception as e:
+            result, kind = e, "error"
+        try:
+            self.send(source, kind, message_id, result)
+        except Exception as e:  # eg, an unpicklable result or exception
+            self.send(source, "error", message_id, RemoteError(repr(e)))
+
+    def _export(self, value):
+        """Replaces local agents in `value` by refs, so they're never sent by value."""
+        if isinstance(value, Agent):
+            return self.ref(value)
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._export(v) for v in value)
+        if isinstance(value, dict):
+            return {k: self._export(v) for k, v in value.items()}
+        return value
+
+    def _describe(self, organization: Organization) -> dict:
+        members = {}
+        for attribute, value in vars(organization).items():
+            if isinstance(value, Agent) or (
+                isinstance(value, list) and value and isinstance(value[0], Agent)
+            ):
+                members[attribute] = self._export(value)
+        return members
+
+
+_process_runtime: _Runtime = None
+
+
+def _runtime() -> _Runtime:
+    runtime = _process_runtime
+    if runtime is None:
+        raise RuntimeError("AgentRef: no Cluster is running in this process.")
+    return runtime
+
+
+def _node_main(node: str, connection: Connection):
+    global _process_runtime
+    # set before the first message arrives, and receive on this thread
+    _process_runtime = _Runtime(node, connection)
+    _process_runtime.receive()
+
+
+class RemoteOrganization:
+    """An organization hosted on another node. Its agent members (eg, `manager`,
+    `workers`) are `AgentRef`s; `run` executes a function next to it."""
+
+    def __init__(self, cluster: Cluster, node: str, members: dict):
+        self.cluster = cluster
+        self.node = node
+        self.__dict__.update(members)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Returns `fn(organization, *args, **kwargs)`, called on the node. `fn` must
+        be picklable (eg, a module-level function such as a process). Agents in
+        `args` and `kwargs` stay here and are passed as `AgentRef`s."""
+        runtime = self.cluster._runtime
+        return runtime.request(
+            self.node,
+            "run",
+            (self.node, fn, runtime._export(args), runtime._export(kwargs)),
+        )
+
+    def __repr__(self):
+        return f"RemoteOrganization({self.node})"
+
+
+class Cluster:
+    """Runs organizations in worker processes connected by a local message broker.
+
+    The broker stands in for a cluster transport: every node (the worker processes
+    and this one, `main`) has one duplex pipe to it, and it forwards each frame to
+    the node it is addressed to. Frames are built by `encode`. Agents stay on the
+    node that hosts them; other nodes reach them through `AgentRef`s.
+
+    Nodes are started with `spawn` by default, since this process already runs
+    threads (the broker's, at least) and forking it can deadlock the child. With
+    `spawn`, organizations and `run` functions must be importable by the nodes.
+
+    >>> with Cluster() as cluster:
+    ...     units = cluster.deploy(enterprise)  # one node per subsidiary
+    ...     units["Acme"].run(waterfall_for_team, "todo app")
+    """
+
+    def __init__(self, start_method: str = "spawn"):
+        self._context = multiprocessing.get_context(start_method)
+        self._connections: dict[str, Connection] = {}
+        self._processes: dict[str, multiprocessing.Process] = {}
+        self._routers: list[threading.Thread] = []
+        global _process_runtime
+        main_end, broker_end = multiprocessing.Pipe()
+        self._add_route(MAIN, broker_end)
+        self._runtime = _process_runtime = _Runtime(MAIN, main_end)
+        self._receiver = threading.Thread(target=self._runtime.receive, daemon=True)
+        self._receiver.start()
+
+    def _add_route(self, node: str, connection: Connection):
+        self._connections[node] = connection
+        router = threading.Thread(target=self._route, args=(node,), daemon=True)
+        router.start()
+        self._routers.append(router)
+
+    def _route(self, node: str):
+        connection = self._connections[node]
+        while True:
+            try:
+                data = connection.recv_bytes()
+            except (EOFError, OSError):
+                return
+            target = self._connections.get(destination(data))
+            try:
+                if target is None:
+                    raise RemoteError(f"unknown node {destination(data)}")
+                target.send_bytes(data)
+            except (RemoteError, OSError) as e:
+                self._bounce(data, e)
+
+    def _bounce(self, frame: bytes, error: Exception):
+        # answer undeliverable requests with an error, so their senders don't wait
+        # forever; undeliverable answers and stops are dropped
+        source, kind, message_id, _ = decode(frame)
+        if kind in ("result", "error", "stop") or source not in self._connections:
+            return
+        if not isinstance(error, RemoteError):
+            error = RemoteError(f"{destination(frame)}: {error!r}")
+        reply = encode(source, (destination(frame), "error", message_id, error))
+        try:
+            self._connections[source].send_bytes(reply)
+        except OSError:
+            pass
+
+    def spawn(
+        self, name: str, organization: Organization | Callable
+    ) -> RemoteOrganization:
+        """Starts node `name` hosting `organization` (or what a factory returns)."""
+        assert name not in self._connections, f"Cluster: node {name} already exists."
+        node_end, broker_end = self._context.Pipe()
+        process = self._context.Process(
+            target=_node_main, args=(name, node_end), name=name, daemon=True
+        )
+        process.start()
+        self._processes[name] = process
+        self._add_route(name, broker_end)
+        members = self._runtime.request(name, "host", (name, organization))
+        return RemoteOrganization(self, name, members)
+
+    def deploy(self, organization: Organization) -> dict[str, RemoteOrganization]:
+        """One node per subsidiary of an `Enterprise`, per team of a `Company`, or a
+        single node for anything else."""
+        if isinstance(organization, Enterprise):
+            units = organization.subsiduaries
+        elif isinstance(organization, Company):
+            units = organization.teams
+        else:
+            units = [organization]
+        return {unit.name: self.spawn(unit.name, unit) for unit in units}
+
+    def ref(self, agent: Agent) -> AgentRef:
+        """A handle other nodes can use to reach `agent`, which stays in this process."""
+        return self._runtime.ref(agent)
+
+    def close(self):
+        global _process_runtime
+        for node in self._processes:
+            self._runtime.send(node, "stop", -1, None)
+        for process in self._processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self._connections.values():
+            connection.close()
+        self._runtime.connection.close()
+        _process_runtime = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,7 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def debate(
@@ -21,6 +22,7 @@ def debate(
     agents = [agent for agent, _ in agents_and_positions]
 
     for round in range(1, rounds + 1):
+        checkpoint()
         conversation.input(f"Round {round} out of {rounds+1}")
         for agent, position in agents_and_positions:
             # Agent states their position
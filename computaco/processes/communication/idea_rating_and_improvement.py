@@ -1,6 +1,7 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def idea_rating_and_improvement(
@@ -8,6 +9,7 @@ def idea_rating_and_improvement(
 ) -> list[tuple[str, str]]:
     conversation.input("Now let's rate and improve these ideas:")
     for idea in ideas:
+        checkpoint()
         conversation.input(f"Idea: {idea}")
         conversation.input("Please rate and suggest improvements:")
         for agent in agents:
@@ -1,11 +1,13 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def meeting(conversation: Conversation, agenda: list[str], agents: list[Agent]):
     conversation.input("The meeting has started.")
     for item in agenda:
+        checkpoint()
         conversation.input(f"Agenda item: {item}")
         conversation.converse_until_done(f'Have we finished discussing "{item}"?', agents)
     conversation.input("The meeting has ended.")
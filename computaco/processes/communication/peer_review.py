@@ -1,6 +1,7 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def peer_review(
@@ -19,6 +20,7 @@ def peer_review(
     conversation.input(author("Please present your work."))
 
     for round in range(1, rounds + 1):
+        checkpoint()
         conversation.input(f"Round {round} out of {rounds}")
 
         # Reviewers review the work
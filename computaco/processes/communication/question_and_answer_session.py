@@ -1,6 +1,7 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def question_and_answer_session(
@@ -9,6 +10,7 @@ def question_and_answer_session(
     conversation.input("Now let's have a question and answer session.")
 
     while True:
+        checkpoint()
         # Questioners ask questions
         for questioner in questioners:
             conversation.input(
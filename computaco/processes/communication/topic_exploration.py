@@ -1,6 +1,7 @@
 from pathlib import Path
 from computaco.environments.conversation import Conversation, TextMessage
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
 def topic_exploration(
@@ -8,6 +9,7 @@ def topic_exploration(
 ):
     conversation.input(f"Now let's explore the topic: {topic}")
     for round in range(1, rounds + 1):
+        checkpoint()
         conversation.input(f"Round {round} out of {rounds}")
         conversation.converse_until_done(
             f'Have we finished discussing "{topic}"?', agents
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import contextvars
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+import pickle
+import re
+import time
+from typing import Callable
+
+import attr
+
+from computaco.utils.artifact_store import ArtifactStore, fingerprint
+
+_logger = logging.getLogger(__name__)
+
+
+@attr.s
+class Phase:
+    name: str = attr.ib()  # also the name of the artifact it returns
+    fn: Callable = attr.ib()
+    # phases whose artifacts `fn` takes as arguments; inferred from its signature if None
+    requires: tuple[str, ...] = attr.ib(default=None)
+    after: tuple[str, ...] = attr.ib(default=())  # phases that only have to finish first
+    kwargs: dict = attr.ib(factory=dict)
+
+
+class PhaseGraph:
+    """Runs phases as soon as the phases they depend on are done, several at a time.
+
+    Each phase returns one artifact, named after the phase. A phase receives, by
+    keyword, the `run` inputs and the artifacts its parameters are named after
+    (unless `requires` says otherwise), and `after` orders phases that share no
+    artifact. Artifacts are checkpointed to `checkpoint_dir` as json (or pickled,
+    if they aren't json) as they are produced, keyed by the arguments the phase got,
+    so a resumed run skips the phases that already finished with the same arguments.
+    Arguments that can't be fingerprinted (see `fingerprint`) only count by type.
+    `on_resume(name, artifact)` is called for each phase a run skips, eg, to tell
+    the agents what it produced.
+
+    >>> graph = PhaseGraph(checkpoint_dir=project.datapath / "phases")
+    >>> graph.add("requirements", elicit_requirements)
+    >>> graph.add("design", design_phase)  # takes `requirements`
+    >>> graph.add("mockups", draw_mockups, after=["requirements"])
+    >>> artifacts = graph.run(project=project, conversation=conversation)
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: Path = None,
+        max_workers: int = 4,
+        on_resume: Callable[[str, any], None] = None,
+    ):
+        self.phases: dict[str, Phase] = {}
+        self.checkpoint_dir = None if checkpoint_dir is None else Path(checkpoint_dir)
+        self.max_workers = max_workers
+        self.on_resume = on_resume
+        self.timings: dict[str, float] = {}  # seconds per phase run
+        self.resumed: list[str] = []  # phases loaded from checkpoints by the last run
+
+    def add(
+        self,
+        name: str,
+        fn: Callable,
+        requires: list[str] = None,
+        after: list[str] = (),
+        **kwargs,
+    ) -> Phase:
+        """Adds a phase. `kwargs` are passed to `fn` in place of the `run` inputs."""
+        assert name not in self.phases, f"PhaseGraph: phase {name} already exists."
+        phase = Phase(
+            name, fn, None if requires is None else tuple(requires), tuple(after), kwargs
+        )
+        self.phases[name] = phase
+        return phase
+
+    def dependencies(self, phase: Phase) -> tuple[str, ...]:
+        return (*self._requires(phase), *phase.after)
+
+    def _requires(self, phase: Phase) -> tuple[str, ...]:
+        if phase.requires is not None:
+            return phase.requires
+        return tuple(
+            parameter
+            for parameter in inspect.signature(phase.fn).parameters
+            if parameter in self.phases
+            and parameter != phase.name
+            and parameter not in phase.kwargs
+        )
+
+    def order(self) -> list[str]:
+        """The phases in an order that respects their dependencies."""
+        for phase in self.phases.values():
+            for dependency in self.dependencies(phase):
+                if dependency not in self.phases:
+                    raise ValueError(f"PhaseGraph: unknown dependency {dependency}")
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"PhaseGraph: dependency cycle through {name}")
+            visiting.add(name)
+            for dependency in self.dependencies(self.phases[name]):
+                visit(dependency)
+            visiting.remove(name)
+            order.append(name)
+
+        for name in self.phases:
+            visit(name)
+        return order
+
+    def run(self, **inputs) -> dict[str, any]:
+        """Runs every phase that isn't checkpointed yet and returns all artifacts.
+
+        If a phase fails, phases already running are allowed to finish (and are
+        checkpointed), no new ones are started, and the exception is raised."""
+        artifacts = {}
+        self.resumed = []
+        for name in self.order():
+            # a checkpoint is stale if anything it depends on has to run again
+            phase = self.phases[name]
+            if all(d in artifacts for d in self.dependencies(phase)) and self._load(
+                name, self._key(phase, inputs, artifacts), artifacts
+            ):
+                self.resumed.append(name)
+                if self.on_resume is not None:
+                    self.on_resume(name, artifacts[name])
+
+        running: dict[Future, str] = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for name, phase in self.phases.items():
+                    if (
+                        error is None
+                        and name not in artifacts
+                        and name not in running.values()
+                        and all(d in artifacts for d in self.dependencies(phase))
+                    ):
+                        # in the caller's context, so eg, kernel cancellation reaches it
+                        future = executor.submit(
+                            contextvars.copy_context().run,
+                            self._run,
+                            phase,
+                            inputs,
+                            artifacts,
+                        )
+                        running[future] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    artifacts[name] = future.result()
+                    key = self._key(self.phases[name], inputs, artifacts)
+                    self._save(name, key, artifacts[name])
+        if error is not None:
+            raise error
+        return artifacts
+
+    def _arguments(self, phase: Phase, inputs: dict, artifacts: dict) -> dict:
+        available = {
+            **inputs,
+            **{name: artifacts[name] for name in self._requires(phase)},
+            **phase.kwargs,
+        }
+        parameters = inspect.signature(phase.fn).parameters
+        if not any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+            available = {k: v for k, v in available.items() if k in parameters}
+        return available
+
+    def _run(self, phase: Phase, inputs: dict, artifacts: dict):
+        available = self._arguments(phase, inputs, artifacts)
+        start = time.monotonic()
+        artifact = phase.fn(**available)
+        self.timings[phase.name] = time.monotonic() - start
+        return artifact
+
+    def _key(self, phase: Phase, inputs: dict, artifacts: dict) -> str:
+        arguments = {}
+        for name, value in self._arguments(phase, inputs, artifacts).items():
+            try:
+                arguments[name] = fingerprint(value)
+            except TypeError:
+                arguments[name] = type(value).__qualname__  # eg, the conversation
+        return ArtifactStore.key(phase.name, **arguments)[:16]
+
+    def _checkpoint(self, name: str, key: str, suffix: str = ".json") -> Path:
+        return self.checkpoint_dir / f"{name}.{key}{suffix}"
+
+    def _checkpoints(self, name: str) -> list[Path]:
+        """Every checkpoint of `name`, whatever its key."""
+        pattern = re.compile(re.escape(name) + r"\.[0-9a-f]{16}\.(json|pickle|tmp)")
+        return [p for p in self.checkpoint_dir.glob("*") if pattern.fullmatch(p.name)]
+
+    def _load(self, name: str, key: str, artifacts: dict) -> bool:
+        if self.checkpoint_dir is None:
+            return False
+        if self._checkpoint(name, key).exists():
+            with open(self._checkpoint(name, key)) as f:
+                artifacts[name] = json.load(f)
+        elif self._checkpoint(name, key, ".pickle").exists():
+            with open(self._checkpoint(name, key, ".pickle"), "rb") as f:
+                artifacts[name] = pickle.load(f)
+        else:
+            return False
+        return True
+
+    def _save(self, name: str, key: str, artifact):
+        if self.checkpoint_dir is None:
+            return
+        # artifacts that aren't json (eg, sets or objects) are pickled instead, and
+        # ones that can't be pickled either aren't checkpointed
+        try:
+            data, suffix = json.dumps(artifact).encode(), ".json"
+        except (TypeError, ValueError):
+            try:
+                data, suffix = pickle.dumps(artifact), ".pickle"
+            except Exception:
+                _logger.exception(f"PhaseGraph: can't checkpoint {name}.")
+                return
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        # write then rename, so an interrupted run never leaves a partial checkpoint
+        temporary = self._checkpoint(name, key, ".tmp")
+        temporary.write_bytes(data)
+        checkpoint = self._checkpoint(name, key, suffix)
+        os.replace(temporary, checkpoint)
+        for stale in self._checkpoints(name):  # made with other arguments
+            if stale != checkpoint:
+                stale.unlink(missing_ok=True)
+
+    def forget(self, *names: str):
+        """Deletes the checkpoints of `names` (all phases by default), so they run again."""
+        if self.checkpoint_dir is None or not self.checkpoint_dir.exists():
+            return
+        for name in names or self.phases:
+            for checkpoint in self._checkpoints(name):
+                checkpoint.unlink(missing_ok=True)
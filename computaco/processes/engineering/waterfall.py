@@ -1,9 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import inspect
 import json
 import os
+import re
 import shutil
 from pathlib import Path
 import subprocess
-from computaco.environments.system_interface import SystemInterface
+import time
+from typing import Callable
 from computaco.processes.communication.consensus_building import consensus_building
 from computaco.processes.communication.meeting import meeting
 from computaco.processes.communication.peer_review import peer_review
@@ -12,8 +18,78 @@ import tensorcode as tc
 from computaco.abstractions.project import Project
 from computaco.agents.agent import Agent
 from computaco.environments.conversation import Conversation
+from computaco.processes.dag import PhaseGraph
+from computaco.utils.router import track_usage
+from computaco.utils.suite_runner import TestRunner, TestSuite
+
+
+def stored(filename: str) -> Callable:
+    """Serves a phase from `project.artifacts` when it ran before with the same code
+    and arguments (conversations aside), and writes its result to
+    `project.datapath / filename` either way.
+
+    Only for phases that get everything they build on as arguments (not through the
+    conversation) and leave the conversation as they found it. When the phase is
+    served, its result is said in the conversation instead (and told to the agents
+    it was given that aren't in it)."""
+
+    def decorator(phase: Callable) -> Callable:
+        signature = inspect.signature(phase)
+        code = inspect.getsource(phase)
+
+        @functools.wraps(phase)
+        def run(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            project = arguments["project"]
+            made = []
+
+            def make():
+                made.append(True)
+                return phase(*args, **kwargs)
+
+            result = project.artifact(
+                project.datapath / filename,
+                make,
+                group="documents",
+                code=code,
+                **{
+                    name: value
+                    for name, value in arguments.items()
+                    if name != "project" and not isinstance(value, Conversation)
+                },
+            )
+            if not made:
+                _replay(filename, result, arguments["conversation"], arguments.values())
+            return result
+
+        return run
+
+    return decorator
+
+
+def _replay(name: str, result, conversation: Conversation, values):
+    """Says `result` in `conversation`, and tells it to the agents among `values` that
+    aren't in it, in place of the work that would have made it."""
+    text = (
+        result if isinstance(result, str) else json.dumps(result, indent=4, default=str)
+    )
+    conversation.input(f"{name}:\n\n{text}")
+    for agent in _agents(values):
+        if agent not in conversation.agents:
+            agent.input(f"{name}:\n\n{text}")
+
+
+def _agents(values) -> list[Agent]:
+    agents = []
+    for value in values:
+        if isinstance(value, Agent):
+            agents.append(value)
+        elif isinstance(value, (list, tuple)):
+            agents.extend(v for v in value if isinstance(v, Agent))
+    return agents
 
 
+@stored("basic_info.md")
 def gather_basic_information(
     project_manager: Agent, client: Agent, project: Project, conversation: Conversation
 ) -> str:
@@ -31,21 +107,20 @@ def gather_basic_information(
         f"Please write a summary of the basic information you gathered about {project.name}:"
     )
 
-    # Save basic information to file
-    with open(project.datapath / "basic_info.md", "w") as f:
-        f.write(basic_info)
-
     # Return basic information summary
     return basic_info
 
 
+@stored("system_requirements.md")
 def elicit_system_requirements(
     project_manager: Agent,
     stakeholders: Agent,
     project: Project,
     conversation: Conversation,
+    basic_info: str,
 ) -> str:
     # Elicit system requirements from client
+    project_manager.input(basic_info)
     project_manager.input(
         f"Please elicit system requirements for {project.name} from {stakeholders}. Use the basic information you gathered earlier as a starting point. Ask open-ended questions to gather as much detail as possible."
     )
@@ -63,21 +138,20 @@ def elicit_system_requirements(
         f"Please write a detailed summary of the system requirements for {project.name} using nested bulleted lists (markdown syntax):"
     )
 
-    # Save basic information to file
-    with open(project.datapath / "system_requirements.md", "w") as f:
-        f.write(system_requirements)
-
     # Return basic information summary
     return system_requirements
 
 
+@stored("software_requirements.md")
 def elicit_software_requirements(
     project_manager: Agent,
     software_engineers: list[Agent],
     project: Project,
     conversation: Conversation,
+    system_requirements: str,
 ) -> str:
     # Elicit software requirements from software engineers
+    project_manager.input(system_requirements)
     project_manager.input(
         f"Please work with the software engineers to elicit software requirements for {project.name} based on the system requirements."
     )
@@ -97,23 +171,23 @@ def elicit_software_requirements(
         f"Please write a detailed summary of the software requirements for {project.name} using nested bulleted lists (markdown syntax):"
     )
 
-    # Save software requirements to file
-    with open(project.datapath / "software_requirements.md", "w") as f:
-        f.write(software_requirements)
-
+    conversation.leave(*software_engineers)
     # Return software requirements summary
     return software_requirements
 
 
+@stored("user_requirements.md")
 def elicit_user_requirements(
     project_manager: Agent,
     ux_designers: list[Agent],
     project: Project,
     conversation: Conversation,
+    system_requirements: str,
 ) -> str:
     # Elicit user requirements from UX designers
+    project_manager.input(system_requirements)
     project_manager.input(
-        f"Please work with the UX designers to elicit user requirements for {project.name} based on the system and software requirements."
+        f"Please work with the UX designers to elicit user requirements for {project.name} based on the system requirements."
     )
 
     conversation.join(*ux_designers)
@@ -131,14 +205,12 @@ def elicit_user_requirements(
         f"Please write a detailed summary of the user requirements for {project.name} using nested bulleted lists (markdown syntax):"
     )
 
-    # Save user requirements to file
-    with open(project.datapath / "user_requirements.md", "w") as f:
-        f.write(user_requirements)
-
+    conversation.leave(*ux_designers)
     # Return user requirements summary
     return user_requirements
 
 
+@stored("design_requirements.md")
 def obtain_design_requirements(
     project_manager: Agent,
     software_architects: list[Agent],
@@ -166,14 +238,11 @@ def obtain_design_requirements(
         f"Please write a detailed summary of the design requirements for {project.name} using nested bulleted lists (markdown syntax):"
     )
 
-    # Save design requirements to file
-    with open(project.datapath / "design_requirements.md", "w") as f:
-        f.write(design_requirements)
-
     conversation.leave(*software_architect)
     return design_requirements
 
 
+@stored("design_data.json")
 def design_phase(
     project_manager: Agent,
     software_architects: list[Agent],
@@ -238,65 +307,176 @@ def design_phase(
         "components": components,
     }
 
-    with open(project.datapath / "design_data.json", "w") as f:
-        json.dump(design_data, f)
-
     return design_data
 
 
+def _forker() -> Callable:
+    """A function that replaces agents (also in lists) with forks of them (see
+    `Agent.fork`), forking each agent once, and leaves other values alone."""
+    forks = {}
+
+    def fork(value):
+        if isinstance(value, list):
+            return [fork(v) for v in value]
+        if not isinstance(value, Agent):
+            return value
+        if id(value) not in forks:
+            # agents that can't fork take part themselves
+            forks[id(value)] = value.fork() or value
+        return forks[id(value)]
+
+    return fork
+
+
+def for_each_component(
+    phase: str,
+    components: list[str],
+    work: Callable[..., dict | None],
+    conversation: Conversation,
+    max_workers: int = 1,
+    **agents,
+) -> dict[str, dict]:
+    """Calls `work(component, conversation, **agents)` for every component and reports
+    the wall time and (estimated) engine tokens each one took, plus anything `work`
+    returns.
+
+    With `max_workers` > 1, up to that many components are worked on at once, each
+    in its own branch of `conversation`, with its own forks of `agents` and of the
+    conversation's speakers, so no agent is called from two components at once.
+    Branches are merged back in component order once all are done."""
+    if len(set(components)) != len(components):
+        raise ValueError(f"for_each_component: duplicate components in {components}.")
+    report = {}
+
+    def run(component: str, conversation: Conversation, agents: dict):
+        start = time.monotonic()
+        with track_usage() as usage:
+            details = work(component, conversation, **agents)
+        report[component] = {
+            "seconds": time.monotonic() - start,
+            "engine_calls": usage.calls,
+            "tokens": usage.total_tokens,
+            **(details or {}),
+        }
+
+    if max_workers <= 1:
+        for component in components:
+            run(component, conversation, agents)
+        return report
+
+    branches, forked = {}, {}
+    for index, component in enumerate(components):
+        fork = _forker()
+        forked[component] = {name: fork(value) for name, value in agents.items()}
+        # names like "a b" and "a-b" sanitize alike, so the index keeps branches apart
+        branches[component] = conversation.branch(
+            f"{phase}-{index}-" + re.sub(r"\W+", "_", component),
+            speakers=fork(conversation.speakers),
+        )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                run,
+                component,
+                branches[component],
+                forked[component],
+            )
+            for component in components
+        ]
+    for component in components:
+        conversation.merge(branches[component])
+    for future in futures:
+        future.result()  # raises the first failure, after everything was merged
+    return {component: report[component] for component in components}
+
+
 def development_phase(
     project_manager: Agent,
     software_engineers: list[Agent],
     project: Project,
     conversation: Conversation,
     design_data: dict,
-) -> None:
+    max_parallel_components: int = 1,
+) -> dict[str, dict]:
     components = design_data["components"]
     conversation.join(project_manager, *software_engineers)
 
-    for component in components:
-        conversation.input(
-            f"Let's discuss the implementation of the {component} component."
-        )
-        engineer = tc.choice(software_engineers)
-        conversation.input(
-            f"{engineer.name}, please take the lead on implementing {component}."
-        )
-
-        component_code = engineer(f"Please write the code for the {component} component:")
-        component_path = project.path / "components" / component
+    def develop(
+        component: str, conversation: Conversation, software_engineers: list[Agent]
+    ):
+        def implement() -> str:
+            conversation.input(
+                f"Let's discuss the implementation of the {component} component."
+            )
+            engineer = tc.choice(software_engineers)
+            conversation.input(
+                f"{engineer.name}, please take the lead on implementing {component}."
+            )
 
-        # Save the component code to a file
-        component_path.mkdir(parents=True, exist_ok=True)
-        with open(component_path / "main.py", "w") as f:
-            f.write(component_code)
+            component_code = engineer(
+                f"Please write the code for the {component} component:"
+            )
 
-        conversation.input(
-            f"{engineer.name} has implemented the {component} component. Please review their work."
-        )
-        peer_review(
-            conversation,
-            component_code,
-            engineer,
-            [e for e in software_engineers if e != engineer],
+            conversation.input(
+                f"{engineer.name} has implemented the {component} component. Please review their work."
+            )
+            peer_review(
+                conversation,
+                component_code,
+                engineer,
+                [e for e in software_engineers if e != engineer],
+            )
+            return component_code
+
+        # Save the component code to a file, or reuse it if nothing it depends on changed
+        project.artifact(
+            project.path / "components" / component / "main.py",
+            implement,
+            group="components",
+            component=component,
+            design_data=design_data,
+            software_engineers=software_engineers,
         )
 
+    report = for_each_component(
+        "development",
+        components,
+        develop,
+        conversation,
+        max_parallel_components,
+        software_engineers=software_engineers,
+    )
+    project.write(project.datapath / "development_report.json", json.dumps(report))
+
     conversation.leave(*software_engineers)
+    return report
 
 
 def testing_phase(
     project_manager: Agent,
     testers: list[Agent],
+    software_engineers: list[Agent],
     project: Project,
     conversation: Conversation,
     design_data: dict,
-) -> None:
+    max_parallel_components: int = 1,
+    max_test_attempts: int = 3,
+) -> dict[str, dict]:
     components = design_data["components"]
-    conversation.join(project_manager, *testers)
+    conversation.join(project_manager, *testers, *software_engineers)
     tests_path = project.path / "tests"
     tests_path.mkdir(parents=True, exist_ok=True)
-
-    for component in components:
+    # suites run in their own subprocesses, at most one per core across all components
+    runner = TestRunner(cache_dir=project.datapath / "test_cache")
+
+    def test(
+        component: str,
+        conversation: Conversation,
+        project_manager: Agent,
+        testers: list[Agent],
+        software_engineers: list[Agent],
+    ):
         tester = tc.choice(testers)
         conversation.input(
             f"{tester.name}, please write tests for the {component} component."
@@ -307,55 +487,75 @@ def testing_phase(
 
         # Save the component tests to a file
         component_test_path.mkdir(parents=True, exist_ok=True)
-        with open(component_test_path / "test_main.py", "w") as f:
-            f.write(component_tests)
+        project.write(component_test_path / "test_main.py", component_tests)
 
-    conversation.input("Now, let's run the tests.")
+        conversation.input(f"Now, let's run the tests for the {component} component.")
 
-    with SystemInterface(
-        cwd=tests_path, project_path=project.path, agents=testers, cmd="bash"
-    ) as si:
-        for component in components:
-            component_test_path = tests_path / component
-            test_results = tester(
-                f"Please run the tests for the {component} component using the command 'python -m unittest test_main.py':"
+        suite = TestSuite(
+            component,
+            cwd=component_test_path,
+            inputs=[component_test_path, project.path / "components" / component],
+            env={"PYTHONPATH": str(project.path / "components" / component)},
+        )
+        component_path = project.path / "components" / component / "main.py"
+        attempts = 1
+        result = runner.run(suite)
+        while not result.passed and attempts < max_test_attempts:
+            conversation.input(
+                f"The tests for the {component} component failed (exit code {result.exit_code}). Please review the test results and fix any issues.\n\n{result.output}"
+            )
+            consensus_building(
+                conversation,
+                f"Discuss the test results for the {component} component.",
+                testers + software_engineers,
+            )
+            # the suite is keyed by its files, so it only runs again once they change
+            engineer = tc.choice(software_engineers)
+            project.write(
+                component_path,
+                engineer(
+                    f"Please rewrite the code for the {component} component, fixing the issues we agreed on:"
+                ),
             )
-            si.input_text(test_results)
-            test_output = si.output_text()
-
-            if tc.decide("Were the tests successful?", test_output):
-                conversation.input(
-                    f"The tests for the {component} component were successful."
-                )
-            else:
-                conversation.input(
-                    f"The tests for the {component} component failed. Please review the test results and fix any issues."
-                )
-                consensus_building(
-                    conversation,
-                    f"Discuss the test results for the {component} component.",
-                    testers,
-                )
-                si.input_text("python -m unittest test_main.py")
-                test_output = si.output_text()
-
-                while not tc.decide("Were the tests successful?", test_output):
-                    conversation.input(
-                        f"The tests for the {component} component still failed. Please review the test results and fix any issues."
-                    )
-                    consensus_building(
-                        conversation,
-                        f"Discuss the test results for the {component} component.",
-                        testers,
-                    )
-                    si.input_text("python -m unittest test_main.py")
-                    test_output = si.output_text()
-
-                conversation.input(
-                    f"The tests for the {component} component are now successful."
-                )
-
-    conversation.leave(*testers)
+            project.write(
+                component_test_path / "test_main.py",
+                tester(
+                    f"Please rewrite the tests for the {component} component, fixing the issues we agreed on:"
+                ),
+            )
+            attempts += 1
+            result = runner.run(suite)
+        if result.passed:
+            conversation.input(
+                f"The tests for the {component} component were successful"
+                + (" (unchanged since they last passed)." if result.cached else ".")
+            )
+        else:
+            conversation.input(
+                f"The tests for the {component} component still fail after {attempts} attempts (exit code {result.exit_code}). {project_manager.name}, please decide how to proceed."
+            )
+        return {
+            "tests_passed": result.passed,
+            "test_attempts": attempts,
+            "test_seconds": result.duration,
+            "tests_cached": result.cached,
+        }
+
+    with runner:
+        report = for_each_component(
+            "testing",
+            components,
+            test,
+            conversation,
+            max_parallel_components,
+            project_manager=project_manager,
+            testers=testers,
+            software_engineers=software_engineers,
+        )
+    project.write(project.datapath / "testing_report.json", json.dumps(report))
+
+    conversation.leave(*testers, *software_engineers)
+    return report
 
 
 def deployment_phase(
@@ -379,6 +579,30 @@ def deployment_phase(
     conversation.leave(*operations_team)
 
 
+def in_branch(phase: Callable) -> Callable:
+    """Runs `phase` in its own branch of the `conversation` it is given, merged back
+    when it ends, so it can run alongside other phases.
+
+    Phases side by side can share agents (eg, the project manager), so the phase
+    gets forks of its agents (see `Agent.fork`), and the agents hear the branch as
+    one message when it's merged, instead of hearing both phases interleaved."""
+
+    @functools.wraps(phase)
+    def run(*args, conversation: Conversation, **kwargs):
+        fork = _forker()
+        branch = conversation.branch(phase.__name__, speakers=fork(conversation.speakers))
+        try:
+            return phase(
+                *fork(list(args)),
+                conversation=branch,
+                **{name: fork(value) for name, value in kwargs.items()},
+            )
+        finally:
+            conversation.merge(branch)
+
+    return run
+
+
 def waterfall_sdlc(
     project_manager: Agent,
     client: Agent,
@@ -389,23 +613,48 @@ def waterfall_sdlc(
     operations_team: list[Agent],
     project: Project,
     conversation: Conversation,
-) -> None:
-    basic_info = gather_basic_information(project_manager, client, project, conversation)
-    system_requirements = elicit_system_requirements(
-        project_manager, client, project, conversation
-    )
-    software_requirements = elicit_software_requirements(
-        project_manager, client, project, conversation
-    )
-    user_requirements = elicit_user_requirements(
-        project_manager, client, project, conversation
-    )
-
-    design_data = design_phase(
-        project_manager, software_architects, ux_designers, project, conversation
+    max_parallel_phases: int = 4,
+    max_parallel_components: int = 1,
+    max_test_attempts: int = 3,
+) -> dict:
+    agents = [
+        project_manager,
+        client,
+        software_engineers,
+        software_architects,
+        ux_designers,
+        testers,
+        operations_team,
+    ]
+    # phases get the artifacts their parameters are named after; `after` orders the
+    # rest. Phases resumed from a checkpoint are replayed to the agents instead
+    graph = PhaseGraph(
+        project.datapath / "phases",
+        max_workers=max_parallel_phases,
+        on_resume=lambda name, artifact: _replay(name, artifact, conversation, agents),
     )
-    development_phase(
-        project_manager, software_engineers, project, conversation, design_data
+    graph.add("basic_info", gather_basic_information)
+    graph.add("system_requirements", elicit_system_requirements, stakeholders=client)
+    # both only build on the system requirements, so they are elicited side by side
+    graph.add("software_requirements", in_branch(elicit_software_requirements))
+    graph.add("user_requirements", in_branch(elicit_user_requirements))
+    graph.add("design_data", design_phase)
+    graph.add("development", development_phase)
+    graph.add("testing", testing_phase, after=["development"])
+    graph.add("deployment", deployment_phase, after=["testing"])
+
+    artifacts = graph.run(
+        project_manager=project_manager,
+        client=client,
+        software_engineers=software_engineers,
+        software_architects=software_architects,
+        ux_designers=ux_designers,
+        testers=testers,
+        operations_team=operations_team,
+        project=project,
+        conversation=conversation,
+        max_parallel_components=max_parallel_components,
+        max_test_attempts=max_test_attempts,
     )
-    testing_phase(project_manager, testers, project, conversation, design_data)
-    deployment_phase(project_manager, operations_team, project, conversation)
+    project.checkpoint("waterfall_sdlc", wait=True)
+    return artifacts
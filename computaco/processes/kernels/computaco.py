@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import heapq
+import inspect
+import itertools
+import threading
+import time
+
+import attr
+
+from computaco.processes.process import Process
+from computaco.utils.rate_limit import Priority, flow, priority
+
+_current = contextvars.ContextVar("current_process", default=None)
+
+
+def current_process() -> ProcessHandle | None:
+    return _current.get()
+
+
+def _is_async(process) -> bool:
+    return inspect.iscoroutinefunction(process) or inspect.iscoroutinefunction(
+        getattr(process, "__call__", None)
+    )
+
+
+def checkpoint():
+    """Raises `asyncio.CancelledError` if the calling process was cancelled or missed
+    its deadline. Synchronous processes run on threads, which can't be interrupted,
+    so long-running ones should call this between steps."""
+    handle = current_process()
+    if handle is not None and handle.cancel_requested.is_set():
+        raise asyncio.CancelledError(f"{handle.name} was cancelled")
+
+
+@attr.s(eq=False)
+class ProcessHandle:
+    name: str = attr.ib()
+    process: Process = attr.ib()
+    args: tuple = attr.ib()
+    kwargs: dict = attr.ib()
+    priority: Priority = attr.ib()
+    deadline: float | None = attr.ib()  # loop time, or None
+
+    # pending, running, done, failed, cancelled or timed_out
+    state: str = attr.ib(default="pending")
+    result: any = attr.ib(default=None)
+    exception: BaseException = attr.ib(default=None)
+    started_at: float = attr.ib(default=None)
+    finished_at: float = attr.ib(default=None)
+    cancel_requested: threading.Event = attr.ib(factory=threading.Event)
+    _done: asyncio.Event = attr.ib(factory=asyncio.Event)
+    _task: asyncio.Task = attr.ib(default=None)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    async def wait(self):
+        await self._done.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class Kernel:
+    """Runs many `Process`es concurrently on one event loop.
+
+    Processes are started highest `priority` first, at most `max_running` at a
+    time. Coroutine processes run on the loop; plain functions (most of
+    `computaco.processes`) run on a thread pool. Every engine call a process makes is
+    tagged with its priority and name, so the registry rate limiter serves
+    interactive work first and shares LLM capacity fairly between processes.
+
+    A process is cancelled by `cancel` or when its `deadline` (seconds after
+    `spawn`) passes. Coroutines are interrupted right away; threads stop at their
+    next `checkpoint()` (conversation steps and the communication processes call it),
+    and their results are discarded either way. A cancelled thread keeps its slot
+    until it actually returns, so no more than `max_running` ever run at once.
+
+    >>> kernel = Kernel()
+    >>> kernel.spawn(requirements_gathering, project, priority=Priority.INTERACTIVE)
+    >>> kernel.spawn(testing, project, deadline=3600)
+    >>> await kernel.join()
+    """
+
+    def __init__(self, max_running: int = 16, max_workers: int = 32):
+        self.max_running = max_running
+        self.processes: list[ProcessHandle] = []
+        self._pending: list[tuple[int, int, ProcessHandle]] = []
+        self._running = 0
+        self._counter = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def spawn(
+        self,
+        process: Process,
+        *args,
+        name: str = None,
+        priority: Priority = Priority.NORMAL,
+        deadline: float = None,
+        **kwargs,
+    ) -> ProcessHandle:
+        """Queues `process(*args, **kwargs)`. Must be called on the kernel's loop."""
+        self._loop = self._loop or asyncio.get_running_loop()
+        index = next(self._counter)
+        handle = ProcessHandle(
+            name=name or f"{getattr(process, '__name__', 'process')}-{index}",
+            process=process,
+            args=args,
+            kwargs=kwargs,
+            priority=priority,
+            deadline=None if deadline is None else self._loop.time() + deadline,
+        )
+        self.processes.append(handle)
+        heapq.heappush(self._pending, (int(priority), index, handle))
+        if handle.deadline is not None:
+            self._loop.call_at(handle.deadline, self._expire, handle)
+        self._dispatch()
+        return handle
+
+    def _dispatch(self):
+        while self._pending and self._running < self.max_running:
+            _, _, handle = heapq.heappop(self._pending)
+            if handle.done:
+                continue
+            self._running += 1
+            handle.state = "running"
+            handle.started_at = time.monotonic()
+            handle._task = self._loop.create_task(self._run(handle), name=handle.name)
+
+    async def _run(self, handle: ProcessHandle):
+        _current.set(handle)
+        worker = None
+        try:
+            with priority(handle.priority), flow(handle.name):
+                if _is_async(handle.process):
+                    result = await handle.process(*handle.args, **handle.kwargs)
+                else:
+                    # run_in_executor doesn't carry context over; copy it explicitly
+                    call = functools.partial(
+                        contextvars.copy_context().run,
+                        handle.process,
+                        *handle.args,
+                        **handle.kwargs,
+                    )
+                    worker = self._executor.submit(call)
+                    result = await asyncio.wrap_future(worker)
+            self._finish(handle, "done", result=result)
+        except asyncio.CancelledError as e:
+            if not handle.done:
+                self._finish(handle, "cancelled", exception=e)
+        except Exception as e:
+            self._finish(handle, "failed", exception=e)
+        finally:
+            if worker is None:
+                self._release()
+            else:
+                # threads can't be interrupted; the slot is freed when it returns
+                worker.add_done_callback(self._release_from_thread)
+
+    def _release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def _release_from_thread(self, worker):
+        try:
+            self._loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # the loop is closed, so nothing is left to dispatch
+
+    def _finish(self, handle, state, result=None, exception=None):
+        if handle.done:
+            return  # eg, a thread finishing after its process timed out
+        handle.state = state
+        handle.result = result
+        handle.exception = exception
+        handle.finished_at = time.monotonic()
+        handle._done.set()
+
+    def cancel(self, handle: ProcessHandle, state: str = "cancelled"):
+        if handle.done:
+            return
+        handle.cancel_requested.set()
+        self._finish(handle, state, exception=asyncio.CancelledError(handle.name))
+        if handle._task is not None:
+            handle._task.cancel()
+
+    def _expire(self, handle: ProcessHandle):
+        self.cancel(handle, state="timed_out")
+
+    async def join(self, *handles: ProcessHandle):
+        """Waits for `handles` (all processes by default) to finish, however they end."""
+        for handle in handles or list(self.processes):
+            await handle._done.wait()
+
+    def run(self, main):
+        """Runs `main(kernel)` (a coroutine function that spawns processes) and then
+        every process it spawned."""
+
+        async def run():
+            await main(self)
+            while not all(handle.done for handle in self.processes):
+                await self.join()
+
+        try:
+            return asyncio.run(run())
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
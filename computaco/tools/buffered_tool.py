@@ -1,9 +1,10 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Callable, List
 
 import attr
 
 from computaco.agents.agent import Agent
+from computaco.tools.buffers import Buffer, ListBuffer
 from computaco.tools.tool import Tool
 
 
@@ -11,6 +12,10 @@ from computaco.tools.tool import Tool
 class BufferedTool(Tool):
 
     only_textio: bool = attr.ib(default=False)
+    # eg, `functools.partial(RingBuffer, capacity=1_000)` to bound a tool's memory
+    buffer_factory: Callable[[], Buffer] = attr.ib(default=None)
+
+    DEFAULT_BUFFER_FACTORY: Callable[[], Buffer] = ListBuffer
 
     @dataclass
     class _T_INPUT_COMPLEX:
@@ -38,7 +43,13 @@ class BufferedTool(Tool):
 
     cursor_pos: tuple[int, int] = (0, 0)
     window_size: tuple[int, int] = (0, 0)
-    _buffer: List[str] = []
+    _buffer: Buffer = attr.ib(init=False, default=None)
+
+    def __attrs_post_init__(self):
+        self._buffer = self._new_buffer()
+
+    def _new_buffer(self) -> Buffer:
+        return (self.buffer_factory or self.DEFAULT_BUFFER_FACTORY)()
 
     def insert(self, text: str):
         raise NotImplementedError()
@@ -50,10 +61,8 @@ class BufferedTool(Tool):
         start_col = self.cursor_pos[1]
         end_col = start_col + self.window_size[1]
 
-        visible_rows = self._buffer[start_row:end_row]
-
         window_content = []
-        for row in visible_rows:
+        for row in self._buffer.rows(start_row, end_row):
             if len(row) > end_col:
                 row = row[:end_col]
             if len(row) > start_col:
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+from array import array
+from itertools import islice
+import mmap
+from pathlib import Path
+from typing import IO, Iterable, Iterator
+
+
+class Buffer:
+    """Row storage for a `BufferedTool`.
+
+    Backends only need `__len__`, `rows`, `append`, and `__setitem__`. `window`
+    reads through `rows`, so backends never have to copy their full contents.
+    """
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def rows(self, start: int, stop: int) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def append(self, row: str):
+        raise NotImplementedError()
+
+    def __setitem__(self, index: int, row: str):
+        raise NotImplementedError()
+
+    def extend(self, rows: Iterable[str]):
+        for row in rows:
+            self.append(row)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return next(self.rows(index, index + 1))
+
+    def __iter__(self) -> Iterator[str]:
+        return self.rows(0, len(self))
+
+    def dump(self, file: IO[str]):
+        for row in self:
+            file.write(row + "\n")
+
+
+class ListBuffer(Buffer):
+    """Unbounded in-memory rows. Fine for small tools."""
+
+    def __init__(self, rows: Iterable[str] = ()):
+        self._rows = list(rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows(self, start, stop):
+        return islice(self._rows, max(start, 0), max(stop, 0))
+
+    def append(self, row):
+        self._rows.append(row)
+
+    def extend(self, rows):
+        self._rows.extend(rows)
+
+    def __setitem__(self, index, row):
+        self._rows[index] = row
+
+
+class RingBuffer(Buffer):
+    """Bounded rows with O(1) append. Meant for terminals.
+
+    Only the most recent `capacity` rows are kept in memory. Older rows are dropped,
+    or, if `spill_path` is given, appended to that file so they can still be scrolled
+    back to. Row indices always count from the first row ever appended when spilling,
+    and from the oldest retained row otherwise.
+    """
+
+    def __init__(self, capacity: int = 10_000, spill_path: str | Path = None):
+        assert capacity > 0, "RingBuffer: capacity must be positive."
+        self.capacity = capacity
+        self._rows: list[str] = [None] * capacity
+        self._head = 0  # slot of the oldest retained row
+        self._count = 0  # number of retained rows
+        self._spill = None
+        self._spill_offsets = array("Q", [0])  # byte offsets of spilled rows
+        if spill_path is not None:
+            self._spill = Path(spill_path).open("w+b")
+
+    @property
+    def num_spilled(self) -> int:
+        return len(self._spill_offsets) - 1
+
+    def __len__(self):
+        return self.num_spilled + self._count
+
+    def append(self, row):
+        if self._count < self.capacity:
+            self._rows[(self._head + self._count) % self.capacity] = row
+            self._count += 1
+            return
+        if self._spill is not None:
+            self._spill.seek(0, 2)
+            self._spill.write(self._rows[self._head].encode())
+            self._spill_offsets.append(self._spill.tell())
+        self._rows[self._head] = row
+        self._head = (self._head + 1) % self.capacity
+
+    def __setitem__(self, index, row):
+        index = (index if index >= 0 else index + len(self)) - self.num_spilled
+        if not 0 <= index < self._count:
+            raise IndexError("RingBuffer: only retained rows can be modified.")
+        self._rows[(self._head + index) % self.capacity] = row
+
+    def rows(self, start, stop):
+        start, stop = max(start, 0), min(stop, len(self))
+        spilled = self.num_spilled
+        if start < spilled:
+            self._spill.flush()
+            self._spill.seek(self._spill_offsets[start])
+            for i in range(start, min(stop, spilled)):
+                size = self._spill_offsets[i + 1] - self._spill_offsets[i]
+                yield self._spill.read(size).decode()
+            start = spilled
+        for i in range(start - spilled, stop - spilled):
+            yield self._rows[(self._head + i) % self.capacity]
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class PieceTable(Buffer):
+    """Piece table over the text of a file. Meant for editors.
+
+    The text is never copied on edit: the original text is kept as-is and inserted
+    text goes into new chunks. The document is a list of pieces pointing into those
+    chunks. Each piece caches its newline count so rows can be located without
+    scanning the text itself.
+    """
+
+    MAX_CHUNK_SIZE = 4096  # sequential inserts are coalesced up to this size
+
+    def __init__(self, original: str = ""):
+        self._chunks = [original]
+        # pieces: [chunk index, start, length, newlines]
+        self._pieces: list[list[int]] = []
+        if original:
+            self._pieces.append([0, 0, len(original), original.count("\n")])
+
+    def _piece_text(self, piece, start=0, stop=None) -> str:
+        chunk, offset, length, _ = piece
+        stop = length if stop is None else stop
+        return self._chunks[chunk][offset + start : offset + stop]
+
+    @property
+    def num_chars(self) -> int:
+        return sum(piece[2] for piece in self._pieces)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._piece_text(piece) for piece in self._pieces)
+
+    def __len__(self):
+        if not self._pieces:
+            return 0
+        newlines = sum(piece[3] for piece in self._pieces)
+        return newlines + (0 if self._ends_with_newline() else 1)
+
+    def offset_of(self, row: int, col: int = 0) -> int:
+        """Character offset of (`row`, `col`). Rows past the end map to the end."""
+        offset = 0
+        for piece in self._pieces:
+            if row == 0:
+                break
+            if piece[3] < row:
+                row -= piece[3]
+                offset += piece[2]
+                continue
+            chunk, start, length, _ = piece
+            index = start - 1
+            for _ in range(row):
+                index = self._chunks[chunk].find("\n", index + 1, start + length)
+            offset += index + 1 - start
+            row = 0
+            break
+        return offset + col
+
+    def insert(self, offset: int, text: str):
+        if not text:
+            return
+        index = self._split(offset)
+        last = self._pieces[index - 1] if index else None
+        if (
+            last is not None
+            and last[0] == len(self._chunks) - 1 > 0
+            and isinstance(self._chunks[-1], str)
+            and last[1] + last[2] == len(self._chunks[-1]) < self.MAX_CHUNK_SIZE
+        ):
+            # typing sequentially; grow the previous piece instead of adding one
+            self._chunks[-1] += text
+            last[2] += len(text)
+            last[3] += text.count("\n")
+        else:
+            self._chunks.append(text)
+            piece = [len(self._chunks) - 1, 0, len(text), text.count("\n")]
+            self._pieces.insert(index, piece)
+
+    def delete(self, offset: int, length: int):
+        start = self._split(offset)
+        stop = self._split(offset + length)
+        del self._pieces[start:stop]
+
+    def replace(self, offset: int, length: int, text: str):
+        self.delete(offset, length)
+        self.insert(offset, text)
+
+    def _split(self, offset: int) -> int:
+        """Splits the piece containing `offset`; returns the index of the piece that
+        now starts at `offset`."""
+        for index, piece in enumerate(self._pieces):
+            if offset == 0:
+                return index
+            if offset < piece[2]:
+                chunk, start, length, newlines = piece
+                head_newlines = self._chunks[chunk].count("\n", start, start + offset)
+                tail = [chunk, start + offset, length - offset, newlines - head_newlines]
+                piece[2], piece[3] = offset, head_newlines
+                self._pieces.insert(index + 1, tail)
+                return index + 1
+            offset -= piece[2]
+        return len(self._pieces)
+
+    def rows(self, start, stop):
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return
+        offset = self.offset_of(start)
+        row = []
+        for chunk, begin, length, _ in self._pieces:
+            if offset >= length:
+                offset -= length
+                continue
+            text, position, end = self._chunks[chunk], begin + offset, begin + length
+            offset = 0
+            while position < end:
+                newline = text.find("\n", position, end)
+                if newline == -1:
+                    row.append(text[position:end])
+                    break
+                row.append(text[position:newline])
+                yield "".join(row)
+                row = []
+                start += 1
+                if start == stop:
+                    return
+                position = newline + 1
+        if start < stop:
+            yield "".join(row)
+
+    def append(self, row):
+        num_chars = self.num_chars
+        prefix = "" if num_chars == 0 or self._ends_with_newline() else "\n"
+        self.insert(num_chars, prefix + row + "\n")
+
+    def extend(self, rows):
+        rows = list(rows)
+        if rows:
+            num_chars = self.num_chars
+            prefix = "" if num_chars == 0 or self._ends_with_newline() else "\n"
+            self.insert(num_chars, prefix + "\n".join(rows) + "\n")
+
+    def _ends_with_newline(self) -> bool:
+        last = self._pieces[-1]
+        return self._piece_text(last, last[2] - 1) == "\n"
+
+    def __setitem__(self, index, row):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = self.offset_of(index)
+        self.replace(start, len(self[index]), row)
+
+    def dump(self, file: IO[str]):
+        for piece in self._pieces:
+            file.write(self._piece_text(piece))
+
+
+class MappedText:
+    """Read-only, str-like view of an ASCII file backed by `mmap`.
+
+    Lets a `PieceTable` use a large file as its original text without reading it
+    into memory; pages are only touched when the rows they hold are requested.
+    ASCII-only so that byte offsets and character offsets coincide: `is_mappable`
+    only checks the start of the file, and reads that reach a non-ASCII byte raise
+    `UnicodeDecodeError`, so callers can fall back to reading the file as text.
+    """
+
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, path: str | Path):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def is_mappable(cls, path: str | Path) -> bool:
+        with open(path, "rb") as file:
+            return file.read(cls.BLOCK_SIZE).isascii()
+
+    def __len__(self):
+        return len(self._mmap)
+
+    def __getitem__(self, index: slice) -> str:
+        return self._mmap[index].decode("ascii")
+
+    def find(self, sub: str, start: int = 0, end: int = None) -> int:
+        return self._mmap.find(sub.encode(), start, len(self) if end is None else end)
+
+    def count(self, sub: str, start: int = 0, end: int = None) -> int:
+        # block by block, so counting never copies the whole mapping. `sub` is a
+        # single character (newlines), so no match can straddle two blocks. The
+        # blocks are read anyway, so they're checked for non-ASCII bytes here too
+        end = len(self) if end is None else end
+        count, sub = 0, sub.encode()
+        for block_start in range(start, end, self.BLOCK_SIZE):
+            block = self._mmap[block_start : min(block_start + self.BLOCK_SIZE, end)]
+            if not block.isascii():
+                block.decode("ascii")  # raises UnicodeDecodeError
+            count += block.count(sub)
+        return count
+
+    def close(self):
+        self._mmap.close()
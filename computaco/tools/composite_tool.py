@@ -1,3 +1,7 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+import inspect
+import threading
 from typing import Literal
 import attr
 from computaco.agents.agent import Agent
@@ -5,9 +9,67 @@ from computaco.tools.tool import Tool
 from computaco.utils.python import merge_types
 
 
+class _ToolList(list):
+    """A list of tools that keeps `by_name` ({name: tool}) up to date as it changes."""
+
+    def __init__(self, tools=()):
+        super().__init__(tools)
+        self._reindex()
+
+    def _reindex(self):
+        self.by_name = {tool.name: tool for tool in self}
+
+    def append(self, tool):
+        super().append(tool)
+        self.by_name[tool.name] = tool
+
+
+def _reindexed(method):
+    def mutate(self, *args, **kwargs):
+        result = getattr(list, method)(self, *args, **kwargs)
+        self._reindex()
+        return result
+
+    mutate.__name__ = method
+    return mutate
+
+
+for _method in (
+    "extend",
+    "insert",
+    "remove",
+    "pop",
+    "clear",
+    "reverse",
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+):
+    setattr(_ToolList, _method, _reindexed(_method))
+
+
 @attr.s
 class CompositeTool(Tool):
-    tools: list[Tool] = attr.ib(default=[])
+    # however it's changed, the list keeps a name index for `get_tool`
+    tools: list[Tool] = attr.ib(
+        factory=list, converter=_ToolList, on_setattr=attr.setters.convert
+    )
+
+    # when `parallel`, sub-tools named in one input are called concurrently on a thread
+    # pool. Sub-tools that fail or miss `timeout` get their exception as output
+    # instead of a result, so the others' results are still returned. The timeout is
+    # best-effort: a sub-tool that's already running can't be stopped, and keeps its
+    # worker (and concurrency limit) until it returns. `close` shuts the pool down.
+    # If any sub-tool is async, the output is awaitable too (see `Tool.__call__`).
+    parallel: bool = attr.ib(default=False)
+    max_workers: int = attr.ib(default=8)
+    timeout: float = attr.ib(default=None)
+    concurrency_limits: dict[str, int] = attr.ib(factory=dict)  # {tool name: max calls}
+
+    _executor: ThreadPoolExecutor = attr.ib(init=False, default=None)
+    _semaphores: dict[str, threading.Semaphore] = attr.ib(init=False, factory=dict)
+    _semaphores_lock: threading.Lock = attr.ib(init=False, factory=threading.Lock)
 
     @property
     def T_INPUT(self):
@@ -18,17 +80,107 @@ class CompositeTool(Tool):
         return {tool.name: tool.T_OUTPUT for tool in self.tools}
 
     def _fn(self, agent: Agent, input: T_INPUT) -> T_OUTPUT:
-        output = {}
+        calls = {}
         for tool_name, tool_input in input.items():
-            tool = next((tool for tool in self.tools if tool.name == tool_name), None)
+            tool = self._find_tool(tool_name)
             if tool:
-                tool_output = tool(agent, tool_input)
-                output[tool_name] = tool_output
-        return output
+                calls[tool_name] = (tool, tool_input)
+
+        if not self.parallel or len(calls) < 2:
+            return self._resolved(
+                {
+                    tool_name: self._call(tool, agent, tool_input)
+                    for tool_name, (tool, tool_input) in calls.items()
+                }
+            )
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {
+            tool_name: self._executor.submit(self._call, tool, agent, tool_input)
+            for tool_name, (tool, tool_input) in calls.items()
+        }
+        wait(futures.values(), timeout=self.timeout)
+
+        output = {}
+        for tool_name, future in futures.items():
+            if not future.done():
+                future.cancel()  # only if it hasn't started
+                output[tool_name] = TimeoutError(
+                    f"`{tool_name}` did not finish within {self.timeout}s"
+                )
+            elif future.exception() is not None:
+                output[tool_name] = future.exception()
+            else:
+                output[tool_name] = future.result()
+        return self._resolved(output)
+
+    def _resolved(self, output: dict):
+        """`output`, or if async sub-tools left awaitables in it, an awaitable of it
+        with their results (or exceptions) filled in."""
+        if not any(inspect.isawaitable(value) for value in output.values()):
+            return output
+
+        async def resolve():
+            names = [name for name, value in output.items() if inspect.isawaitable(value)]
+            if self.parallel:
+                results = await asyncio.gather(
+                    *(self._await(name, output[name]) for name in names)
+                )
+            else:
+                results = [await output[name] for name in names]
+            return {**output, **dict(zip(names, results))}
+
+        return resolve()
+
+    async def _await(self, tool_name: str, awaitable):
+        # like a parallel call's future: a timeout or failure becomes the output
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout)
+        except asyncio.TimeoutError:
+            return TimeoutError(f"`{tool_name}` did not finish within {self.timeout}s")
+        except Exception as e:
+            return e
+
+    def _call(self, tool: Tool, agent: Agent, tool_input):
+        limit = self.concurrency_limits.get(tool.name)
+        if limit is None:
+            return tool(agent, tool_input)
+        with self._semaphores_lock:
+            if tool.name not in self._semaphores:
+                self._semaphores[tool.name] = threading.Semaphore(limit)
+        with self._semaphores[tool.name]:
+            return tool(agent, tool_input)
+
+    def _find_tool(self, tool_name) -> Tool | None:
+        tools = self.tools
+        if isinstance(tools, _ToolList):
+            return tools.by_name.get(tool_name)
+        # eg, subclasses that compute `tools`
+        return next((tool for tool in tools if tool.name == tool_name), None)
 
     def get_tool(self, tool_name):
-        for tool in self.tools:
-            if tool.name == tool_name:
-                return tool
-        else:
-            raise ValueError(f"`{tool}` not a valid option. Is your spelling correct?")
+        tool = self._find_tool(tool_name)
+        if tool is None:
+            raise ValueError(
+                f"`{tool_name}` not a valid option. Is your spelling correct?"
+            )
+        return tool
+
+    def add_tool(self, tool: Tool):
+        self.tools.append(tool)
+
+    def remove_tool(self, tool: Tool):
+        self.tools.remove(tool)
+
+    def close(self):
+        """Shuts down the worker pool, once the sub-tools still running return."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,8 +1,12 @@
 from __future__ import annotations
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
 from datetime import datetime
 from enum import Enum
+from pathlib import Path
 
-from typing import Literal, Union
+from typing import Callable, Iterator, Literal, Union
 import json
 import os
 
@@ -11,6 +15,82 @@ import attr
 from computaco.abstractions.types import Audio, Image, Video
 from computaco.agents.agent import Agent
 from computaco.tools.tool import Environment, Tool
+from computaco.utils.blob_store import BlobStore
+from computaco.utils.compact import CompactMessage
+
+
+class PagedMessages(Sequence):
+    """Messages kept on disk as JSON lines and decoded a page at a time.
+
+    Only the line offsets and the `max_pages` most recently used pages are held in
+    memory, so indexing and iterating a long history doesn't load all of it.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        encode: Callable[[any], dict],
+        decode: Callable[[dict], any],
+        page_size: int = 256,
+        max_pages: int = 16,
+    ):
+        self.path = Path(path)
+        self.encode = encode
+        self.decode = decode
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages: OrderedDict[int, list] = OrderedDict()
+        self._offsets = array("Q")
+        self._file = self.path.open("a+b")
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if line.strip():
+                self._offsets.append(offset)
+            offset += len(line)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        page, index = divmod(index, self.page_size)
+        return self._page(page)[index]
+
+    def __iter__(self) -> Iterator:
+        for page in range((len(self) + self.page_size - 1) // self.page_size):
+            yield from self._page(page)
+
+    def _page(self, page: int) -> list:
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+        offsets = self._offsets[page * self.page_size : (page + 1) * self.page_size]
+        self._file.seek(offsets[0])
+        messages = []
+        while len(messages) < len(offsets):
+            line = self._file.readline()
+            if line.strip():
+                messages.append(self.decode(json.loads(line)))
+        self._pages[page] = messages
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return messages
+
+    def append(self, message):
+        self._file.seek(0, os.SEEK_END)
+        self._offsets.append(self._file.tell())
+        self._file.write(json.dumps(self.encode(message)).encode() + b"\n")
+        self._file.flush()
+        self._pages.pop((len(self) - 1) // self.page_size, None)
+
+    def close(self):
+        self._file.close()
 
 
 @attr.s
@@ -21,56 +101,88 @@ class Conversation(Tool):
         audio = Audio
         video = Video
 
-    class Message:
-        sender: Agent
-        timestamp: datetime
-        content: any
+    class Message(CompactMessage):
+        __slots__ = ()
 
-    messages: list[Message] = []
+    # a list, or `PagedMessages` to keep long histories on disk
+    messages: list[Message] | PagedMessages = attr.ib(factory=list)
+    # if set, media content is kept here instead of in memory
+    blob_store: BlobStore = attr.ib(default=None)
     T_INPUT = any
     T_OUTPUT = any
 
     def _fn(self, agent: Agent, input: T_INPUT) -> T_OUTPUT:
         message = self.Message(sender=agent, timestamp=datetime.now(), content=input)
+        message.offload(self.blob_store)
         self.messages.append(message)
         return message.content
 
-    def to_markdown(self):
-        markdown = ""
+    def iter_markdown(self) -> Iterator[str]:
         for message in self.messages:
-            markdown += f"**{message.sender.name} ({message.timestamp.strftime('%Y-%m-%d %H:%M:%S')}):** {message.content}\n"
-        return markdown
-
-    def save(self, format: Literal["markdown", "json", "text"]):
-        if format == "markdown":
-            content = self.to_markdown()
-            file_ext = "md"
-        elif format == "json":
-            content = json.dumps(
-                [
-                    {
-                        "sender": msg.sender.name,
-                        "timestamp": msg.timestamp.isoformat(),
-                        "content": msg.content,
-                    }
-                    for msg in self.messages
-                ]
-            )
-            file_ext = "json"
-        elif format == "text":
-            content = "\n".join(
+            yield f"**{message.sender.name} ({message.timestamp.strftime('%Y-%m-%d %H:%M:%S')}):** {message.content}\n"
+
+    def iter_text(self) -> Iterator[str]:
+        for i, msg in enumerate(self.messages):
+            yield ("\n" if i else "") + (
                 f"{msg.sender.name} ({msg.timestamp.strftime('%Y-%m-%d %H:%M:%S')}): {msg.content}"
-                for msg in self.messages
             )
-            file_ext = "txt"
+
+    def iter_json(self) -> Iterator[str]:
+        yield "["
+        for i, msg in enumerate(self.messages):
+            yield ("," if i else "") + json.dumps(self.message_to_dict(msg))
+        yield "]"
+
+    def iter_jsonl(self) -> Iterator[str]:
+        for msg in self.messages:
+            yield json.dumps(self.message_to_dict(msg)) + "\n"
+
+    def to_markdown(self):
+        return "".join(self.iter_markdown())
+
+    def save(self, format: Literal["markdown", "json", "jsonl", "text"]):
+        chunks, file_ext = {
+            "markdown": (self.iter_markdown, "md"),
+            "json": (self.iter_json, "json"),
+            "jsonl": (self.iter_jsonl, "jsonl"),
+            "text": (self.iter_text, "txt"),
+        }[format]
 
         file_name = f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_ext}"
         with open(file_name, "w") as f:
-            f.write(content)
+            f.writelines(chunks())
+
+    @classmethod
+    def message_to_dict(cls, msg: Message) -> dict:
+        return {
+            "sender": msg.sender.name,
+            "timestamp": msg.timestamp.isoformat(),
+            "content": msg.content,
+        }
+
+    @classmethod
+    def message_from_dict(cls, msg_data: dict) -> Message:
+        return cls.Message(
+            sender=Agent(msg_data["sender"], "", []),
+            timestamp=datetime.fromisoformat(msg_data["timestamp"]),
+            content=msg_data["content"],
+        )
+
+    @classmethod
+    def iter_messages(cls, file_path: str) -> Iterator[Message]:
+        """Lazily reads messages from a JSON-lines file, one line at a time."""
+        with open(file_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield cls.message_from_dict(json.loads(line))
 
     @classmethod
     def load(
-        cls, env: Environment, file_path: str, format: Literal["markdown", "json", "text"]
+        cls,
+        env: Environment,
+        file_path: str,
+        format: Literal["markdown", "json", "jsonl", "text"],
+        paged: bool = False,
     ) -> Conversation:
         if format == "json":
             with open(file_path, "r") as f:
@@ -78,14 +190,16 @@ class Conversation(Tool):
 
             conversation = cls(env=env)
             for msg_data in data:
-                sender = Agent(msg_data["sender"], "", [])
-                timestamp = datetime.fromisoformat(msg_data["timestamp"])
-                content = msg_data["content"]
-                message = conversation.Message(
-                    sender=sender, timestamp=timestamp, content=content
-                )
-                conversation.messages.append(message)
+                conversation.messages.append(cls.message_from_dict(msg_data))
             return conversation
+        elif format == "jsonl" and paged:
+            # the file itself backs `messages`; new messages are appended to it
+            messages = PagedMessages(
+                file_path, cls.message_to_dict, cls.message_from_dict
+            )
+            return cls(env=env, messages=messages)
+        elif format == "jsonl":
+            return cls(env=env, messages=list(cls.iter_messages(file_path)))
         else:
             raise NotImplementedError(
                 "Loading from markdown and text formats is not supported yet."
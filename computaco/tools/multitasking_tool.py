@@ -40,7 +40,7 @@ class MultitaskingTool(CompositeTool):
             if self.multitasking_tool.agent_can_remove_tools:
 
                 def close(tool: str):
-                    self.multitasking_tool.tools.remove(
+                    self.multitasking_tool.remove_tool(
                         self.multitasking_tool.get_tool(tool)
                     )
 
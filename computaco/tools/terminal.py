@@ -1,6 +1,16 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import functools
 from pathlib import Path
+import os
+import pty
+import re
 import select
+import shlex
 import subprocess
+import termios
 from dataclasses import dataclass
 
 import attr
@@ -8,6 +18,7 @@ import attr
 from computaco.abstractions.environment import Environment
 from computaco.agents.agent import Agent
 from computaco.tools.buffered_tool import BufferedTool
+from computaco.tools.buffers import RingBuffer
 from computaco.tools.tool import Tool
 
 
@@ -15,6 +26,8 @@ from computaco.tools.tool import Tool
 class Terminal(BufferedTool):
     _process: subprocess.Popen = None
 
+    DEFAULT_BUFFER_FACTORY = functools.partial(RingBuffer, capacity=10_000)
+
     def __init__(
         self,
         proc_invocation: str,
@@ -62,3 +75,141 @@ class Terminal(BufferedTool):
     def insert(self, text: str):
         self._process.stdin.write(text + "\n")
         self._process.stdin.flush()
+
+
+@attr.s
+class QuiescenceDetector:
+    """Decides when a terminal's output is ready to hand back to the agent.
+
+    Output is ready once the process has been silent for `idle` seconds, once the
+    (optional) `prompt` regex matches the tail of the output, or after `max_wait`.
+    """
+
+    idle: float = attr.ib(default=0.1)
+    max_wait: float = attr.ib(default=10.0)
+    prompt: str | None = attr.ib(default=None)
+
+    def is_quiet(self, idle_for: float, waited: float, output: str) -> bool:
+        if waited >= self.max_wait:
+            return True
+        if self.prompt is not None and re.search(self.prompt, output[-256:]):
+            return True
+        return idle_for >= self.idle
+
+
+@attr.s(init=False)
+class AsyncTerminal(Terminal):
+    """A `Terminal` driven by the asyncio event loop instead of `select` polling.
+
+    The process runs on a PTY and is read continuously in the background, so `_fn`
+    (which is awaitable) returns as soon as `quiescence` says the process is idle.
+    """
+
+    quiescence: QuiescenceDetector
+    _master: int = None
+    _unread: list[str]
+    _partial_line: str = ""
+    _last_output: float = 0.0
+    _output_event: asyncio.Event = None
+
+    def __init__(
+        self,
+        proc_invocation: str,
+        path: str | Path,
+        env: Environment,
+        name: str,
+        description: str,
+        examples: list[tuple[BufferedTool.T_INPUT, BufferedTool.T_OUTPUT]] = [],
+        quiescence: QuiescenceDetector = None,
+    ):
+        # the process is started lazily on the running loop (see `start`)
+        BufferedTool.__init__(self, env, name, description, examples)
+        self.proc_invocation = proc_invocation
+        self.path = path
+        self.quiescence = quiescence or QuiescenceDetector()
+        self._unread = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def start(self):
+        master, slave = pty.openpty()
+        # don't echo input back; keeps output identical to the pipe-based `Terminal`
+        mode = termios.tcgetattr(slave)
+        mode[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, mode)
+        self._process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.proc_invocation),
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            cwd=str(self.path),
+            start_new_session=True,
+        )
+        os.close(slave)
+        self._master = master
+        self._output_event = asyncio.Event()
+        asyncio.get_running_loop().add_reader(master, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._master, 65536)
+        except OSError:  # EIO once the process has exited
+            data = b""
+        if not data:
+            asyncio.get_running_loop().remove_reader(self._master)
+            self._output_event.set()
+            return
+
+        text = self._decoder.decode(data).replace("\r\n", "\n")
+        self._unread.append(text)
+        *lines, self._partial_line = (self._partial_line + text).split("\n")
+        self._buffer.extend(line.rstrip("\r") for line in lines)
+        self._last_output = asyncio.get_running_loop().time()
+        self._output_event.set()
+
+    async def _fn(
+        self, agent: Agent, input: BufferedTool.T_INPUT
+    ) -> BufferedTool.T_OUTPUT:
+        if self._process is None:
+            await self.start()
+
+        self._unread.clear()
+        self.insert(input.text_input)
+        await self._wait_until_quiet()
+        output = "".join(self._unread)
+        self._unread.clear()
+
+        self.move_cursor(input.scroll)
+        window = self.window
+        return BufferedTool._T_OUTPUT_COMPLEX(output, window)
+
+    async def _wait_until_quiet(self):
+        loop = asyncio.get_running_loop()
+        start = self._last_output = loop.time()
+        while self._process.returncode is None:
+            now = loop.time()
+            if self.quiescence.is_quiet(
+                now - self._last_output, now - start, "".join(self._unread)
+            ):
+                return
+            self._output_event.clear()
+            try:
+                await asyncio.wait_for(self._output_event.wait(), self.quiescence.idle)
+            except asyncio.TimeoutError:
+                pass
+
+    def insert(self, text: str):
+        os.write(self._master, (text + "\n").encode())
+
+    async def close(self):
+        if self._process is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._master)
+        os.close(self._master)  # hangs up the PTY; interactive shells ignore SIGTERM
+        if self._process.returncode is None:
+            self._process.terminate()
+            try:
+                await asyncio.wait_for(self._process.wait(), self.quiescence.max_wait)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        self._process = self._master = None
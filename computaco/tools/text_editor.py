@@ -4,10 +4,13 @@ from dataclasses import dataclass
 from pathlib import Path
 import threading
 import os
+import stat
 
 import attr
+from computaco.abstractions.project import mark_dirty
 from computaco.agents.agent import Agent
 from computaco.tools.buffered_tool import BufferedTool
+from computaco.tools.buffers import MappedText, PieceTable
 from computaco.tools.tool import Tool
 
 
@@ -15,7 +18,14 @@ from computaco.tools.tool import Tool
 class TextEditor(BufferedTool):
     path: Path = attr.ib()
     _changes: str = attr.ib(default="")
-    _lock = attr.ib(default=threading.Lock())
+    # reentrant: `_fn` holds it while calling the mutators, which take it too
+    _lock: threading.RLock = attr.ib(factory=threading.RLock)
+    # edits are written to disk at most once per `save_delay` seconds
+    save_delay: float = attr.ib(default=0.5)
+    _save_timer: threading.Timer = attr.ib(init=False, default=None)
+
+    DEFAULT_BUFFER_FACTORY = PieceTable
+    MMAP_THRESHOLD = 1 << 20  # files larger than this are memory-mapped on load
 
     def _fn(self, agent: Agent, input: BufferedTool.T_INPUT) -> BufferedTool.T_OUTPUT:
         with self._lock:
@@ -34,18 +44,86 @@ class TextEditor(BufferedTool):
         return f"A text editor for {self.name}"
 
     def insert(self, text: str):
+        with self._lock:
+            row, col = self.cursor_pos
+            self._buffer.insert(self._buffer.offset_of(row, col), text)
+            self._move_cursor_past(text)
+            self._changes += text
+            self._schedule_save()
+
+    def delete(self, start: tuple[int, int], end: tuple[int, int]):
+        """Deletes the text between the (row, col) positions `start` and `end`."""
+        with self._lock:
+            offset = self._buffer.offset_of(*start)
+            length = self._buffer.offset_of(*end) - offset
+            self._buffer.delete(offset, length)
+            self.cursor_pos = start
+            self._changes += f"[deleted {length} characters]"
+            self._schedule_save()
+
+    def replace(self, start: tuple[int, int], end: tuple[int, int], text: str):
+        """Replaces the text between the (row, col) positions `start` and `end`."""
+        with self._lock:
+            offset = self._buffer.offset_of(*start)
+            self._buffer.replace(offset, self._buffer.offset_of(*end) - offset, text)
+            self.cursor_pos = start
+            self._move_cursor_past(text)
+            self._changes += text
+            self._schedule_save()
+
+    def _move_cursor_past(self, text: str):
         row, col = self.cursor_pos
-        self._buffer[row] = self._buffer[row][:col] + text + self._buffer[row][col:]
-        self.cursor_pos = (row, col + len(text))
-        self._changes += text
-        self.save_changes_to_file()
+        *lines, last_line = text.split("\n")
+        if lines:
+            self.cursor_pos = (row + len(lines), len(last_line))
+        else:
+            self.cursor_pos = (row, col + len(text))
 
     def load_buffer(self):
-        with self.path.open("r") as file:
-            lines = file.readlines()
-        self._buffer = [line.rstrip("\n") for line in lines]
+        if self.path.stat().st_size > self.MMAP_THRESHOLD and MappedText.is_mappable(
+            self.path
+        ):
+            original = MappedText(self.path)
+            try:
+                self._buffer = self._new_buffer()
+                self._buffer.insert(0, original)  # counts the rows, reading it once
+                return
+            except UnicodeDecodeError:
+                # not ASCII past the start after all
+                original.close()
+        self._buffer = self._new_buffer()
+        self._buffer.insert(0, self.path.read_text())
+
+    def _schedule_save(self):
+        # the first edit starts the timer; edits made before it fires share its write
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self._save_pending)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_pending(self):
+        with self._lock:
+            self._save_timer = None
+            self.save_changes_to_file()
+
+    def flush(self):
+        """Writes pending edits to disk now instead of waiting for `save_delay`."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+                self.save_changes_to_file()
 
     def save_changes_to_file(self):
-        with self.path.open("w") as file:
-            for line in self._buffer:
-                file.write(line + "\n")
+        # write a sibling file and rename it over the original, so readers never see
+        # a half-written file and a memory-mapped original stays valid
+        with self._lock:
+            tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            with tmp_path.open("w") as file:
+                self._buffer.dump(file)
+                file.flush()
+                os.fsync(file.fileno())
+            if self.path.exists():
+                os.chmod(tmp_path, stat.S_IMODE(self.path.stat().st_mode))
+            os.replace(tmp_path, self.path)
+        mark_dirty(self.path)
@@ -5,6 +5,7 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
+import inspect
 import subprocess
 from typing import TypeVar
 
@@ -62,9 +63,20 @@ class Tool:
     __all_users = attr.ib(init=False, default=set())
 
     def __call__(self, agent: Agent, input):
+        """Broadcasts the tool's output to its users, and returns it (or, for async
+        tools, an awaitable of it)."""
         self.__all_users.add(agent)
         output = self._fn(agent, input)
+        if inspect.isawaitable(output):
+            # async tools (eg, `AsyncTerminal`) broadcast once their output is ready
+            return self._broadcast_when_ready(agent, output)
         self.env.input_tool_output(self, output, sender=agent, recievers=self.__all_users)
+        return output
+
+    async def _broadcast_when_ready(self, agent: Agent, output):
+        output = await output
+        self.env.input_tool_output(self, output, sender=agent, recievers=self.__all_users)
+        return output
 
     def _fn(self, agent: Agent, input: T_INPUT) -> T_OUTPUT:
         raise NotImplementedError()
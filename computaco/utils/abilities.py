@@ -5,6 +5,7 @@ from computaco.environments.conversation import (
     TextMessage,
     VideoMessage,
 )
+from computaco.abstractions.streaming import TextStream
 from computaco.abstractions.types import Audio, Image, Text, Video
 
 
@@ -18,6 +19,18 @@ class HandlesTextOutput:
         raise NotImplementedError()
 
 
+class HandlesTextStreamInput:
+    def input_stream(self, stream: TextStream, *args, remember=True, **kwargs):
+        # `stream` is a message still being generated by `stream.sender`; iterate it to
+        # start on the first chunks, or call `stream.result()` for the whole text
+        raise NotImplementedError()
+
+
+class HandlesTextStreamOutput:
+    def output_stream(self, *args, remember=True, **kwargs) -> TextStream | None:
+        raise NotImplementedError()
+
+
 class HandlesImageInput:
     def input_image(self, video: Image, *args, sender="Info", remember=True, **kwargs):
         raise NotImplementedError()
@@ -54,6 +67,11 @@ class HandlesAnyInput(
     def input(self, message: str | Message | None, *args, remember=True, **kwargs):
         raise NotImplementedError()
 
+    def input_batch(self, messages: list[tuple[str | Message, any]], *args, **kwargs):
+        # (message, sender) pairs queued for this agent; override to take them in bulk
+        for message, sender in messages:
+            self.input(message, *args, sender=sender, **kwargs)
+
     def __call__(self, message: str | Message | None, *args, remember=True, **kwargs):
         return self.input(message, *args, remember=remember, **kwargs)
 
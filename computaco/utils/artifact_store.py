@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
+
+import attr
+
+from computaco.utils.blob_store import BlobStore
+
+_ADDRESS = re.compile(r"\b0x[0-9a-fA-F]{4,}\b")
+
+
+def fingerprint(value):
+    """A json-able stand-in for `value` in an artifact key. Objects can define a
+    `fingerprint()` method (agents do: name, prompt and engine); other objects are
+    represented by their class and `repr`, which mustn't contain a memory address
+    (the key would change every run)."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        # iteration order of sets of str changes with the hash seed
+        return sorted(
+            (fingerprint(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True)
+        )
+    if isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in value.items()}
+    if hasattr(value, "fingerprint"):
+        return fingerprint(value.fingerprint())
+    text = repr(value)
+    if _ADDRESS.search(text):
+        raise TypeError(
+            f"Can't fingerprint {type(value).__qualname__}: its repr has a memory "
+            "address. Define a `fingerprint()` method or `__repr__` for it."
+        )
+    return f"{type(value).__qualname__}:{text}"
+
+
+@attr.s
+class ArtifactStats:
+    hits: int = attr.ib(default=0)
+    misses: int = attr.ib(default=0)
+    evictions: int = attr.ib(default=0)
+
+
+class ArtifactStore:
+    """Artifacts keyed by what they were made from.
+
+    `key` hashes an artifact's name and inputs (eg, the prompt, the upstream
+    artifacts and the agents that made it), so a phase that runs again with the
+    same inputs can read its artifact back instead of making it. Contents live in a
+    `BlobStore` (artifacts with equal contents are stored once) and an SQLite index
+    maps keys to them. Least recently used artifacts beyond `max_bytes` are evicted.
+
+    >>> store = ArtifactStore(project.path / ".computacode" / "artifacts")
+    >>> key = store.key("basic_info.md", prompt=prompt, client=fingerprint(client))
+    >>> data = store.get(key)
+    >>> if data is None:
+    ...     store.put(key, "basic_info.md", make_basic_info().encode())
+    """
+
+    DEFAULT_MAX_BYTES = 1 << 30
+
+    def __init__(self, path: str | Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.stats = ArtifactStats()
+        self.blobs = BlobStore(self.path / "blobs")
+        # a cache, so it's kept out of the project's checkpoints
+        (self.path / ".gitignore").write_text("*\n")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path / "index.sqlite", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "key TEXT PRIMARY KEY, name TEXT, blob TEXT, size INTEGER, "
+            "created REAL, accessed REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(name: str, **inputs) -> str:
+        blob = json.dumps([name, fingerprint(inputs)], sort_keys=True).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT blob FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] not in self.blobs:
+                self.stats.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE artifacts SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+            self.stats.hits += 1
+        return self.blobs.get(row[0])
+
+    def put(self, key: str, name: str, data: bytes):
+        blob = self.blobs.put(data)
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                (key, name, blob, len(data), now, now),
+            )
+            self._evict(self.max_bytes)
+            self._db.commit()
+
+    def evict(self, max_bytes: int = 0):
+        """Drops least recently used artifacts until at most `max_bytes` are left."""
+        with self._lock:
+            self._evict(max_bytes)
+            self._db.commit()
+
+    def _evict(self, max_bytes: int):
+        total = self._db.execute("SELECT SUM(size) FROM artifacts").fetchone()[0] or 0
+        if total <= max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, blob, size FROM artifacts ORDER BY accessed"
+        ).fetchall()
+        for key, blob, size in rows:
+            if total <= max_bytes:
+                break
+            self._db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            total -= size
+            self.stats.evictions += 1
+            # blobs are shared by artifacts with equal contents
+            if not self._db.execute(
+                "SELECT 1 FROM artifacts WHERE blob = ? LIMIT 1", (blob,)
+            ).fetchone():
+                self.blobs.delete(blob)
+
+    def names(self) -> dict[str, int]:
+        """{artifact name: number of stored versions}"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, COUNT(*) FROM artifacts GROUP BY name"
+            ).fetchall()
+        return dict(rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
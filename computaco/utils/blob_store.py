@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+import pickle
+import uuid
+
+
+class BlobStore:
+    """Content-addressed store for large payloads (images, audio, video, ...).
+
+    Blobs are keyed by the sha256 of their bytes, so storing the same payload twice
+    costs nothing, and live under `path/<first 2 hex chars>/<rest>`.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _blob_path(self, key: str) -> Path:
+        return self.path / key[:2] / key[2:]
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(key)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(exist_ok=True)
+            # unique per writer, so threads storing the same blob don't share one
+            tmp_path = blob_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, blob_path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self._blob_path(key).read_bytes()
+
+    def __contains__(self, key: str) -> bool:
+        return self._blob_path(key).exists()
+
+    def delete(self, key: str):
+        self._blob_path(key).unlink(missing_ok=True)
+
+    def put_object(self, obj) -> BlobRef:
+        return BlobRef(self, self.put(pickle.dumps(obj)))
+
+
+class BlobRef:
+    """Reference to a pickled object in a `BlobStore`; `load` reads it back."""
+
+    __slots__ = ("store", "key")
+
+    def __init__(self, store: BlobStore, key: str):
+        self.store = store
+        self.key = key
+
+    def load(self):
+        return pickle.loads(self.store.get(self.key))
+
+    def __getstate__(self):
+        return (str(self.store.path), self.key)
+
+    def __setstate__(self, state):
+        path, self.key = state
+        self.store = BlobStore(path)
+
+    def __repr__(self):
+        return f"BlobRef({self.key[:12]})"
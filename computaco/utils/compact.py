@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from datetime import datetime, tzinfo
+import threading
+
+from computaco.utils.blob_store import BlobRef, BlobStore
+
+
+class Interner:
+    """Maps each distinct value to a small int, so records can store the int.
+
+    Plain values like strings are matched by equality, other objects (eg, agents)
+    by identity, so they needn't be hashable. Every value is kept, so a record's
+    sender can always be read back, even once nothing else refers to it.
+    """
+
+    def __init__(self):
+        self._ids: dict[any, int] = {}
+        self._values: list = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, (str, bytes, int, float, bool, type(None), tuple)):
+            return ("value", value)
+        return ("id", id(value))  # stable, since the value is kept
+
+    def intern(self, value) -> int:
+        key = self._key(value)
+        with self._lock:
+            id = self._ids.get(key)
+            if id is None:
+                id = self._ids[key] = len(self._values)
+                self._values.append(value)
+        return id
+
+    def __getitem__(self, id: int):
+        return self._values[id]
+
+    def __len__(self):
+        return len(self._values)
+
+
+SENDERS = Interner()
+
+
+def to_epoch_us(timestamp: datetime | int) -> int:
+    """Microseconds since the epoch, in UTC (naive timestamps are taken as local)."""
+    if isinstance(timestamp, int):
+        return timestamp
+    return (
+        int(timestamp.replace(microsecond=0).timestamp()) * 10**6 + timestamp.microsecond
+    )
+
+
+def from_epoch_us(epoch_us: int, tz: tzinfo = None) -> datetime:
+    """The inverse of `to_epoch_us`: a naive local datetime, or an aware one in `tz`."""
+    seconds, microseconds = divmod(epoch_us, 10**6)
+    return datetime.fromtimestamp(seconds, tz).replace(microsecond=microseconds)
+
+
+def offload(value, store: BlobStore | None):
+    """Moves `value` into `store` unless it's small and plain (text, numbers, ...)."""
+    if store is None or isinstance(value, (str, int, float, bool, type(None), BlobRef)):
+        return value
+    return store.put_object(value)
+
+
+def unload(value):
+    return value.load() if isinstance(value, BlobRef) else value
+
+
+class CompactMessage:
+    """Message with `__slots__`, an interned sender, and an integer timestamp.
+
+    `sender`, `timestamp`, and `content` read like plain attributes. Call `offload`
+    to move non-text content into a `BlobStore`; it is then re-read on each access.
+    """
+
+    __slots__ = ("_sender", "_timestamp", "_content")
+
+    def __init__(self, sender, timestamp: datetime | int, content):
+        self._sender = SENDERS.intern(sender)
+        self._timestamp = to_epoch_us(timestamp)
+        self._content = content
+
+    @property
+    def sender(self):
+        return SENDERS[self._sender]
+
+    @property
+    def timestamp(self) -> datetime:
+        return from_epoch_us(self._timestamp)
+
+    @property
+    def content(self):
+        return unload(self._content)
+
+    def offload(self, store: BlobStore | None):
+        self._content = offload(self._content, store)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}({self.sender!r}, {self.timestamp}, {self._content!r})"
+        )
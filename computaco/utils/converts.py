@@ -2,6 +2,8 @@ from computaco.abstractions.types import Image
 
 
 class Markdown:
+    __slots__ = ()
+
     @property
     def markdown(self) -> str:
         raise NotImplementedError()
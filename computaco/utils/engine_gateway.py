@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future
+import contextvars
+import json
+import threading
+import time
+from typing import Callable
+
+import attr
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+from computaco.utils.rate_limit import current_flow, current_priority
+
+
+class TokenBudget:
+    """Tokens-per-minute budget shared by every engine of a gateway.
+
+    `acquire` blocks until the tokens spent over the last `window` seconds leave room
+    for the request, so bursts are spread out before the API starts rejecting them.
+    A single request larger than the whole budget is let through on an empty window.
+    """
+
+    def __init__(self, tokens_per_minute: int = 90_000, window: float = 60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._spent: deque[tuple[float, int]] = deque()
+        self._total = 0
+        self._condition = threading.Condition()
+
+    def _expire(self, now: float):
+        while self._spent and now - self._spent[0][0] >= self.window:
+            self._total -= self._spent.popleft()[1]
+
+    def acquire(self, tokens: int):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if not self._spent or self._total + tokens <= self.tokens_per_minute:
+                    break
+                self._condition.wait(self._spent[0][0] + self.window - now)
+            self._spent.append((now, tokens))
+            self._total += tokens
+
+    def adjust(self, tokens: int):
+        """Records `tokens` more (or, if negative, fewer) than were acquired, once the
+        API reports actual usage."""
+        with self._condition:
+            self._spent.append((time.monotonic(), tokens))
+            self._total += tokens
+            self._condition.notify_all()
+
+    @property
+    def available(self) -> int:
+        with self._condition:
+            self._expire(time.monotonic())
+            return self.tokens_per_minute - self._total
+
+
+@attr.s(slots=True)
+class _Request:
+    prompt: str = attr.ib()
+    stop: list[str] = attr.ib()
+    kwargs: dict = attr.ib()
+    future: Future = attr.ib()
+    level: int = attr.ib()  # `rate_limit` priority and flow of the caller
+    flow: any = attr.ib()
+    context: contextvars.Context = attr.ib()  # the caller's, to send it in
+
+
+class BatchingEngine:
+    """Callable stand-in for a langchain LLM that sends prompts through a gateway.
+
+    Prompts submitted concurrently within `max_wait` seconds of each other are sent
+    to the backend as one `generate` call of up to `max_batch_size` prompts. The
+    first caller of a batch waits out the window and sends it; the others just wait
+    for their result. With `max_batch_size=1` (eg, chat models that only take one
+    prompt per request) calls are sent right away. The most urgent calls are
+    batched first, and only calls with the same `priority` and flow (see
+    `rate_limit`) share a request, which is sent in the context of its first call,
+    most urgent requests first. Other keyword arguments are passed on to `generate`;
+    only calls with the same `stop` and arguments share a request.
+
+    Any other attribute is looked up on `llm`.
+    """
+
+    def __init__(
+        self,
+        gateway: EngineGateway,
+        llm,
+        max_batch_size: int = 20,
+        generate: Callable = None,
+    ):
+        self.gateway = gateway
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.generate = generate or llm.generate
+        self._pending: list[_Request] = []
+        self._has_leader = False
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str, stop: list[str] = None, **kwargs) -> str:
+        future = Future()
+        request = _Request(
+            prompt,
+            stop,
+            kwargs,
+            future,
+            current_priority(),
+            current_flow(),
+            contextvars.copy_context(),
+        )
+        if self.max_batch_size <= 1:
+            self._send([request])
+            return future.result()
+
+        batch, lead = None, False
+        with self._lock:
+            self._pending.append(request)
+            if len(self._pending) >= self.max_batch_size:
+                # the most urgent go first; the rest wait for the next batch
+                self._pending.sort(key=lambda r: r.level)
+                batch = self._pending[: self.max_batch_size]
+                del self._pending[: self.max_batch_size]
+            elif not self._has_leader:
+                self._has_leader = lead = True
+        if batch:
+            self._send(batch)
+        elif lead:
+            time.sleep(self.gateway.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._has_leader = False
+            if batch:
+                self._send(batch)
+        return future.result()
+
+    def _send(self, batch: list[_Request]):
+        # `generate` takes one `stop` (and set of arguments) for all of its prompts,
+        # and is paced at one priority and flow
+        groups: dict[tuple, list[_Request]] = {}
+        for request in batch:
+            key = (
+                request.level,
+                repr(request.flow),
+                tuple(request.stop or ()),
+                json.dumps(request.kwargs, sort_keys=True, default=repr),
+            )
+            groups.setdefault(key, []).append(request)
+        for group in sorted(groups.values(), key=lambda group: group[0].level):
+            first = group[0]
+            first.context.run(
+                self._send_group,
+                [request.prompt for request in group],
+                first.stop,
+                first.kwargs,
+                [request.future for request in group],
+            )
+
+    def _send_group(
+        self, prompts: list[str], stop: list[str], kwargs: dict, futures: list[Future]
+    ):
+        try:
+            estimate = sum(self.gateway.estimate_tokens(self.llm, p) for p in prompts)
+            self.gateway.budget.acquire(estimate)
+            result = self.generate(prompts, stop=stop, **kwargs)
+            if len(result.generations) != len(prompts):
+                raise RuntimeError(
+                    f"BatchingEngine: {len(result.generations)} generations for "
+                    f"{len(prompts)} prompts."
+                )
+            for future, generations in zip(futures, result.generations):
+                future.set_result(generations[0].text)
+            usage = (result.llm_output or {}).get("token_usage", {}).get("total_tokens")
+            if usage is not None:
+                self.gateway.budget.adjust(usage - estimate)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # never leave a caller waiting, whatever went wrong
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError("BatchingEngine: no result."))
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+class EngineGateway:
+    """Shared front door for the registry engines.
+
+    Batches concurrent prompts per engine (see `BatchingEngine`), spends from one
+    global `TokenBudget`, and, once `pool_connections` is called, sends every
+    OpenAI request over a pooled keep-alive session. Point `api_base` at a local
+    stub server to test without the real API.
+    """
+
+    DEFAULT_MAX_TOKENS = 256  # completion size assumed when the engine doesn't say
+
+    def __init__(
+        self,
+        tokens_per_minute: int = 90_000,
+        max_wait: float = 0.02,
+        pool_size: int = 16,
+        api_base: str = None,
+    ):
+        self.budget = TokenBudget(tokens_per_minute)
+        self.max_wait = max_wait
+        self.pool_size = pool_size
+        self.api_base = api_base
+        self.session: requests.Session = None
+
+    def pool_connections(self) -> requests.Session:
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size, pool_maxsize=self.pool_size
+            )
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        openai.requestssession = self.session
+        if self.api_base is not None:
+            openai.api_base = self.api_base
+        return self.session
+
+    def engine(self, llm, max_batch_size: int = 20, generate: Callable = None):
+        return BatchingEngine(self, llm, max_batch_size=max_batch_size, generate=generate)
+
+    def estimate_tokens(self, llm, prompt: str) -> int:
+        # ~4 characters per token, plus room for the completion
+        max_tokens = getattr(llm, "max_tokens", None)
+        if max_tokens is None or max_tokens < 0:
+            max_tokens = self.DEFAULT_MAX_TOKENS
+        return len(prompt) // 4 + max_tokens
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
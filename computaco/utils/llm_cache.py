@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+import attr
+
+
+@attr.s
+class CacheStats:
+    memory_hits: int = attr.ib(default=0)
+    disk_hits: int = attr.ib(default=0)
+    misses: int = attr.ib(default=0)
+    bypassed: int = attr.ib(default=0)  # calls that skipped the lookup
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False, eq=False)
+
+    def add(self, name: str, count: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class MemoryCache:
+    """LRU of responses, bounded by `max_entries`. Entries older than `ttl` seconds
+    are treated as missing."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str, created: float = None):
+        with self._lock:
+            self._entries[key] = (time.time() if created is None else created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """Persistent responses in a SQLite file, shared across runs (and processes).
+
+    Least recently used entries beyond `max_entries` are evicted every
+    `evict_every` puts, and entries older than `ttl` seconds are treated as missing.
+    The file is only created on first use.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = 100_000,
+        ttl: float = None,
+        evict_every: int = 256,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._num_puts = 0
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # called with `_lock` held
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key: str) -> tuple[float, str] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT created, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl is not None and now - row[0] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            return row
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._num_puts += 1
+            if self._num_puts % self.evict_every == 0:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class ResponseCache:
+    """Two-tier cache of LLM responses, keyed on an exact match of the model, its
+    parameters, and the prompt (plus call arguments like `stop`).
+
+    Lookups try `memory` first, then `disk`; disk hits are promoted to memory.
+    Either tier may be None.
+    """
+
+    def __init__(self, memory: MemoryCache = None, disk: SQLiteCache = None):
+        self.memory = memory
+        self.disk = disk
+        self.stats = CacheStats()
+
+    @staticmethod
+    def key(model: str, params: dict, prompt: str, **kwargs) -> str:
+        blob = json.dumps(
+            [model, params, prompt, kwargs], sort_keys=True, default=str
+        ).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        if self.memory is not None and (value := self.memory.get(key)) is not None:
+            self.stats.add("memory_hits")
+            return value
+        if self.disk is not None and (row := self.disk.get(key)) is not None:
+            self.stats.add("disk_hits")
+            created, value = row
+            if self.memory is not None:
+                self.memory.put(key, value, created=created)
+            return value
+        self.stats.add("misses")
+        return None
+
+    def put(self, key: str, value: str):
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self):
+        for tier in (self.memory, self.disk):
+            if tier is not None:
+                tier.clear()
+
+    def wrap(
+        self, engine, model: str, params: dict = None, temperature: float = 0.0
+    ) -> CachedEngine:
+        return CachedEngine(engine, self, model, params or {}, temperature)
+
+
+class CachedEngine:
+    """Calls `engine` only on cache misses. Pass `cache=False` to always call it
+    (eg, when a fresh sample is wanted); the response still refreshes the cache.
+    Sampled calls skip the cache altogether unless `cache=True` is passed, so they
+    stay random: calls with a `temperature` above 0, or without one if the engine's
+    own `temperature` (its default, eg 0.7 for langchain's `OpenAI`) is above 0.
+
+    A prompt that starts with a rendered `PromptPrefix` can pass its `(key, length)`
+    as `prefix`; only the rest of the prompt is hashed then, since the key already
+    stands for the prefix. Any other attribute is looked up on `engine`.
+    """
+
+    accepts_prefix = True
+
+    def __init__(
+        self,
+        engine,
+        cache: ResponseCache,
+        model: str,
+        params: dict,
+        temperature: float = 0.0,
+    ):
+        self.engine = engine
+        self.cache = cache
+        self.model = model
+        self.params = params
+        self.temperature = temperature
+
+    def __call__(
+        self,
+        prompt: str,
+        stop: list[str] = None,
+        cache: bool = None,
+        prefix: tuple[str, int] = None,
+        **kwargs,
+    ):
+        if prefix is None:
+            key = self.cache.key(self.model, self.params, prompt, stop=stop, **kwargs)
+        else:
+            prefix_key, length = prefix
+            key = self.cache.key(
+                self.model,
+                self.params,
+                prompt[length:],
+                stop=stop,
+                prefix=prefix_key,
+                **kwargs,
+            )
+        temperature = kwargs.get("temperature", self.temperature)
+        store = True
+        if cache is None:
+            # sampled calls neither read nor fill the cache unless asked to
+            cache = store = temperature <= 0
+        if cache:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+        else:
+            self.cache.stats.add("bypassed")
+        response = self.engine(prompt, stop=stop, **kwargs)
+        if store and isinstance(response, str):
+            self.cache.put(key, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from array import array
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import threading
+from typing import Iterator
+
+# every record is: header length, payload length, json header, opaque payload
+_PREFIX = struct.Struct("<II")
+_OFFSET = struct.Struct("<Q")
+
+
+class MessageLog:
+    """Append-only log of message records, split into fixed-size segments.
+
+    Each record is a small JSON header (sender, timestamp, text, markdown, ...) plus an
+    opaque binary payload (eg, pickled media). Exports only ever decode headers.
+    Every segment `NNNNNN.log` has an `NNNNNN.idx` of record offsets next to it, so
+    opening a log doesn't scan it. Writes are fsynced once every `sync_every` records
+    (and on `flush`/`close`), and reads go through `mmap`.
+
+    >>> log = MessageLog(path)
+    >>> log.append({"sender": "Alice", "text": "hi"})
+    0
+    >>> log.header(0)
+    {'sender': 'Alice', 'text': 'hi'}
+    """
+
+    def __init__(self, path: str | Path, segment_size=64 << 20, sync_every=32):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+
+        self._record_segments = array("I")
+        self._record_offsets = array("Q")
+        self._maps: dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+        self._num_unsynced = 0
+
+        segments = sorted(int(p.stem) for p in self.path.glob("*.log"))
+        for segment in segments:
+            self._load_index(segment)
+        self._open_segment(segments[-1] if segments else 0)
+
+    def _segment_path(self, segment: int, suffix: str) -> Path:
+        return self.path / f"{segment:06d}.{suffix}"
+
+    def _load_index(self, segment: int):
+        offsets = array("Q")
+        index_path = self._segment_path(segment, "idx")
+        if index_path.exists():
+            offsets.frombytes(index_path.read_bytes())
+        size = self._segment_path(segment, "log").stat().st_size
+        # records written after the last index flush (eg, after a crash) are recovered
+        # by walking the length prefixes from the last indexed record
+        with self._segment_path(segment, "log").open("rb") as file:
+            offset = 0
+            if offsets:
+                file.seek(offsets[-1])
+                header_size, payload_size = _PREFIX.unpack(file.read(_PREFIX.size))
+                offset = offsets[-1] + _PREFIX.size + header_size + payload_size
+            while offset + _PREFIX.size <= size:
+                file.seek(offset)
+                header_size, payload_size = _PREFIX.unpack(file.read(_PREFIX.size))
+                end = offset + _PREFIX.size + header_size + payload_size
+                if end > size:
+                    break  # torn write; it is overwritten by the next append
+                offsets.append(offset)
+                offset = end
+        self._record_segments.extend([segment] * len(offsets))
+        self._record_offsets.extend(offsets)
+        self._end_offset = offset
+
+    def _open_segment(self, segment: int):
+        self._segment = segment
+        log_path = self._segment_path(segment, "log")
+        if not log_path.exists():
+            self._end_offset = 0
+        self._log_file = log_path.open("r+b" if log_path.exists() else "w+b")
+        self._log_file.truncate(self._end_offset)
+        self._log_file.seek(self._end_offset)
+        self._index_file = self._segment_path(segment, "idx").open("wb")
+        self._index_file.write(
+            array("Q", self._record_offsets[len(self) - self._num_in_segment() :])
+        )
+
+    def _num_in_segment(self) -> int:
+        count = 0
+        for segment in reversed(self._record_segments):
+            if segment != self._segment:
+                break
+            count += 1
+        return count
+
+    def __len__(self):
+        return len(self._record_offsets)
+
+    def append(self, header: dict, payload: bytes = b"") -> int:
+        header = json.dumps(header).encode()
+        with self._lock:
+            if self._end_offset >= self.segment_size:
+                self._roll()
+            self._log_file.write(_PREFIX.pack(len(header), len(payload)))
+            self._log_file.write(header)
+            self._log_file.write(payload)
+            self._index_file.write(_OFFSET.pack(self._end_offset))
+            self._record_segments.append(self._segment)
+            self._record_offsets.append(self._end_offset)
+            self._end_offset += _PREFIX.size + len(header) + len(payload)
+            self._num_unsynced += 1
+            if self._num_unsynced >= self.sync_every:
+                self._sync()
+            return len(self) - 1
+
+    def _roll(self):
+        self._sync()
+        self._log_file.close()
+        self._index_file.close()
+        self._open_segment(self._segment + 1)
+
+    def _sync(self):
+        for file in (self._log_file, self._index_file):
+            file.flush()
+            os.fsync(file.fileno())
+        self._num_unsynced = 0
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        mapping = self._maps.get(segment)
+        if mapping is None or len(mapping) < end:
+            if segment == self._segment:
+                with self._lock:
+                    self._log_file.flush()
+            if mapping is not None:
+                mapping.close()
+            with self._segment_path(segment, "log").open("rb") as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapping
+        return mapping
+
+    def _locate(self, index: int) -> tuple[mmap.mmap, int, int, int]:
+        segment, offset = self._record_segments[index], self._record_offsets[index]
+        mapping = self._map(segment, offset + _PREFIX.size)
+        header_size, payload_size = _PREFIX.unpack_from(mapping, offset)
+        start = offset + _PREFIX.size
+        mapping = self._map(segment, start + header_size + payload_size)
+        return mapping, start, header_size, payload_size
+
+    def header(self, index: int) -> dict:
+        mapping, start, header_size, _ = self._locate(index)
+        return json.loads(mapping[start : start + header_size])
+
+    def payload(self, index: int) -> bytes:
+        mapping, start, header_size, payload_size = self._locate(index)
+        return mapping[start + header_size : start + header_size + payload_size]
+
+    def headers(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self.header(index)
+
+    def close(self):
+        with self._lock:
+            if self._log_file.closed:
+                return
+            self._sync()
+            self._log_file.close()
+            self._index_file.close()
+        for mapping in self._maps.values():
+            mapping.close()
+        self._maps.clear()
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+from enum import IntEnum
+import itertools
+import random
+import threading
+import time
+from typing import Callable
+
+
+class Priority(IntEnum):
+    """Lower goes first. Interactive (user-facing) calls beat background ones, such
+    as evaluators deciding whether a conversation is done."""
+
+    INTERACTIVE = 0
+    NORMAL = 5
+    BACKGROUND = 10
+
+
+_priority = contextvars.ContextVar("priority", default=Priority.NORMAL)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+_flow = contextvars.ContextVar("flow", default=None)
+
+
+def current_flow():
+    return _flow.get()
+
+
+@contextlib.contextmanager
+def flow(name):
+    """Attributes the engine calls made inside the block to `name` (eg, a process),
+    so capacity is shared fairly between flows instead of first come, first served."""
+    token = _flow.set(name)
+    try:
+        yield
+    finally:
+        _flow.reset(token)
+
+
+@contextlib.contextmanager
+def priority(level: Priority):
+    """Runs the engine calls made inside the block at `level`.
+
+    >>> with priority(Priority.BACKGROUND):
+    ...     evaluator("Are you ready to move on to the next step?")
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Allows `rate` units per second on average, and bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError(f"TokenBucket: rate must be positive, got {rate}.")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def take(self, amount: float = 1):
+        """Blocks until `amount` units are available, then takes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empties the bucket (eg, after the API says we are over the limit)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = 0
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit that adapts with AIMD, admitting waiters by priority.
+
+    Every success adds `increase / limit` to the limit, so it grows by about
+    `increase` per round trip. Every throttle, and every call slower than
+    `target_latency` (if set), multiplies it by `decrease`.
+
+    Callers wait for a slot in priority order. Within a priority, the caller whose
+    `flow` has the fewest calls in flight goes first, so one busy flow can't take
+    every slot from the others.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        target_latency: float = None,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._flow_in_flight: dict[any, int] = {}
+        self._waiters: list[tuple[int, any, int]] = []  # (priority, flow, ticket)
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def _next_waiter(self) -> tuple[int, any, int]:
+        return min(
+            self._waiters,
+            key=lambda w: (w[0], self._flow_in_flight.get(w[1], 0), w[2]),
+        )
+
+    def acquire(self, level: Priority = Priority.NORMAL, flow=None):
+        with self._condition:
+            waiter = (int(level), flow, next(self._tickets))
+            self._waiters.append(waiter)
+            self._condition.wait_for(
+                lambda: self.in_flight < int(self.limit) and self._next_waiter() == waiter
+            )
+            self._waiters.remove(waiter)
+            self.in_flight += 1
+            self._flow_in_flight[flow] = self._flow_in_flight.get(flow, 0) + 1
+            self._condition.notify_all()
+
+    def release(
+        self, latency: float = None, throttled: bool = False, flow=None, failed=False
+    ):
+        """Frees the caller's slot. Calls that `failed` for reasons other than
+        throttling (eg, a server error) leave the limit as it is."""
+        with self._condition:
+            self.in_flight -= 1
+            self._flow_in_flight[flow] -= 1
+            if not self._flow_in_flight[flow]:
+                del self._flow_in_flight[flow]
+            if failed and not throttled:
+                self._condition.notify_all()
+                return
+            slow = (
+                latency is not None
+                and self.target_latency is not None
+                and latency > self.target_latency
+            )
+            if throttled or slow:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+
+def is_throttle(error: Exception) -> bool:
+    """Whether `error` is the API telling us to slow down (HTTP 429)."""
+    return (
+        getattr(error, "http_status", None) == 429
+        or type(error).__name__ == "RateLimitError"
+    )
+
+
+_TRANSIENT_ERRORS = {
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "Timeout",
+    "TryAgain",
+}
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether `error` is likely to go away on its own: server errors (HTTP 5xx),
+    timeouts and dropped connections."""
+    status = getattr(error, "http_status", None)
+    return (
+        (status is not None and status >= 500)
+        or type(error).__name__ in _TRANSIENT_ERRORS
+        or isinstance(error, (TimeoutError, ConnectionError))
+    )
+
+
+class RateLimiter:
+    """Proactive rate limiting for engine calls.
+
+    A call takes one unit from each of its `buckets` (eg, one per model and one per
+    API key), then waits for `concurrency` to admit it in priority order. Throttled
+    calls drain those buckets, shrink the concurrency limit, and are retried after a
+    short jittered delay. Transient errors (see `is_transient`) are retried with
+    jittered exponential backoff, up to `max_delay` seconds, and leave the limits
+    alone. Either way, at most `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        concurrency: AdaptiveConcurrency = None,
+        max_retries: int = 5,
+        retry_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, name: str, requests_per_minute: float) -> TokenBucket:
+        if requests_per_minute <= 0:
+            raise ValueError(
+                f"RateLimiter: requests_per_minute for {name} must be positive, "
+                f"got {requests_per_minute}."
+            )
+        if name not in self.buckets:
+            rate = requests_per_minute / 60
+            self.buckets[name] = TokenBucket(rate, capacity=max(rate, 1))
+        return self.buckets[name]
+
+    def call(self, fn: Callable, *args, buckets: list[TokenBucket] = (), **kwargs):
+        level, name = current_priority(), current_flow()
+        for attempt in range(self.max_retries + 1):
+            # no slot is held while waiting for the buckets
+            for bucket in buckets:
+                bucket.take()
+            self.concurrency.acquire(level, name)
+            start, throttled, failed = time.monotonic(), False, False
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttle(e)
+                failed = True
+                if not (throttled or is_transient(e)) or attempt == self.max_retries:
+                    raise
+                if throttled:
+                    for bucket in buckets:
+                        bucket.drain()
+            finally:
+                latency = time.monotonic() - start
+                self.concurrency.release(latency, throttled, name, failed)
+            if throttled:
+                delay = self.retry_delay
+            else:
+                delay = min(self.max_delay, self.retry_delay * 2**attempt)
+            time.sleep(delay * (1 + random.random()))
+
+    def wrap(self, fn: Callable, buckets: list[TokenBucket] = ()) -> Callable:
+        def limited(*args, **kwargs):
+            return self.call(fn, *args, buckets=buckets, **kwargs)
+
+        return limited
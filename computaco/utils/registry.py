@@ -1,15 +1,118 @@
+import hashlib
+import os
+from pathlib import Path
+
 from langchain.llms import OpenAI, OpenAIChat
 from langchain.llms.base import BaseLLM
 
-from computils.computils.fns.exponential_backoff import ExponentialBackoff
+from computaco.utils.engine_gateway import EngineGateway
+from computaco.utils.llm_cache import MemoryCache, ResponseCache, SQLiteCache
+from computaco.utils.rate_limit import AdaptiveConcurrency, RateLimiter
+from computaco.utils.router import CallKind, ModelRouter
+
+# requests are paced by token buckets per model and per API key before they are
+# sent, instead of backing off after the API rejects them. Concurrency adapts to
+# 429s and latency, and calls inside `rate_limit.priority(...)` jump the queue.
+REQUESTS_PER_MINUTE = {
+    "text-babbage-001": 3_000,
+    "text-curie-001": 3_000,
+    "text-davinci-003": 3_000,
+    "gpt-3.5-turbo": 3_500,
+    "gpt-4": 200,
+}
+API_KEY_REQUESTS_PER_MINUTE = 3_500
+rate_limiter = RateLimiter(
+    AdaptiveConcurrency(initial=4, max_limit=32, target_latency=30)
+)
+_api_key_bucket = rate_limiter.bucket(
+    "key:"
+    + hashlib.sha256(os.environ.get("OPENAI_API_KEY", "").encode()).hexdigest()[:8],
+    API_KEY_REQUESTS_PER_MINUTE,
+)
+
+# every engine shares one token-per-minute budget and one pooled HTTP session.
+# Set OPENAI_API_BASE to send requests to a local stub server instead.
+gateway = EngineGateway(
+    tokens_per_minute=int(os.environ.get("COMPUTACO_TOKENS_PER_MINUTE", 90_000)),
+    api_base=os.environ.get("OPENAI_API_BASE"),
+)
+gateway.pool_connections()
+
+# identical prompts (eg, repeated evaluator questions) are answered from here instead
+# of the API; sampled calls (temperature > 0) skip it unless passed `cache=True`. The
+# on-disk tier is created on first use; set COMPUTACO_CACHE_DIR to move it, or pass
+# `cache=False` to an engine call to skip the lookup.
+CACHE_DIR = Path(
+    os.environ.get("COMPUTACO_CACHE_DIR", Path.home() / ".cache" / "computaco")
+)
+response_cache = ResponseCache(
+    memory=MemoryCache(max_entries=1024),
+    disk=SQLiteCache(CACHE_DIR / "llm_responses.sqlite", max_entries=100_000),
+)
+
 
-_rate_limit = ExponentialBackoff(scale=5, max_wait=60)
+def _temperature(llm: BaseLLM) -> float:
+    # `OpenAIChat` has no temperature of its own; the chat API then samples at 1
+    if isinstance(llm, OpenAIChat):
+        return llm.model_kwargs.get("temperature", 1.0)
+    return llm.temperature
 
-small_completion_engine: BaseLLM = _rate_limit(
-    OpenAI("text-curie-001")
+
+def _cached(llm: BaseLLM, model: str, max_batch_size: int = 20) -> BaseLLM:
+    # `rate_limiter` retries failed calls; langchain retrying each of them as well
+    # would multiply the attempts against a rate limit
+    llm.max_retries = 0
+    buckets = [rate_limiter.bucket(model, REQUESTS_PER_MINUTE[model]), _api_key_bucket]
+    engine = gateway.engine(
+        llm,
+        max_batch_size=max_batch_size,
+        generate=rate_limiter.wrap(llm.generate, buckets),
+    )
+    return response_cache.wrap(
+        engine, model, llm._identifying_params, temperature=_temperature(llm)
+    )
+
+
+# only asked short, easily checked questions (see `router`), so it doesn't sample and
+# repeated questions are answered from the cache
+tiny_completion_engine: BaseLLM = _cached(
+    OpenAI(model_name="text-babbage-001", temperature=0), "text-babbage-001"
+)
+small_completion_engine: BaseLLM = _cached(
+    OpenAI(model_name="text-curie-001"), "text-curie-001"
 )  # TODO: change to alpaca once it's available
-large_completion_engine: BaseLLM = _rate_limit(
-    OpenAI("text-davinci-003")
+large_completion_engine: BaseLLM = _cached(
+    OpenAI(model_name="text-davinci-003"), "text-davinci-003"
 )  # TODO: change to alpaca once it's available
-small_chat_engine: BaseLLM = _rate_limit(OpenAIChat(model_name="gpt-3.5-turbo"))
-large_chat_engine: BaseLLM = _rate_limit(OpenAIChat(model_name="gpt-4"))
+# chat models take one prompt per request, so they are paced but not batched
+small_chat_engine: BaseLLM = _cached(
+    OpenAIChat(model_name="gpt-3.5-turbo"), "gpt-3.5-turbo", max_batch_size=1
+)
+large_chat_engine: BaseLLM = _cached(
+    OpenAIChat(model_name="gpt-4"), "gpt-4", max_batch_size=1
+)
+
+# picks the cheapest adequate engine per call: decisions and summaries go to a model
+# a quarter of the price of gpt-3.5-turbo (the engine agents used before routing),
+# and are redone on gpt-3.5-turbo only if the answer looks unsure. Everything else
+# stays on gpt-3.5-turbo, so routing never costs more than one cheap call over it
+COSTS_PER_1K_TOKENS = {
+    "text-babbage-001": 0.0005,
+    "text-curie-001": 0.002,
+    "text-davinci-003": 0.02,
+    "gpt-3.5-turbo": 0.002,
+    "gpt-4": 0.06,
+}
+router = ModelRouter(
+    engines={
+        "text-babbage-001": tiny_completion_engine,
+        "gpt-3.5-turbo": small_chat_engine,
+    },
+    rules={
+        CallKind.DECISION: "text-babbage-001",
+        CallKind.SUMMARY: "text-babbage-001",
+        CallKind.LONG_FORM: "gpt-3.5-turbo",
+    },
+    fallback="gpt-3.5-turbo",
+    costs=COSTS_PER_1K_TOKENS,
+)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+from enum import Enum
+import re
+import threading
+import time
+from typing import Callable
+
+import attr
+
+
+class CallKind(Enum):
+    DECISION = "decision"  # yes/no questions, eg "Are you ready to move on?"
+    SUMMARY = "summary"
+    LONG_FORM = "long_form"
+
+
+_call_kind = contextvars.ContextVar("call_kind", default=None)
+
+
+@contextlib.contextmanager
+def call_kind(kind: CallKind):
+    """Routes the engine calls made inside the block as `kind`, instead of guessing
+    it from the prompt.
+
+    >>> with call_kind(CallKind.DECISION):
+    ...     evaluator("Are you ready to move on to the next step?")
+    """
+    token = _call_kind.set(kind)
+    try:
+        yield
+    finally:
+        _call_kind.reset(token)
+
+
+@attr.s
+class Usage:
+    calls: int = attr.ib(default=0)
+    # estimated at ~4 characters per token
+    prompt_tokens: int = attr.ib(default=0)
+    completion_tokens: int = attr.ib(default=0)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+_usage = contextvars.ContextVar("usage", default=())
+
+
+@contextlib.contextmanager
+def track_usage():
+    """Counts the routed engine calls made inside the block (and nested blocks) on
+    this thread or context.
+
+    >>> with track_usage() as usage:
+    ...     engineer("Please write the code for the parser component:")
+    >>> usage.total_tokens
+    """
+    usage = Usage()
+    token = _usage.set((*_usage.get(), usage))
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+_DECISION = re.compile(
+    r"^\s*(are|is|am|was|were|do|does|did|can|could|should|would|will|has|have|had)\b"
+    r"[^?]*\?\s*$",
+    re.IGNORECASE,
+)
+_SUMMARY = re.compile(
+    r"\b(summari[sz]e|summary|tl;?dr|in (one|a few) sentences?)\b", re.IGNORECASE
+)
+_YES_NO = re.compile(r"^\W*(yes|no|y|n|true|false)\b", re.IGNORECASE)
+
+
+def classify(prompt: str) -> CallKind:
+    """Guesses the kind of call from the last line of the prompt."""
+    lines = prompt.strip().splitlines()
+    last_line = lines[-1] if lines else ""
+    if _DECISION.match(last_line):
+        return CallKind.DECISION
+    if _SUMMARY.search(last_line):
+        return CallKind.SUMMARY
+    return CallKind.LONG_FORM
+
+
+def default_confidence(kind: CallKind, prompt: str, response: str) -> float:
+    """How sure we are that a cheap engine's `response` is adequate, in [0, 1]."""
+    if not response or not response.strip():
+        return 0.0
+    if kind == CallKind.DECISION:
+        return 1.0 if _YES_NO.match(response) else 0.0
+    if kind == CallKind.SUMMARY:
+        return 1.0 if len(response) < len(prompt) else 0.5
+    return 1.0
+
+
+@attr.s
+class RouterStats:
+    calls: dict[str, int] = attr.ib(factory=dict)  # {engine name: calls}
+    seconds: dict[str, float] = attr.ib(factory=dict)  # {engine name: total latency}
+    kinds: dict[CallKind, int] = attr.ib(factory=dict)
+    escalations: int = attr.ib(default=0)  # low-confidence answers redone by fallback
+    cost: float = attr.ib(default=0.0)
+    # what the same calls would have cost on the baseline engine, without routing
+    baseline_cost: float = attr.ib(default=0.0)
+
+    @property
+    def saved_cost(self) -> float:
+        return self.baseline_cost - self.cost
+
+    def mean_latency(self, engine_name: str) -> float | None:
+        calls = self.calls.get(engine_name)
+        return self.seconds[engine_name] / calls if calls else None
+
+
+class ModelRouter:
+    """Sends each call to the cheapest engine that is adequate for its kind.
+
+    `rules` maps each `CallKind` to the name of an engine in `engines`. The kind is
+    taken from `call_kind(...)` if set, else guessed from the prompt with `classify`.
+    If `confidence(kind, prompt, response)` is below `min_confidence`, the call is
+    redone on the `fallback` engine. `costs` (per 1k tokens, by engine name) are used
+    to estimate the savings in `stats`, against sending every call to `baseline` (the
+    engine used before routing; the fallback by default).
+    """
+
+    def __init__(
+        self,
+        engines: dict[str, Callable],
+        rules: dict[CallKind, str],
+        fallback: str,
+        costs: dict[str, float] = None,
+        confidence: Callable[[CallKind, str, str], float] = default_confidence,
+        min_confidence: float = 0.5,
+        baseline: str = None,
+    ):
+        assert fallback in engines, f"ModelRouter: unknown fallback engine {fallback}."
+        baseline = baseline or fallback
+        assert baseline in engines, f"ModelRouter: unknown baseline engine {baseline}."
+        self.engines = engines
+        self.rules = rules
+        self.fallback = fallback
+        self.baseline = baseline
+        self.costs = costs or {}
+        self.confidence = confidence
+        self.min_confidence = min_confidence
+        self.stats = RouterStats()
+        self._lock = threading.Lock()
+
+    @property
+    def accepts_prefix(self) -> bool:
+        """Whether every engine takes a `prefix` (see `CachedEngine`)."""
+        return all(getattr(e, "accepts_prefix", False) for e in self.engines.values())
+
+    def route(self, prompt: str, kind: CallKind = None) -> tuple[CallKind, str]:
+        kind = kind or _call_kind.get() or classify(prompt)
+        return kind, self.rules.get(kind, self.fallback)
+
+    def __call__(
+        self, prompt: str, stop: list[str] = None, kind: CallKind = None, **kwargs
+    ):
+        kind, engine_name = self.route(prompt, kind)
+        response = self._call(engine_name, prompt, stop, **kwargs)
+        if (
+            engine_name != self.fallback
+            and self.confidence(kind, prompt, response) < self.min_confidence
+        ):
+            with self._lock:
+                self.stats.escalations += 1
+            response = self._call(self.fallback, prompt, stop, **kwargs)
+        with self._lock:
+            self.stats.kinds[kind] = self.stats.kinds.get(kind, 0) + 1
+            self.stats.baseline_cost += self._cost(self.baseline, prompt, response)
+        return response
+
+    def _call(self, engine_name: str, prompt: str, stop: list[str], **kwargs) -> str:
+        start = time.monotonic()
+        response = self.engines[engine_name](prompt, stop=stop, **kwargs)
+        with self._lock:
+            stats = self.stats
+            stats.calls[engine_name] = stats.calls.get(engine_name, 0) + 1
+            stats.seconds[engine_name] = (
+                stats.seconds.get(engine_name, 0.0) + time.monotonic() - start
+            )
+            stats.cost += self._cost(engine_name, prompt, response)
+            for usage in _usage.get():
+                usage.calls += 1
+                usage.prompt_tokens += len(prompt) // 4
+                usage.completion_tokens += len(response or "") // 4
+        return response
+
+    def _cost(self, engine_name: str, prompt: str, response: str) -> float:
+        # ~4 characters per token
+        tokens = (len(prompt) + len(response or "")) / 4
+        return tokens / 1000 * self.costs.get(engine_name, 0.0)
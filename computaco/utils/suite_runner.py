@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import threading
+import time
+
+import attr
+
+_UNITTEST = [sys.executable, "-m", "unittest"]
+_DISCOVER = [*_UNITTEST, "discover", "-t", "."]
+# prints the id of every test `_DISCOVER` would run, one per line
+_LIST_TESTS = """
+import unittest
+
+def ids(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from ids(test)
+        else:
+            yield test.id()
+
+for id in ids(unittest.defaultTestLoader.discover(".", top_level_dir=".")):
+    print(id)
+"""
+
+
+@attr.s
+class TestSuite:
+    name: str = attr.ib()
+    cwd: Path = attr.ib(converter=Path)
+    # the files and directories whose contents decide the result, eg the tests and
+    # the code they test; `cwd` if empty
+    inputs: list[Path] = attr.ib(factory=list)
+    command: list[str] = attr.ib(factory=lambda: list(_DISCOVER))
+    env: dict[str, str] = attr.ib(factory=dict)  # eg, {"PYTHONPATH": ...}
+    # processes the tests are split over (with the default command only); as many as
+    # the runner runs at once if None
+    shards: int = attr.ib(default=None)
+
+
+@attr.s
+class TestResult:
+    suite: str = attr.ib()
+    exit_code: int = attr.ib()  # -1 if the run timed out
+    duration: float = attr.ib()
+    stdout: str = attr.ib()
+    stderr: str = attr.ib()
+    cached: bool = attr.ib(default=False)
+
+    @property
+    def passed(self) -> bool:
+        return self.exit_code == 0
+
+    @property
+    def output(self) -> str:
+        return "\n".join(text for text in (self.stdout, self.stderr) if text)
+
+
+@attr.s
+class TestRunnerStats:
+    runs: int = attr.ib(default=0)
+    cache_hits: int = attr.ib(default=0)
+    seconds: float = attr.ib(default=0.0)  # summed over runs; wall time is less
+
+
+class TestRunner:
+    """Runs test suites in separate subprocesses, up to one per CPU core at a time.
+
+    Each run gets its own process and working directory, so suites can't see each
+    other's output or state, and returns a `TestResult`. Suites with the default
+    (unittest) command are split into `shards` processes by test, so one large suite
+    also uses every core. Passing runs are cached by a hash of the suite's command
+    and input files: until those change, the suite isn't run again. Failures are
+    always rerun, since they may be flaky.
+
+    >>> runner = TestRunner(cache_dir=project.datapath / "test_cache")
+    >>> suite = TestSuite("parser", tests_path / "parser", [tests_path, code_path])
+    >>> runner.run(suite).passed
+    """
+
+    DEFAULT_TIMEOUT = 600
+
+    def __init__(
+        self,
+        cache_dir: Path = None,
+        max_workers: int = None,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.timeout = timeout
+        self.max_workers = max_workers or os.cpu_count()
+        self.stats = TestRunnerStats()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # bounds the test processes across suites and shards; suites only wait on them
+        self._processes = threading.BoundedSemaphore(self.max_workers)
+
+    def submit(self, suite: TestSuite) -> Future[TestResult]:
+        return self._executor.submit(self._run, suite)
+
+    def run(self, suite: TestSuite) -> TestResult:
+        return self.submit(suite).result()
+
+    def run_all(self, suites: list[TestSuite]) -> dict[str, TestResult]:
+        futures = {suite.name: self.submit(suite) for suite in suites}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _run(self, suite: TestSuite) -> TestResult:
+        key = self.key(suite)
+        result = self._load(key)
+        if result is not None:
+            with self._lock:
+                self.stats.cache_hits += 1
+            return result
+
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1", **suite.env}
+        start = time.monotonic()
+        commands = self._shard(suite, env)
+        if len(commands) == 1:
+            exit_code, stdout, stderr = self._process(commands[0], suite.cwd, env)
+        else:
+            with ThreadPoolExecutor(max_workers=len(commands)) as shards:
+                outputs = list(
+                    shards.map(
+                        lambda command: self._process(command, suite.cwd, env), commands
+                    )
+                )
+            exit_code = next((code for code, _, _ in outputs if code != 0), 0)
+            stdout = "\n".join(out for _, out, _ in outputs if out)
+            stderr = "\n".join(err for _, _, err in outputs if err)
+        result = TestResult(
+            suite.name, exit_code, time.monotonic() - start, stdout, stderr
+        )
+        with self._lock:
+            self.stats.runs += 1
+            self.stats.seconds += result.duration
+        if result.passed:
+            self._save(key, result)
+        return result
+
+    def _process(self, command: list[str], cwd: Path, env: dict) -> tuple[int, str, str]:
+        with self._processes:
+            try:
+                process = subprocess.run(
+                    command,
+                    cwd=cwd,
+                    env=env,
+                    stdin=subprocess.DEVNULL,
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout,
+                )
+            except subprocess.TimeoutExpired as e:
+                stderr = _text(e.stderr) + f"\nTimed out after {self.timeout}s."
+                return -1, _text(e.stdout), stderr
+        return process.returncode, process.stdout, process.stderr
+
+    def _shard(self, suite: TestSuite, env: dict) -> list[list[str]]:
+        """The commands to run `suite` with: one per shard, each running a run of
+        consecutive tests (so a test class's setup is mostly shared)."""
+        shards = self.max_workers if suite.shards is None else suite.shards
+        if shards <= 1 or suite.command != _DISCOVER:
+            return [suite.command]
+        exit_code, stdout, _ = self._process(
+            [sys.executable, "-c", _LIST_TESTS], suite.cwd, env
+        )
+        ids = stdout.split()
+        # tests that failed to load are reported by the whole suite's run
+        if exit_code != 0 or len(ids) < 2 or any(i.startswith("unittest.") for i in ids):
+            return [suite.command]
+        shards = min(shards, len(ids))
+        size, extra = divmod(len(ids), shards)
+        commands, start = [], 0
+        for index in range(shards):
+            stop = start + size + (index < extra)
+            commands.append([*_UNITTEST, *ids[start:stop]])
+            start = stop
+        return commands
+
+    @staticmethod
+    def key(suite: TestSuite) -> str:
+        """Hashes the command, environment and every input file's path and contents."""
+        digest = hashlib.sha256(json.dumps([suite.command, suite.env]).encode())
+        for root in suite.inputs or [suite.cwd]:
+            root = Path(root)
+            files = sorted(root.rglob("*")) if root.is_dir() else [root]
+            for file in files:
+                if not file.is_file() or "__pycache__" in file.parts:
+                    continue
+                digest.update(str(file.relative_to(root.parent)).encode() + b"\0")
+                digest.update(file.read_bytes() + b"\0")
+        return digest.hexdigest()
+
+    def _load(self, key: str) -> TestResult | None:
+        if self.cache_dir is None or not (self.cache_dir / f"{key}.json").exists():
+            return None
+        with open(self.cache_dir / f"{key}.json") as f:
+            return TestResult(**{**json.load(f), "cached": True})
+
+    def _save(self, key: str, result: TestResult):
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temporary = self.cache_dir / f"{key}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(attr.asdict(result), f)
+        os.replace(temporary, self.cache_dir / f"{key}.json")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _text(output: bytes | str | None) -> str:
+    if isinstance(output, bytes):
+        return output.decode(errors="replace")
+    return output or ""
@@ -10,7 +10,7 @@ class ConversationAgent(Agent):
     engine: ConversationEngine | CompletionEngine
     _messages: Conversation
 
-    DEFAULT_ENGINE = registry.small_chat_engine
+    DEFAULT_ENGINE = registry.router
     DEFAULT_SYSTEM_PROMPT = "You are {name}."
 
     def __init__(self, name, initial_message=None, engine=None):
@@ -1,42 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
 import json
 import logging
 from pathlib import Path
 import pickle
 from threading import Lock
+from typing import Callable, Literal
 import attr
+import tensorcode as tc
 from datetime import datetime
 from computaco.abstractions.converts import Markdown
 from computaco.abstractions.types import Audio, Image, Text, Video
 
 import IPython.display
 from computaco.abstractions.environment import Environment
+from computaco.abstractions.streaming import TextStream
 import ipywidgets
 import imageio
 import soundfile as sf
 
+from computaco.utils.blob_store import BlobStore
+from computaco.utils.compact import SENDERS, offload, to_epoch_us, from_epoch_us, unload
 from computaco.utils.logging import make_logger
+from computaco.utils.message_log import MessageLog
+from computaco.utils.rate_limit import Priority, priority
+from computaco.utils.router import CallKind, call_kind
 from computaco.utils import english
 from computaco.utils import consts
 from computaco.abstractions import abilities
 from computaco.agents.agent import Agent
+from computaco.processes.kernels.computaco import checkpoint
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class Message(Markdown):
-    sender: str
-    timestamp: datetime = attr.ib(default=datetime.now())
+    # stored compactly (interned sender id, epoch microseconds); read via properties
+    _sender: int = attr.ib(converter=SENDERS.intern)
+    _timestamp: int = attr.ib(factory=datetime.now, converter=to_epoch_us)
+
+    @property
+    def sender(self) -> str:
+        return SENDERS[self._sender]
+
+    @property
+    def timestamp(self) -> datetime:
+        return from_epoch_us(self._timestamp)
+
+    def offload(self, store: BlobStore):
+        """Moves large payloads (media) into `store`; they're then loaded on access."""
+
+    def to_record(self) -> tuple[dict, bytes]:
+        """Splits the message into a json header and a binary payload for `MessageLog`.
+        Anything an export needs goes in the header, so exports never unpickle."""
+        header = {
+            "type": type(self).__name__,
+            "sender": str(self.sender),
+            "timestamp": self.timestamp.isoformat(),
+            "markdown": self.markdown,
+            **self._header_fields(),
+        }
+        payload = self._payload()
+        return header, b"" if payload is None else pickle.dumps(payload)
+
+    @staticmethod
+    def from_record(header: dict, payload: bytes) -> Message:
+        message_type = MESSAGE_TYPES[header["type"]]
+        return message_type._from_record(
+            header, pickle.loads(payload) if payload else None
+        )
 
-    def save(self, path: Path):
-        # make directory if it doesn't exist
-        path.mkdir(path, parents=True, exist_ok=True)
-        # save pickle
-        with path.open(path / "pickle.pkl", "wb") as f:
-            pickle.dump(self, f)
+    def _header_fields(self) -> dict:
+        return {}
+
+    def _payload(self):
+        return None
 
     @classmethod
-    def load(cls, path: Path):
-        with path.open(path / "pickle.pkl", "rb") as f:
-            return pickle.load(f)
+    def _from_record(cls, header: dict, payload):
+        return cls(
+            sender=header["sender"],
+            timestamp=datetime.fromisoformat(header["timestamp"]),
+        )
 
     @property
     def name(self):
@@ -53,19 +101,27 @@ class Message(Markdown):
         return f"{self.__class__.__name__}({self.sender})"
 
 
+@attr.s(auto_attribs=True, slots=True)
 class MultipleMessages(Message):
     messages: list[Message] = attr.ib(factory=list)
 
-    def save(self, path: Path):
+    def offload(self, store: BlobStore):
         for m in self.messages:
-            m.save(path / m.name)
-        super().save(path)
+            m.offload(store)
 
-    def load(self, path: Path):
-        super().load(path)
-        # not used since the pickle already contains all the messages
-        # for m in path.iterdir():
-        #     self.messages.append(Message.load(m))
+    def _header_fields(self) -> dict:
+        return {"messages": [m.to_record()[0] for m in self.messages]}
+
+    def _payload(self):
+        return [m.to_record()[1] for m in self.messages]
+
+    @classmethod
+    def _from_record(cls, header: dict, payload):
+        message = super()._from_record(header, payload)
+        message.messages = [
+            Message.from_record(h, p) for h, p in zip(header["messages"], payload)
+        ]
+        return message
 
     @property
     def name(self):
@@ -83,16 +139,20 @@ class MultipleMessages(Message):
 
 
 class TextMessage(Message):
+    __slots__ = ("text",)
     text: str
 
     def __init__(self, sender, text, timestamp=None):
-        super().__init__(sender=sender, timestamp=timestamp)
+        super().__init__(sender=sender, timestamp=timestamp or datetime.now())
         self.text = text
 
-    def save(self, path: Path):
-        super().save(path)
-        with path.open(path / "text.txt", encoding="w") as f:
-            f.write(self.text)
+    def _header_fields(self) -> dict:
+        return {"text": self.text}
+
+    @classmethod
+    def _from_record(cls, header: dict, payload):
+        timestamp = datetime.fromisoformat(header["timestamp"])
+        return cls(header["sender"], header["text"], timestamp=timestamp)
 
     @property
     def markdown(self) -> str:
@@ -103,8 +163,7 @@ class TextMessage(Message):
 
 
 class FileAssetMessage(TextMessage):
-    def save(self, path: Path):
-        super().save(path)
+    def export_asset(self, path: Path):
         fullpath = self._save(path)
         if self.text == "[Image]":
             caption = ""
@@ -120,11 +179,26 @@ class FileAssetMessage(TextMessage):
 
 
 class ImageMessage(TextMessage):
-    image: Image
+    __slots__ = ("_image",)
 
     def __init__(self, sender, image, text="[Image]", timestamp=None):
         super().__init__(sender=sender, timestamp=timestamp, text=text)
-        self.image = image
+        self._image = image
+
+    @property
+    def image(self) -> Image:
+        return unload(self._image)
+
+    def offload(self, store: BlobStore):
+        self._image = offload(self._image, store)
+
+    def _payload(self):
+        return self._image  # a small `BlobRef` once offloaded
+
+    @classmethod
+    def _from_record(cls, header: dict, payload):
+        timestamp = datetime.fromisoformat(header["timestamp"])
+        return cls(header["sender"], payload, text=header["text"], timestamp=timestamp)
 
     def _save(self, path: Path):
         fullpath = path / "image.png"
@@ -133,11 +207,26 @@ class ImageMessage(TextMessage):
 
 
 class AudioMessage(TextMessage):
-    audio: Audio
+    __slots__ = ("_audio",)
 
     def __init__(self, sender, audio, text="[Audio]", timestamp=None):
         super().__init__(sender=sender, timestamp=timestamp, text=text)
-        self.audio = audio
+        self._audio = audio
+
+    @property
+    def audio(self) -> Audio:
+        return unload(self._audio)
+
+    def offload(self, store: BlobStore):
+        self._audio = offload(self._audio, store)
+
+    def _payload(self):
+        return self._audio  # a small `BlobRef` once offloaded
+
+    @classmethod
+    def _from_record(cls, header: dict, payload):
+        timestamp = datetime.fromisoformat(header["timestamp"])
+        return cls(header["sender"], payload, text=header["text"], timestamp=timestamp)
 
     def _save(self, path: Path):
         fullpath = path / "audio.wav"
@@ -146,11 +235,26 @@ class AudioMessage(TextMessage):
 
 
 class VideoMessage(TextMessage):
-    video: Video
+    __slots__ = ("_video",)
 
     def __init__(self, sender, video, text="[Video]", timestamp=None):
         super().__init__(sender=sender, timestamp=timestamp, text=text)
-        self.video = video
+        self._video = video
+
+    @property
+    def video(self) -> Video:
+        return unload(self._video)
+
+    def offload(self, store: BlobStore):
+        self._video = offload(self._video, store)
+
+    def _payload(self):
+        return self._video  # a small `BlobRef` once offloaded
+
+    @classmethod
+    def _from_record(cls, header: dict, payload):
+        timestamp = datetime.fromisoformat(header["timestamp"])
+        return cls(header["sender"], payload, text=header["text"], timestamp=timestamp)
 
     def _save(self, path: Path):
         fullpath = path / "video.mp4"
@@ -158,6 +262,20 @@ class VideoMessage(TextMessage):
         return fullpath
 
 
+MESSAGE_TYPES: dict[str, type[Message]] = {
+    message_type.__name__: message_type
+    for message_type in [
+        Message,
+        MultipleMessages,
+        TextMessage,
+        FileAssetMessage,
+        ImageMessage,
+        AudioMessage,
+        VideoMessage,
+    ]
+}
+
+
 class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
     speakers: list[Agent]
     bystanders: list[Agent]
@@ -170,17 +288,26 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
         bystanders=[],
         initial_message=None,
         final_message=None,
+        turn_policy: Callable[[list[Agent]], list[Agent]] = None,
+        max_workers=8,
     ):
+        self.path = Path(path)
         self.speakers = speakers
         self.bystanders = bystanders
+        # orders the speakers of each concurrent step (`astep`); speaker order by default
+        self.turn_policy = turn_policy or list
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
         self._evaluators = []
         self._initial_message = initial_message
         self._final_message = final_message
         self.messages = []
+        self._log = None
         self.initialize()
         super().__init__(path, speakers + bystanders)
 
-    def input(self, message: str | Message | None, *args, remember=True, **kwargs):
+    def input(
+        self, message: str | Message | TextStream | None, *args, remember=True, **kwargs
+    ):
         # TODO: support string input
         self._logger.info(f"Message sent: {message}")
         if message is None:
@@ -191,10 +318,36 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
                 "Conversation.input called with remember=False. Ignoring message and returning."
             )
             return
+        if isinstance(message, TextStream):
+            return self._input_stream(message)
+
+        if isinstance(message, Message):
+            message.offload(self._blobs)
+        self._save_delta(message)
+        self.messages.append(message)
+        for agent in set(self.agents) | set(self._evaluators):
+            agent.input(message)
 
+    def _input_stream(self, stream: TextStream):
+        """Hands `stream` to listeners that take streams as soon as it starts, and
+        records (and delivers to everyone else) the complete message once it ends."""
+        listeners = set(self.agents) | set(self._evaluators)
+        streaming = {
+            agent
+            for agent in listeners
+            if isinstance(agent, abilities.HandlesTextStreamInput)
+            and agent is not stream.sender
+        }
+        for agent in streaming:
+            self._executor.submit(agent.input_stream, stream)
+
+        message = TextMessage(stream.sender, stream.result())
+        if stream.ttft is not None:
+            self._logger.info(f"{stream.sender}: first chunk after {stream.ttft:.3f}s")
+        message.offload(self._blobs)
         self._save_delta(message)
         self.messages.append(message)
-        for agent in set(self.agents) + set(self._evaluators):
+        for agent in listeners - streaming:
             agent.input(message)
 
     @property
@@ -203,18 +356,83 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
 
     def step(self):
         for speaker in self.speakers:
-            self.input(speaker.output())
+            checkpoint()  # lets the kernel stop a cancelled process between turns
+            # speakers that can stream are heard while they are still talking
+            if isinstance(speaker, abilities.HandlesTextStreamOutput):
+                self.input(speaker.output_stream())
+            else:
+                self.input(speaker.output())
+
+    async def astep(self, max_turns: int = None):
+        """Concurrent version of `step`.
+
+        Speakers draft their utterances at the same time on the worker pool. The
+        utterances are then added in `turn_policy` order, regardless of which finished
+        first. If `max_turns` is set, only that many non-empty utterances are kept:
+        that many speakers draft at first, and the next speaker in line starts only
+        when a draft comes back empty, so no engine call is made for a turn that
+        can't be taken. If a draft fails, the drafts that haven't started are
+        cancelled, the running ones are waited for, and the error is raised.
+        """
+        speakers = iter(self.turn_policy(list(self.speakers)))
+
+        def draft(speaker):
+            return self._executor.submit(speaker.output, remember=False)
+
+        drafts = deque(
+            draft(speaker) for speaker in itertools.islice(speakers, max_turns)
+        )
+        utterances = []
+        try:
+            while drafts:
+                utterance = await asyncio.wrap_future(drafts[0])
+                drafts.popleft()
+                if utterance is not None:
+                    utterances.append(utterance)
+                elif (speaker := next(speakers, None)) is not None:
+                    drafts.append(draft(speaker))
+        except BaseException:
+            running = [d for d in drafts if not d.cancel()]
+            await asyncio.gather(
+                *(asyncio.wrap_future(d) for d in running), return_exceptions=True
+            )
+            raise
+        for utterance in utterances:
+            await self.ainput(utterance)
+
+    async def ainput(self, message: str | Message | None):
+        """Like `input`, but delivers `message` to all agents concurrently."""
+        if message is None:
+            return
+        self._logger.info(f"Message sent: {message}")
+        if isinstance(message, Message):
+            message.offload(self._blobs)
+        self._save_delta(message)
+        self.messages.append(message)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self._executor, agent.input, message)
+                for agent in set(self.agents) | set(self._evaluators)
+            )
+        )
 
     def converse(self, rounds=5):
         for _ in range(rounds):
             self.step()
 
+    async def aconverse(self, rounds=5, max_turns: int = None):
+        for _ in range(rounds):
+            await self.astep(max_turns=max_turns)
+
     def converse_until_done(
         self,
         is_done_message=None,
         evaluators=None,
         evaluators_and_queries: list[tuple[Agent | list[Agent], str | Message]] = None,
         num_steps=10,
+        quorum: Literal["any", "all", "majority"] = "any",
+        check_every=1,
     ):
         assert not (
             evaluators_and_queries is not None
@@ -232,19 +450,54 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
             else:
                 _evaluators_and_queries.append((e, query))
 
-        self._evaluators = [e[0] for e in evaluators_and_queries]
+        self._evaluators = [e[0] for e in _evaluators_and_queries]
 
-        for _ in range(num_steps):
+        for step in range(1, num_steps + 1):
             self.step()
 
-            # Check if each agent has made a decision
-            for evaluator, query in evaluators_and_queries:
-                if tc.decide(evaluator(query, remember=False)):
-                    break
+            # Skipping checks trades a few extra steps for fewer evaluator queries
+            if step % check_every == 0 and self._is_done(_evaluators_and_queries, quorum):
+                break
         # else:
         #     raise RuntimeError("Conversation.converse_until_done: No decision reached.")
         self._evaluators = []
 
+    def _is_done(
+        self,
+        evaluators_and_queries: list[tuple[Agent, str | Message]],
+        quorum: Literal["any", "all", "majority"],
+    ) -> bool:
+        """Asks all evaluators at once and stops waiting as soon as `quorum` is
+        decided either way, cancelling the queries that haven't started yet."""
+        num_votes = len(evaluators_and_queries)
+        needed = {"any": 1, "all": num_votes, "majority": num_votes // 2 + 1}[quorum]
+
+        def vote(evaluator, query):
+            # evaluators are background work; they yield to user-facing agents, and
+            # their yes/no answers are routed to a small engine
+            with priority(Priority.BACKGROUND), call_kind(CallKind.DECISION):
+                return tc.decide(evaluator(query, remember=False))
+
+        votes = [
+            self._executor.submit(vote, evaluator, query)
+            for evaluator, query in evaluators_and_queries
+        ]
+        yes = no = 0
+        try:
+            for ballot in as_completed(votes):
+                if ballot.result():
+                    yes += 1
+                else:
+                    no += 1
+                if yes >= needed:
+                    return True
+                if no > num_votes - needed:
+                    return False
+            return False
+        finally:
+            for ballot in votes:
+                ballot.cancel()
+
     def join(self, *agents: list[Agent]):
         self.remove_bystanders(*agents)
         super().join(agents)
@@ -279,24 +532,60 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
                 )
                 self.bystanders.remove(bystander)
 
+    def branch(self, name: str, speakers: list[Agent] = None) -> Conversation:
+        """A side conversation, stored under this one, that can run concurrently with
+        it. `speakers` default to this conversation's; see `merge`. A branch of the
+        same name from an earlier run (eg, one being resumed) is left alone, and the
+        new one is stored next to it."""
+        path, version = self.path / "branches" / name, 1
+        while path.exists():
+            path, version = self.path / "branches" / f"{name}.{version}", version + 1
+        return Conversation(
+            path,
+            speakers=list(self.speakers if speakers is None else speakers),
+            bystanders=[],
+            turn_policy=self.turn_policy,
+        )
+
+    def merge(self, branch: Conversation):
+        """Adds `branch`'s messages to this transcript as one message, delivered to the
+        agents that weren't in the branch (the others heard it already)."""
+        if not branch.messages:
+            return
+        message = MultipleMessages(branch.path.name, messages=list(branch.messages))
+        message.offload(self._blobs)
+        self._save_delta(message)
+        self.messages.append(message)
+        for agent in (set(self.agents) | set(self._evaluators)) - set(branch.agents):
+            agent.input(message)
+        branch.close()
+
     def name(self):
         return str(self.path)
 
     def _save_delta(self, *messages: list[Message]):
         for message in messages:
-            # write to file
-            message.save(self.path / message.name)
-            self._md_file.write(f"\n{message}\n")
+            self._log.append(*message.to_record())
 
     def save(self):
-        with open(self.path / "conversation.pkl", "wb") as f:
-            pickle.dump(self, f)
+        self._log.flush()
 
     @classmethod
-    def load(self, path: Path):
-        # load from pickle
-        with open(path / "conversation.pkl", "rb") as f:
-            return pickle.load(f)
+    def load(cls, path: Path, speakers=[], bystanders=[]):
+        # messages are rebuilt from the log by `initialize`
+        return cls(path, speakers=speakers, bystanders=bystanders)
+
+    def export_markdown(self, path: Path):
+        with open(path, "w") as f:
+            for header in self._log.headers():
+                f.write(f"{header['markdown']}\n\n")
+
+    def export_json(self, path: Path):
+        with open(path, "w") as f:
+            f.write("[")
+            for i, header in enumerate(self._log.headers()):
+                f.write(("," if i else "") + json.dumps(header))
+            f.write("]")
 
     def to_string(self, include_timestamps: bool = False):
         return "\n".join(
@@ -311,16 +600,24 @@ class Conversation(Environment, abilities.HandlesAnyInput, Markdown):
         )
 
     def initialize(self):
-        # create dir at the path
-        self.path.mkdir(self.path, parents=True, exist_ok=False)
-        # open file at the path
-        self._md_file = open(self.path / "conversation.md", "a")
+        if self._log is not None:
+            return
+        self._log = MessageLog(self.path / "messages")
+        self._blobs = BlobStore(self.path / "blobs")
+        self.messages = [
+            Message.from_record(self._log.header(i), self._log.payload(i))
+            for i in range(len(self._log))
+        ]
 
     def close(self):
+        if self._log is None:
+            return
         if self._final_message:
             self.input(self._final_message)
-        self._md_file.close()
-        self.save()
+        # waits for the deliveries still running, which may still log messages
+        self._executor.shutdown(wait=True)
+        self._log.close()
+        self._log = None
 
     def __enter__(self):
         self.initialize()
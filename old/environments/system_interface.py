@@ -1,70 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+import os
+import re
 import subprocess
 from typing import Optional
 import threading
+import time
+import uuid
+
+import attr
+
 from computaco.abstractions.abilities import HandlesTextInputOutput
 from computaco.abstractions.environment import Environment
 from computaco.abstractions.types import Text
 
 
+@attr.s
+class CommandResult:
+    command: str = attr.ib()
+    output: str = attr.ib(default="")  # stdout and stderr, interleaved
+    exit_code: int = attr.ib(default=None)
+    started_at: float = attr.ib(factory=time.monotonic)
+    finished_at: float = attr.ib(default=None)
+
+    @property
+    def duration(self) -> float:
+        return self.finished_at - self.started_at
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exit_code == 0
+
+
 class SystemInterface(Environment, HandlesTextInputOutput):
+    """A shell session that agents send commands to.
+
+    Every command is followed by a line that echoes a sentinel and the command's exit
+    status, so the output of each command is known exactly and `run` (or `submit`)
+    returns it as soon as the command finishes. Agents are notified once per
+    command, with its whole output, from a separate thread, so reading the shell
+    never waits on agent code. `cmd` must be a POSIX shell.
+
+    Commands are passed to `eval` through a quoted heredoc, with stdin from
+    /dev/null, so an unclosed quote, a trailing backslash or a command that reads
+    stdin can't swallow the sentinel line; they still run in the session's shell,
+    so `cd` and variables persist. A command that exits the shell fails the
+    commands still pending.
+
+    >>> with SystemInterface(cwd=tests_path, project_path=project.path) as si:
+    ...     result = si.run("python -m unittest test_main.py")
+    ...     result.exit_code, result.output
+    """
+
     def __init__(self, cwd, project_path, agents=[], cmd="bash"):
-        super().__init__(project_path, agents)
-        self._logger.info(f"SystemInterface {self.name} created.")
+        super().__init__(project_path, agents=agents)
+        self._logger.info(f"SystemInterface for {cwd} created.")
         self.cwd = cwd
         self.process = None
         self.cmd = cmd
-        self.output_buffer = ""
+        self.output_thread = None
         self.output_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffer = ""  # output of the running command so far
+        self._scanned = 0  # how much of `_buffer` has no sentinel in it
+        self._pending: deque[tuple[int, CommandResult, Future]] = deque()
+        self._unread: list[Future] = []  # `input_text` commands for `output_text`
+        self._ids = itertools.count()
+        self._sentinel = f"__computaco_{uuid.uuid4().hex}_"
+        # the newline printed before the sentinel isn't part of the command's output
+        self._done = re.compile(rf"\n?{self._sentinel}(\d+) (\d+)\n")
+        self._notifier = None
 
     def __enter__(self):
         self.process = subprocess.Popen(
             self.cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             cwd=self.cwd,
-            text=True,
             bufsize=0,
         )
+        # one worker, so agents hear the commands in order
+        self._notifier = ThreadPoolExecutor(max_workers=1)
 
-        self.output_thread = threading.Thread(target=self._read_output)
+        self.output_thread = threading.Thread(target=self._read_output, daemon=True)
         self.output_thread.start()
 
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.process:
-            self.process.terminate()
-            self.process.wait()
-            self.process = None
+            self.process.stdin.close()  # the shell exits at the end of its input
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
 
         if self.output_thread:
             self.output_thread.join()
             self.output_thread = None
 
-    def input_text(self, text: Text, *args, sender="Info", remember=True, **kwargs):
+        if self._notifier:
+            self._notifier.shutdown(wait=True)
+            self._notifier = None
+        self.process = None
+
+    def submit(self, command: str) -> Future[CommandResult]:
+        """Sends `command` to the shell; the future resolves when it finishes."""
         if self.process is None:
             raise RuntimeError("SystemInterface process not running")
 
-        self.process.stdin.write(text)
-        self.process.stdin.flush()
+        command_id = next(self._ids)
+        future = Future()
+        framed = (
+            f"command eval \"$(cat <<'{self._sentinel}EOF'\n"
+            f"{command.rstrip()}\n"
+            f"{self._sentinel}EOF\n"
+            f')" < /dev/null\n'
+            f"printf '\\n{self._sentinel}{command_id} %s\\n' \"$?\"\n"
+        )
+        # never write while holding `output_lock`: the shell may be blocked on output
+        with self._write_lock:
+            with self.output_lock:
+                self._pending.append((command_id, CommandResult(command), future))
+            self.process.stdin.write(framed.encode())
+            self.process.stdin.flush()
+        return future
+
+    def run(self, command: str, timeout: float = None) -> CommandResult:
+        return self.submit(command).result(timeout)
+
+    async def arun(self, command: str) -> CommandResult:
+        return await asyncio.wrap_future(self.submit(command))
+
+    def input_text(self, text: Text, *args, sender="Info", remember=True, **kwargs):
+        future = self.submit(text)
+        with self.output_lock:
+            self._unread.append(future)
 
     def _read_output(self):
-        while self.process is not None:
-            output = self.process.stdout.readline()
-            if output:
-                with self.output_lock:
-                    self._notify_agents(output.strip())
-                    self.output_buffer += output
-            else:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        fd = self.process.stdout.fileno()
+        while True:
+            # whatever is available, not line by line
+            data = os.read(fd, 65536)
+            if not data:
                 break
+            with self.output_lock:
+                finished = self._parse(decoder.decode(data))
+            # outside the lock: callbacks and agents may take as long as they like
+            for result, future in finished:
+                future.set_result(result)
+                if result.output:
+                    self._notifier.submit(self._notify_agents, result.output)
+
+        with self.output_lock:
+            pending, self._pending = self._pending, deque()
+        for _, result, future in pending:
+            future.set_exception(
+                RuntimeError(f"SystemInterface process exited during {result.command!r}")
+            )
+
+    def _parse(self, text: str) -> list[tuple[CommandResult, Future]]:
+        self._buffer += text
+        finished = []
+        while self._pending:
+            # a sentinel line may have started in the part already scanned
+            start = max(0, self._scanned - len(self._sentinel) - 48)
+            match = self._done.search(self._buffer, start)
+            if match is None:
+                self._scanned = len(self._buffer)
+                break
+            # the shell runs commands in the order they were sent
+            _, result, future = self._pending.popleft()
+            result.output = self._buffer[: match.start()]
+            result.exit_code = int(match.group(2))
+            result.finished_at = time.monotonic()
+            self._buffer = self._buffer[match.end() :]
+            self._scanned = 0
+            finished.append((result, future))
+        return finished
 
     def _notify_agents(self, text: Text):
         for agent in self.agents:
             agent.input(text)
 
-    def output_text(self, *args, remember=True, **kwargs) -> Optional[Text]:
+    # seconds `output_text` waits for commands by default
+    DEFAULT_OUTPUT_TIMEOUT = 60.0
+
+    def output_text(
+        self, *args, remember=True, timeout=DEFAULT_OUTPUT_TIMEOUT, **kwargs
+    ) -> Optional[Text]:
+        """The output of the commands `input_text` sent since the last call, once they
+        have finished. Commands still running after `timeout` seconds are left for
+        the next call."""
+        with self.output_lock:
+            unread = list(self._unread)
+        futures.wait(unread, timeout=timeout)
+        done = []
         with self.output_lock:
-            output = self.output_buffer
-            self.output_buffer = ""
-            return output.strip() if output else None
+            for future in list(self._unread):
+                if future.done():
+                    done.append(future)
+                    self._unread.remove(future)
+        output = "\n".join(
+            future.result().output.rstrip("\n")
+            for future in done
+            if future.exception() is None
+        )
+        return output.strip() or None
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from computaco.abstractions.project import Project
+from computaco.utils.artifact_store import ArtifactStore, fingerprint
+
+
+class Named:
+    def __init__(self, name):
+        self.name = name
+
+    def fingerprint(self):
+        return {"name": self.name}
+
+
+def test_store_hit_and_miss(tmp_path):
+    store = ArtifactStore(tmp_path)
+    key = store.key("basic_info.md", prompt="hello", client=Named("client"))
+    assert store.get(key) is None
+    store.put(key, "basic_info.md", b"info")
+    assert store.get(key) == b"info"
+    assert (
+        store.get(store.key("basic_info.md", prompt="hello", client=Named("other")))
+        is None
+    )
+    assert (store.stats.hits, store.stats.misses) == (1, 2)
+    assert store.names() == {"basic_info.md": 1}
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    store = ArtifactStore(tmp_path, max_bytes=8)
+    store.put("a", "a", b"1234")
+    store.put("b", "b", b"1234")  # same contents, same blob
+    store.get("a")
+    store.put("c", "c", b"5678")
+    assert store.get("b") is None
+    assert store.get("a") == b"1234"  # its blob outlived "b"
+    assert store.get("c") == b"5678"
+    assert store.stats.evictions == 1
+
+
+def test_fingerprint_sets_are_ordered():
+    # sets of str iterate in a different order in every interpreter
+    code = (
+        "from computaco.utils.artifact_store import ArtifactStore;"
+        "print(ArtifactStore.key('x', names={'alice', 'bob', 'carol', 'dave'}))"
+    )
+    keys = {
+        subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        ).stdout
+        for seed in range(4)
+    }
+    assert len(keys) == 1
+
+
+def test_fingerprint_rejects_memory_addresses():
+    with pytest.raises(TypeError):
+        fingerprint(object())
+    assert fingerprint(Named("a")) == {"name": "a"}
+
+
+def test_project_artifact(tmp_path):
+    project = Project(tmp_path, checkpoint_interval=0)
+    calls = []
+
+    def make():
+        calls.append(1)
+        return {"components": ["parser"]}
+
+    path = project.datapath / "design_data.json"
+    try:
+        for _ in range(2):
+            result = project.artifact(path, make, group="documents", summary="s")
+            assert result == {"components": ["parser"]}
+        assert len(calls) == 1
+        project.artifact(path, make, group="documents", summary="changed")
+        assert len(calls) == 2
+        assert json.loads(path.read_text()) == {"components": ["parser"]}
+        assert project.files == {"documents": [".computaco/design_data.json"]}
+        project.checkpoint(wait=True)
+        assert not project.repo.ignored(".computaco/design_data.json")
+        assert project.repo.ignored(".computacode/artifacts/index.sqlite")
+    finally:
+        project.close()
@@ -0,0 +1,91 @@
+import pytest
+
+from computaco.agents.memory import ContextMemory
+from computaco.agents.prompt_cache import PromptCache
+from computaco.utils.llm_cache import MemoryCache, ResponseCache
+
+
+def test_prefix_is_reused_after_the_window_slides():
+    # no summaries, so only trimming can change the start of the context
+    memory = ContextMemory(
+        summarize=lambda text: "summary",
+        token_budget=100,
+        window_tokens=80,
+        chunk_size=10**6,
+    )
+    cache = PromptCache()
+    trims = extended = 0
+    previous = None
+    for i in range(200):
+        memory.add(f"message number {i}", sender="Agent")
+        parts = memory.context_parts()
+        cache.build("agent", "You are Agent.", parts)
+        assert memory.stats.context_tokens <= memory.token_budget
+        if previous is not None:
+            if parts[: len(previous)] == previous:
+                extended += 1
+            else:
+                trims += 1
+        previous = parts
+    # the window slid, and the budget filled up, many times over
+    assert memory.stats.history_tokens > 10 * memory.token_budget
+    assert trims > 0
+    # each trim frees `trim_tokens` (~6 messages), which are then only appended to
+    assert extended > 4 * trims
+    assert cache.stats.tokens_reused > 4 * cache.stats.tokens_rendered
+
+
+def test_summary_replaces_parts_in_place():
+    memory = ContextMemory(
+        summarize=lambda text: "summary",
+        token_budget=1000,
+        window_tokens=20,
+        chunk_size=2,
+    )
+    for i in range(10):
+        memory.add(f"message number {i}", sender="Agent")
+    memory.flush()
+    parts = memory.context_parts()
+    assert parts[0].startswith("[Summary]")
+    assert parts[-1] == "Agent: message number 9"
+    assert memory.stats.last_saved > 0
+
+
+def test_failed_summary_is_retried_in_place():
+    calls = []
+
+    def summarize(text):
+        calls.append(text)
+        if len(calls) == 2:
+            raise RuntimeError("unavailable")
+        return "(" + text.replace("\n", " ") + ")"
+
+    memory = ContextMemory(summarize, window_tokens=1, chunk_size=2, fanout=2)
+    for i in range(7):
+        memory.add(f"m{i}")
+    with pytest.raises(RuntimeError):
+        memory.flush()
+    memory.add("m7")
+    memory.flush()
+    assert memory.context_parts() == [
+        "[Summary] ((m0 m1) (m2 m3))",
+        "[Summary] (m4 m5)",
+        "m6",
+        "m7",
+    ]
+    assert memory.stats.failed_summaries == 1
+
+
+def test_cached_engine_keys_on_prefix():
+    calls = []
+
+    def engine(prompt, stop=None):
+        calls.append(prompt)
+        return "answer"
+
+    cached = ResponseCache(memory=MemoryCache()).wrap(engine, "model")
+    prompt = "You are Agent.\nhello\nAgent:"
+    assert cached(prompt, prefix=("abc", len("You are Agent.\nhello\n"))) == "answer"
+    assert cached(prompt, prefix=("abc", len("You are Agent.\nhello\n"))) == "answer"
+    cached(prompt, prefix=("def", len("You are Agent.\nhello\n")))
+    assert len(calls) == 2